@@ -0,0 +1,372 @@
+import os
+import sys
+sys.stdout.reconfigure(line_buffering=True) # Prevent buffering when running with nohup
+import json
+import copy
+import traceback
+import contextlib
+import multiprocessing as mp
+import multiprocessing.connection
+from pathlib import Path
+
+import benchmark_circuit
+from benchmark_circuit import DEFAULT_CONFIG, CSV_FIELDNAMES, parse_optional_args, write_csv_line, now
+from scheduler import Job, CostModel, Scheduler, FifoScheduler, circuit_features, load_history, parse_memory_budgets, simulate_makespan
+import runtime_model
+from results_store import new_run_id
+
+BATCH_CONFIG = {
+    **DEFAULT_CONFIG,
+    "circuit_list": "circuit_list.json",
+    "batch_results_file": "batch_results.csv",
+    "schedule": "cost",
+    "slot_memory_mb": "",
+    "predict": "0",
+}
+
+BATCH_FIELDNAMES = ["backend_index", "gpu_index", "status", "wall_time"] + CSV_FIELDNAMES
+
+def print_usage(config):
+    print("Usage:")
+    print(f"  {config['python_bin']} {Path(__file__).name} <backend_index> <gpu_index>[,<gpu_index>...] [--key=value ...]\n")
+    print("One worker process is started per GPU index. Repeat an index to run several workers on the same GPU.")
+    print("\nOptional config overrides:")
+    for key in BATCH_CONFIG:
+        print(f"  --{key}=<value> (default: {config[key]})")
+    sys.exit(1)
+
+def load_circuit_list(circuit_list_file):
+    try:
+        with open(circuit_list_file, 'r') as f:
+            circuit_list = json.load(f)
+    except FileNotFoundError:
+        print(f"Error: The file '{circuit_list_file}' was not found.")
+        sys.exit(1)
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON in '{circuit_list_file}': {e}")
+        sys.exit(1)
+
+    return [(item["name"], item.get("threshold")) for item in circuit_list]
+
+def parse_slots(backend_index, gpu_spec):
+    return [(backend_index, int(gpu_index)) for gpu_index in gpu_spec.split(",") if gpu_index != ""]
+
+def worker(slot, config, exp_data, conn, backend_factory):
+    """
+    Long-lived worker pinned to one backend/GPU slot.
+
+    The backend is opened once and reused for every circuit the parent sends.
+    Each circuit's console output goes to <results_path>/<circuit>.log.
+
+    Args:
+        slot (tuple): (backend_index, gpu_index) this worker is pinned to.
+        config (dict): Resolved configuration.
+        exp_data (dict): Pauli operators per circuit.
+        conn: Pipe end the worker receives (circuit_file_name, threshold) tasks on, terminated
+            by None, and reports progress and results on.
+        backend_factory (callable): Called as backend_factory(config, backend_index, gpu_index).
+    """
+    backend_index, gpu_index = slot
+    backend = backend_factory(config, backend_index, gpu_index)
+    conn.send(("ready", None, None, 0))
+
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+
+        circuit_name, threshold = task
+        # Pipe sends are synchronous, so the parent knows the running circuit even if this process crashes
+        conn.send(("started", circuit_name, None, 0))
+
+        log_file = Path(config['results_path']) / f"{Path(circuit_name).stem}.log"
+        start_time = now()
+        try:
+            with open(log_file, "w") as log, contextlib.redirect_stdout(log):
+                row = benchmark_circuit.run_circuit(config, backend, backend_index, circuit_name, threshold, exp_data)
+            conn.send(("done", circuit_name, row, now() - start_time))
+        except (Exception, SystemExit):
+            conn.send(("failed", circuit_name, traceback.format_exc(), now() - start_time))
+
+    conn.close()
+
+def run_batch(config, slots, circuits, exp_data, backend_factory=benchmark_circuit.open_backend, scheduler=None):
+    """
+    Runs circuits on a pool of persistent worker processes, one per slot.
+
+    Whenever a worker is idle, scheduler picks its next circuit. Results are yielded as soon
+    as a worker reports them. A worker that dies is replaced, and the circuit it was running
+    is reported as failed.
+
+    Args:
+        config (dict): Resolved configuration.
+        slots (list): (backend_index, gpu_index) per worker.
+        circuits (list): (circuit_file_name, threshold) to run.
+        exp_data (dict): Pauli operators per circuit.
+        backend_factory (callable): Opens the backend for a slot. Replace it to run against a stub backend.
+        scheduler (scheduler.Scheduler, optional): Places the circuits on the slots. Defaults to list order.
+
+    Yields:
+        tuple: (status, slot, circuit_name, row_or_error, wall_time) with status 'done' or 'failed'.
+    """
+    if scheduler is None:
+        scheduler = FifoScheduler([Job(name, threshold, None) for name, threshold in circuits], slots, None)
+
+    remaining = len(circuits)
+    for job in scheduler.unschedulable():
+        remaining -= 1
+        yield ("failed", (None, None), job.circuit_name, f"Expected state size of {scheduler.model.expected_memory(job):.4g} MB exceeds the memory budget of every slot", 0)
+
+    ctx = mp.get_context("spawn")
+
+    def start_worker(slot):
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(target=worker, args=(slot, config, exp_data, child_conn, backend_factory), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    workers = {index: start_worker(slot) for index, slot in enumerate(slots)} if remaining > 0 else {}
+    ready = set()
+    idle = set()
+    running = {}
+
+    def dispatch():
+        for index in sorted(idle):
+            job = scheduler.next_job(index)
+            if job is not None:
+                idle.discard(index)
+                running[index] = job.circuit_name
+                workers[index][1].send((job.circuit_name, job.threshold))
+            elif not scheduler.pending:
+                idle.discard(index)
+                workers[index][1].send(None)
+
+    while remaining > 0 and workers:
+        waitables = {}
+        for index, (process, conn) in workers.items():
+            waitables[conn] = index
+            waitables[process.sentinel] = index
+
+        for item in mp.connection.wait(list(waitables)):
+            index = waitables[item]
+            if index not in workers:
+                continue
+            process, conn = workers[index]
+            slot = slots[index]
+            # Checked before draining, so everything a dead worker sent is read before it is cleaned up
+            alive = process.is_alive()
+
+            try:
+                while conn.poll():
+                    status, circuit_name, payload, wall_time = conn.recv()
+                    if status == "ready":
+                        ready.add(index)
+                        idle.add(index)
+                        print(f"Worker for backend {slot[0]} / GPU {slot[1]} is ready")
+                    elif status == "started":
+                        running[index] = circuit_name
+                    else:
+                        running.pop(index, None)
+                        remaining -= 1
+                        final_state_memory = payload.get("final_state_memory") if status == "done" else None
+                        scheduler.finished(index, wall_time, final_state_memory)
+                        idle.add(index)
+                        yield (status, slot, circuit_name, payload, wall_time)
+            except EOFError:
+                pass
+
+            if alive:
+                continue
+
+            process.join()
+            conn.close()
+            del workers[index]
+            idle.discard(index)
+            circuit_name = running.pop(index, None)
+            if circuit_name is not None:
+                remaining -= 1
+                scheduler.finished(index, 0)
+                yield ("failed", slot, circuit_name, f"Worker process exited with code {process.exitcode}", 0)
+
+            # A worker that never got ready cannot open its backend, so it is not restarted
+            if process.exitcode != 0 and index in ready and remaining > 0:
+                ready.discard(index)
+                workers[index] = start_worker(slot)
+
+        dispatch()
+
+        # Circuits that only fit the memory budget of a slot whose worker is gone
+        if scheduler.pending and not running and workers and idle == set(workers):
+            for job in list(scheduler.pending):
+                scheduler.pending.remove(job)
+                remaining -= 1
+                yield ("failed", (None, None), job.circuit_name, "No running slot has the memory budget for this circuit", 0)
+            dispatch()
+
+    if remaining > 0:
+        print(f"Error: All batch workers exited with {remaining} circuits still pending.")
+
+    for process, conn in workers.values():
+        try:
+            conn.send(None)
+        except OSError:
+            pass
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+
+def build_scheduler(config, slots, circuits, memory_budgets):
+    """
+    Builds the scheduler of a batch: list order with --schedule=fifo, otherwise cost-aware
+    placement from static circuit features and the results of earlier runs in results_path.
+    Circuits that are already transpiled are estimated by the runtime model (see runtime_model.py)
+    when one can be loaded or trained.
+    """
+    if config['schedule'] == "fifo":
+        return FifoScheduler([Job(name, threshold, None) for name, threshold in circuits], slots, None)
+
+    predictor = runtime_model.load_model(config, {Path(name).stem: threshold for name, threshold in circuits})
+
+    jobs = []
+    for circuit_name, threshold in circuits:
+        try:
+            circuit_file = runtime_model.transpiled_circuit_file(config['transpiled_circuit_path'], Path(circuit_name).stem)
+            if predictor is not None and circuit_file is not None:
+                features = runtime_model.circuit_file_features(circuit_file, threshold)
+            else:
+                features = circuit_features(config, circuit_name, threshold)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: Could not read the features of {circuit_name} ({e}), it is scheduled last.")
+            features = {"num_qubits": 0, "one_qubit_gates": 0, "two_qubit_gates": 0, "threshold": 0}
+        jobs.append(Job(circuit_name, threshold, features))
+
+    history = load_history(config['results_path']) if os.path.isdir(config['results_path']) else {}
+    model = CostModel(history, predictor)
+    model.calibrate(jobs)
+
+    known = sum(job.stripped_circuit_name in history for job in jobs)
+    cost_makespan = simulate_makespan(Scheduler(jobs, slots, copy.deepcopy(model), memory_budgets), model, {})
+    fifo_makespan = simulate_makespan(FifoScheduler(jobs, slots, None), model, {})
+    print(f"Cost estimates: {known} of {len(jobs)} circuits from earlier results, the others from their gate counts")
+    print(f"Expected makespan: {cost_makespan:.1f}s (in list order: {fifo_makespan:.1f}s)")
+
+    return Scheduler(jobs, slots, model, memory_budgets)
+
+def predict_batch(config, slots, circuits, memory_budgets):
+    """
+    Dry run of --predict: prints the predicted state preparation time, state size and wall time of
+    every transpiled circuit, whether it is admitted under the memory budgets, and the timeout
+    its state preparation gets with step_timeout_factor (or the default factor).
+    """
+    model = runtime_model.load_model(config, {Path(name).stem: threshold for name, threshold in circuits})
+    if model is None:
+        print("Error: No prediction_model and not enough earlier results in results_path to train one.")
+        sys.exit(1)
+
+    budgets = [float(config['memory_budget_mb'])] if config['memory_budget_mb'] else []
+    if memory_budgets and all(budget is not None for budget in memory_budgets.values()):
+        budgets.append(max(memory_budgets.values()))
+    budget = min(budgets) if budgets else None
+    factor = float(config['step_timeout_factor']) or runtime_model.STEP_TIMEOUT_FACTOR
+
+    print(f"Predictions of a model trained on {model.rows} runs" + (f", memory budget {budget:g} MB" if budget is not None else ""))
+    total_time = 0
+    rejected = 0
+    for circuit_name, threshold in circuits:
+        stripped_circuit_name = Path(circuit_name).stem
+        circuit_file = runtime_model.transpiled_circuit_file(config['transpiled_circuit_path'], stripped_circuit_name)
+        if circuit_file is None:
+            print(f"  {stripped_circuit_name}: not transpiled yet, no prediction")
+            continue
+        features = runtime_model.circuit_file_features(circuit_file, threshold)
+        prediction = model.predict(features)
+        admitted = budget is None or prediction['final_state_memory'] <= budget
+        if admitted:
+            total_time += prediction['wall_time']
+        else:
+            rejected += 1
+        print(f"  {stripped_circuit_name}: threshold {features['threshold']}, {features['num_qubits']} qubits, {features['two_qubit_gates']} two-qubit gates, "
+              f"depth {features['depth']}, cut width {features['cut_width']} -> state preparation {prediction['simulation_time']:.2f}s "
+              f"(timeout {runtime_model.step_timeout(prediction['simulation_time'], factor):.0f}s), state {prediction['final_state_memory']:.1f} MB, "
+              f"wall time {prediction['wall_time']:.2f}s" + ("" if admitted else ", REJECTED: exceeds the memory budget"))
+
+    print(f"Predicted total wall time of the admitted circuits: {total_time:.1f}s on one worker ({rejected} rejected)")
+
+def main():
+    config = BATCH_CONFIG.copy()
+
+    positional_args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    optional_args = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+    config = parse_optional_args(config, optional_args)
+
+    if len(positional_args) < 2:
+        print("Error: Missing required arguments.\n")
+        print_usage(config)
+
+    benchmark_circuit.validate_config(config, print_usage)
+
+    try:
+        backend_index = int(positional_args[0])
+        slots = parse_slots(backend_index, positional_args[1])
+    except ValueError:
+        print("Error: Backend index and GPU indices must be integers.\n")
+        print_usage(config)
+
+    if not slots:
+        print("Error: At least one GPU index is required.\n")
+        print_usage(config)
+
+    available = benchmark_circuit.list_circuit_files(config['pytket_circuit_path'])
+    circuits = []
+    for name, threshold in load_circuit_list(config['circuit_list']):
+        circuit_name = f"{name}.json"
+        if circuit_name not in available:
+            print(f"Warning: Circuit file '{circuit_name}' not found in {config['pytket_circuit_path']}, skipping.")
+            continue
+        circuits.append((circuit_name, threshold))
+
+    try:
+        memory_budgets = parse_memory_budgets(config['slot_memory_mb'], slots)
+    except ValueError:
+        print("Error: slot_memory_mb must be a number or gpu_index:MB pairs.\n")
+        print_usage(config)
+
+    if config['schedule'] not in ("cost", "fifo"):
+        print("Error: schedule must be 'cost' or 'fifo'.\n")
+        print_usage(config)
+
+    if config['predict'] != "0":
+        predict_batch(config, slots, circuits, memory_budgets)
+        return
+
+    exp_data = benchmark_circuit.load_exp_data(config['json_file'])
+
+    # All circuits of a batch are one run in the results store
+    config['run_id'] = config['run_id'] or new_run_id()
+
+    scheduler = build_scheduler(config, slots, circuits, memory_budgets)
+
+    os.makedirs(config['results_path'], exist_ok=True)
+    batch_results_file = Path(config['results_path']) / config['batch_results_file']
+    write_csv_line(batch_results_file, BATCH_FIELDNAMES, mode='w')
+
+    print(f"Running {len(circuits)} circuits on {len(slots)} workers as run {config['run_id']}")
+
+    failed = 0
+    for status, slot, circuit_name, payload, wall_time in run_batch(config, slots, circuits, exp_data, scheduler=scheduler):
+        if status == "done":
+            print(f"[backend {slot[0]} / GPU {slot[1]}] {circuit_name}: done in {wall_time:.2f}s, mirror fidelity {payload['mirror_fidelity']}")
+            write_csv_line(batch_results_file, [slot[0], slot[1], status, wall_time] + [payload[key] for key in CSV_FIELDNAMES])
+        else:
+            failed += 1
+            print(f"[backend {slot[0]} / GPU {slot[1]}] {circuit_name}: failed\n{payload}")
+            write_csv_line(batch_results_file, [slot[0], slot[1], status, wall_time, Path(circuit_name).stem] + [""] * (len(CSV_FIELDNAMES) - 1))
+
+    print(f"Batch finished: {len(circuits) - failed} succeeded, {failed} failed. Summary written to {batch_results_file}")
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,6 @@ print(python_version())
 import os
 import sys
 sys.stdout.reconfigure(line_buffering=True) # Prevent buffering when running with nohup
-import QuantumRingsLib
-from QuantumRingsLib import QuantumRegister, AncillaRegister, ClassicalRegister, QuantumCircuit
-from QuantumRingsLib import QuantumRingsProvider
-from QuantumRingsLib import job_monitor
-from QuantumRingsLib import JobStatus
-from QuantumRingsLib import OptimizeQuantumCircuit
-from matplotlib import pyplot as plt
 import numpy as np
 import math
 import time
@@ -18,6 +11,23 @@ import json
 import csv
 from pathlib import Path
 import subprocess
+import shutil
+import threading
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client
+import gate_ir
+from gate_ir import read_gate_file, write_dagger_gate_file
+from qasm_dagger import write_dagger_qasm
+from tracing import Tracer
+from timing_stats import summarize, outlier_mask, STAT_FIELDNAMES
+from shot_stream import ShotWriter, ShotAccumulator, read_shot_chunks, read_shot_rows
+from xeb_fidelity import estimate_fidelity, sample_indices
+from pauli_expectation import PauliTable, ExpectationMemo, evaluate_expectations, qwc_groups, memory_to_bits, estimate_from_bits
+from transpile_cache import TranspileCache, transpile_cache_key, qasm_gate_counts, file_digest
+from checkpoint import RunCheckpoint, run_key
+from results_store import record_result, new_run_id
+from runtime_model import RuntimeModel, circuit_file_features, transpiled_circuit_file, step_timeout
 
 DEFAULT_CONFIG = {
     "system_state_path": None,
@@ -31,8 +41,77 @@ DEFAULT_CONFIG = {
     "email":None,
     "python_bin": "python",
     "transpile_script": "transpile_pytket.py",
+    "transpile_preset": "light",
+    "transpile_server": "",
+    "transpile_server_timeout": "600",
+    "generate_dagger": "auto",
+    "circuit_format": "gates",
+    "qasm_export": "0",
+    "expectation_workers": "1",
+    "expectation_memo": "0",
+    "expectation_mode": "exact",
+    "expectation_shots": "1000",
+    "shots": "100",
+    "shot_chunk_size": "100000",
+    "shots_format": "packed",
+    "shot_histogram_limit": "65536",
+    "fidelity_method": "mirror",
+    "fidelity_samples": "100",
+    "fidelity_reference_threshold": "",
+    "state_handoff": "memory",
+    "state_handoff_path": "",
+    "state_checkpoint": "1",
+    "resume": "0",
+    "checkpoint_path": "",
+    "trace": "1",
+    "repeat": "1",
+    "warmup": "0",
+    "transpile_cache": "1",
+    "transpile_cache_path": "",
+    "transpile_cache_size_mb": "2048",
+    "prediction_model": "",
+    "memory_budget_mb": "",
+    "step_timeout_factor": "0",
+    "results_store": "1",
+    "results_db": "",
+    "run_id": "",
+    "backend_cache": "~/.cache/quantum_rings/backends.json",
+    "import_profile": "0",
 }
 
+# Options that must be integers, checked before the SDK is imported
+INT_OPTIONS = ["expectation_workers", "expectation_shots", "shots", "shot_chunk_size", "shot_histogram_limit", "fidelity_samples", "repeat", "warmup", "transpile_cache_size_mb", "transpile_server_timeout"]
+
+# QuantumRingsLib is only imported by load_sdk, when a backend is opened or a circuit is run,
+# so printing the usage and validating the arguments never pay for it
+QuantumRingsLib = None
+
+def load_sdk(module=None):
+    """
+    Imports QuantumRingsLib, or installs module in its place, and binds the SDK names this module uses.
+
+    Args:
+        module (optional): Object with the QuantumRingsLib names, e.g. a stub backend module.
+
+    Returns:
+        The SDK module.
+    """
+    global QuantumRingsLib, QuantumRegister, ClassicalRegister, QuantumCircuit, QuantumRingsProvider, job_monitor, OptimizeQuantumCircuit
+    if module is None:
+        if QuantumRingsLib is not None:
+            return QuantumRingsLib
+        import QuantumRingsLib as module
+    QuantumRingsLib = module
+    QuantumRegister = module.QuantumRegister
+    ClassicalRegister = module.ClassicalRegister
+    QuantumCircuit = module.QuantumCircuit
+    QuantumRingsProvider = module.QuantumRingsProvider
+    job_monitor = module.job_monitor
+    OptimizeQuantumCircuit = module.OptimizeQuantumCircuit
+    return module
+
+CSV_FIELDNAMES = ["circuit_name", "mirror_fidelity", "fidelity_estimate", "total_runtime", "simulation_time", "preprocessing_time", "shot_time", "expectation_value_time", "other_time", "final_state_memory", "shots_per_second", "checkpoint_time", "threshold", "transpile_preset", "fidelity_estimate_time", "expectation_memo_hits"]
+
 def list_circuit_files(circuit_path):
     try:
         return [f for f in os.listdir(circuit_path) if f.endswith(".json")]
@@ -40,15 +119,15 @@ def list_circuit_files(circuit_path):
         return []
 
 def print_usage(config):
-    dummy_provider = QuantumRingsProvider()
-    backends = dummy_provider.backends()
-    print(backends)
-
     print("Usage:")
     print(f"  {config['python_bin']} {Path(__file__).name} <backend_index> <circuit_file_name> <gpu_index> [threshold] [--key=value ...]\n")
-    print("Available Backends:")
-    for i, b in enumerate(backends):
-        print(f"  {i}: {b}")
+    backends = cached_backends(config)
+    if backends is None:
+        print("Available Backends: (not listed yet, they are cached after the first login)")
+    else:
+        print("Available Backends:")
+        for i, b in enumerate(backends):
+            print(f"  {i}: {b}")
     print("\nAvailable Circuit Files:")
     for f in list_circuit_files(config['pytket_circuit_path']):
         print(f"  {f}")
@@ -61,10 +140,15 @@ def parse_optional_args(config, args):
     for arg in args:
         if arg.startswith("--"):
             key_value = arg[2:].split("=", 1)
-            if len(key_value) == 2 and key_value[0] in config:
+            key_value[0] = key_value[0].replace("-", "_")
+            if len(key_value) == 1 and key_value[0] in config:
+                # A bare --flag turns a 0/1 option on
+                config[key_value[0]] = "1"
+            elif len(key_value) == 2 and key_value[0] in config:
                 config[key_value[0]] = key_value[1]
             else:
-                print(f"Warning: Ignored unknown or malformed option '{arg}'")
+                print(f"Error: Unknown or malformed option '{arg}'")
+                sys.exit(1)
     return config
 
 def write_csv_line(filename, row, mode='a'):
@@ -81,31 +165,121 @@ def write_csv_line(filename, row, mode='a'):
         writer = csv.writer(csvfile)
         writer.writerow(row)
 
-def save_partial_results(state_dir, circuit_name, data):
-    filename = Path(state_dir) / f"{circuit_name}_partial_results.json"
-    with open(filename, "w") as f:
-        json.dump(data, f, indent=2)
+def load_exp_data(json_file):
+    try:
+        with open(json_file, 'r') as f:
+            exp_data = json.load(f)
+        print("JSON data loaded successfully.")
 
-def load_partial_results(state_dir, circuit_name):
-    filename = Path(state_dir) / f"{circuit_name}_partial_results.json"
-    if not filename.exists():
-        return None  # No saved state
-    with open(filename, "r") as f:
-        return json.load(f)
+    except FileNotFoundError:
+        print(f"Error: The file '{json_file}' was not found.")
+        sys.exit(1)
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON in '{json_file}': {e}")
+        sys.exit(1)
 
-def setup():
-    if len(sys.argv) < 4:
-        print("Error: Missing required arguments.\n")
-        print_usage(DEFAULT_CONFIG)
+    return exp_data
 
-    config = DEFAULT_CONFIG.copy()
+def open_backend(config, backend_index, gpu_index):
+    """
+    Logs in to QuantumRings and returns the backend for one backend/GPU slot.
 
-    # Split args
-    positional_args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
-    optional_args = [arg for arg in sys.argv[1:] if arg.startswith("--")]
-    config = parse_optional_args(config, optional_args)
+    Args:
+        config (dict): Configuration holding the account token and email.
+        backend_index (int): Index into provider.backends().
+        gpu_index (int): GPU the backend is pinned to.
+    """
+    load_sdk()
+    provider = QuantumRingsProvider(token=config["token"], name=config["email"])
+    backends = provider.backends()
+    cache_backends(config, backends)
+    if not 0 <= backend_index < len(backends):
+        print(f"Error: Invalid backend index {backend_index}, the account has {len(backends)} backends.")
+        sys.exit(1)
+    backend = provider.get_backend(backends[backend_index], gpu=gpu_index)
 
-    # Validate that all required config keys are defined
+    print("Account Name: ", provider.active_account()["name"], "\nMax Qubits: ", provider.active_account()["max_qubits"])
+
+    return backend
+
+def backend_cache_file(config):
+    return Path(os.path.expanduser(config['backend_cache'])) if config['backend_cache'] else None
+
+def cached_backends(config):
+    """
+    The backend names of the account in config as cached by its last login, or None. Without an
+    email in config, the list of the only cached account is used.
+    """
+    cache_file = backend_cache_file(config)
+    try:
+        with open(cache_file, "r") as f:
+            cache = json.load(f)
+    except (TypeError, OSError, ValueError):
+        return None
+    if config['email'] is None and len(cache) == 1:
+        return next(iter(cache.values()))
+    return cache.get(config['email'] or "")
+
+def cache_backends(config, backends):
+    cache_file = backend_cache_file(config)
+    if cache_file is None:
+        return
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(cache_file, "r") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        cache[config['email'] or ""] = [str(b) for b in backends]
+        temp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        print(f"Warning: Could not cache the backend list in {cache_file}: {e}")
+
+def import_profile():
+    """
+    Prints the import time of this script and of QuantumRingsLib, measured with python -X importtime
+    in a fresh interpreter: every top-level import, and the direct imports of this script.
+    """
+    script = f"import sys; sys.path.insert(0, {str(Path(__file__).parent)!r}); import benchmark_circuit; benchmark_circuit.load_sdk()"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Error: Importing the script failed:\n{result.stderr.splitlines()[-1] if result.stderr else ''}")
+
+    modules = []
+    children = []
+    script_imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # importtime indents nested imports by two spaces per level and lists them before their importer
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entry = (int(cumulative) / 1e6, name.strip())
+        if depth == 1:
+            children.append(entry)
+        elif depth == 0:
+            modules.append(entry)
+            if entry[1] == "benchmark_circuit":
+                script_imports = children
+            children = []
+
+    total = sum(t for t, _ in modules)
+    print(f"Import time: {total:.3f}s")
+    for t, name in sorted(modules, reverse=True):
+        if t >= 0.001:
+            print(f"  {t:8.3f}s  {t / total if total else 0:6.1%}  {name}")
+    print("Direct imports of benchmark_circuit:")
+    for t, name in sorted(script_imports, reverse=True)[:15]:
+        print(f"  {t:8.3f}s  {t / total if total else 0:6.1%}  {name}")
+
+def validate_config(config, print_usage=print_usage):
+    """Checks the required keys, integer options and input paths of config, without importing the SDK."""
     missing_keys = [key for key, val in config.items() if val is None and key != "python_bin"]
     if missing_keys:
         print("Error: Missing required config values.\n")
@@ -114,13 +288,50 @@ def setup():
         print("")
         print_usage(config)
 
-    provider = QuantumRingsProvider(token=config["token"], name=config["email"])
-    backends = provider.backends()
+    for key in INT_OPTIONS:
+        try:
+            int(config[key])
+        except ValueError:
+            print(f"Error: --{key} must be an integer, got '{config[key]}'.\n")
+            print_usage(config)
+
+    for key in ("pytket_circuit_path", "system_state_path", "results_path"):
+        if not os.path.isdir(config[key]):
+            print(f"Error: {key} '{config[key]}' is not a directory.\n")
+            print_usage(config)
+
+    if not os.path.exists(config['transpile_script']):
+        print(f"Error: transpile_script '{config['transpile_script']}' not found.\n")
+        print_usage(config)
 
-    # Parse backend index
+    if config['fidelity_reference_threshold'] and not config['fidelity_reference_threshold'].isdigit():
+        print(f"Error: --fidelity_reference_threshold must be an integer, got '{config['fidelity_reference_threshold']}'.\n")
+        print_usage(config)
+
+def setup():
+    config = DEFAULT_CONFIG.copy()
+
+    # Split args
+    positional_args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    optional_args = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+    config = parse_optional_args(config, optional_args)
+
+    if config['import_profile'] != "0":
+        import_profile()
+        sys.exit(0)
+
+    if len(positional_args) < 3:
+        print("Error: Missing required arguments.\n")
+        print_usage(config)
+
+    # Validate that all required config keys are defined
+    validate_config(config)
+
+    # Parse backend index; without a cached backend list it is checked after the login
+    backends = cached_backends(config)
     try:
         backend_index = int(positional_args[0])
-        backend = backends[backend_index]
+        backend = backends[backend_index] if backends is not None else backend_index
     except (ValueError, IndexError):
         print("Error: Invalid backend index.\n")
         print_usage(config)
@@ -158,122 +369,703 @@ def setup():
 
     dagger_circuit_name = os.path.join(config['pytket_dagger_path'], circuit_name)
     if not os.path.exists(dagger_circuit_name):
-        print(f"Dagger Circuit {dagger_circuit_name} is not existing. We will not be able to calculate Mirror Fidelity")
+        if config['generate_dagger'] == "never":
+            print(f"Dagger Circuit {dagger_circuit_name} is not existing. We will not be able to calculate Mirror Fidelity")
+        else:
+            print(f"Dagger Circuit {dagger_circuit_name} is not existing. It will be generated from the transpiled circuit")
 
-    try:
-        with open(config['json_file'], 'r') as f:
-            exp_data = json.load(f)
-        print("JSON data loaded successfully.")
+    exp_data = load_exp_data(config['json_file'])
 
-    except FileNotFoundError:
-        print(f"Error: The file '{config['json_file']}' was not found.")
-        sys.exit(1)
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON in '{config['json_file']}': {e}")
-        sys.exit(1)
+    return config, backend_index, circuit_name, gpu_index, threshold, exp_data
+
+def transpile_formats(config):
+    """Returns the file formats STEP 0 writes: the binary gate list and/or QASM."""
+    if config['circuit_format'] == "qasm":
+        return ["qasm"]
+    if config['qasm_export'] != "0":
+        return ["gates", "qasm"]
+    return ["gates"]
+
+def transpiled_files(config, stripped_circuit_name, dest_path):
+    return {fmt: Path(dest_path) / f"{stripped_circuit_name}.{fmt}" for fmt in transpile_formats(config)}
+
+def transpiled_gate_counts(output_files):
+    if "gates" in output_files:
+        _, gates = read_gate_file(output_files["gates"])
+        return gate_ir.gate_counts(gates)
+    return qasm_gate_counts(output_files["qasm"])
+
+def request_transpile(socket_path, circuit_name, source_path, dest_path, formats, preset, timeout):
+    """
+    Sends one transpile request to the transpile server and waits for its answer.
+
+    The server runs in its own working directory, so the folders are sent as absolute paths.
+
+    Raises:
+        TimeoutError: If the server does not answer within timeout seconds.
+    """
+    with Client(socket_path, family="AF_UNIX") as conn:
+        conn.send_bytes(json.dumps({"circuit_name": circuit_name, "source_folder": os.path.abspath(source_path), "dest_folder": os.path.abspath(dest_path), "formats": formats, "preset": preset}).encode())
+        if not conn.poll(timeout):
+            raise TimeoutError(f"no answer within {timeout}s")
+        return json.loads(conn.recv_bytes())
+
+def run_transpile(config, stripped_circuit_name, source_path, dest_path):
+    """
+    Transpiles one circuit, either on the transpile server or in an isolated subprocess.
+
+    Returns:
+        dict: returncode, stdout and stderr of the transpile.
+    """
+    if config['transpile_server']:
+        try:
+            return request_transpile(config['transpile_server'], stripped_circuit_name, source_path, dest_path, transpile_formats(config),
+                                     config['transpile_preset'], int(config['transpile_server_timeout']))
+        except TimeoutError as e:
+            # The server may still finish and write the same files; both write them atomically
+            print(f"Warning: Transpile server at {config['transpile_server']} did not answer ({e}), falling back to a subprocess.")
+        except (OSError, EOFError) as e:
+            print(f"Warning: Transpile server at {config['transpile_server']} is not reachable ({e}), falling back to a subprocess.")
+
+    # Scripts written for the original interface take just the three positional arguments and
+    # write QASM with the default passes, so the options are only passed when they change that
+    formats = transpile_formats(config)
+    options = []
+    if formats != ["qasm"]:
+        options.append("--format=" + ("both" if len(formats) > 1 else formats[0]))
+    if config['transpile_preset'] != DEFAULT_CONFIG['transpile_preset']:
+        options.append("--preset=" + config['transpile_preset'])
+    transpile_result = subprocess.run([
+            config['python_bin'], 
+            config['transpile_script'],
+            stripped_circuit_name,
+            source_path,
+            dest_path,
+        ] + options, capture_output=True, text=True)
+    return {"returncode": transpile_result.returncode, "stdout": transpile_result.stdout, "stderr": transpile_result.stderr}
+
+def transpile_circuits(config, stripped_circuit_name, jobs):
+    """
+    Transpiles <source_path>/<name>.json to <dest_path>/<name>.gates (and/or .qasm) for every (source_path, dest_path) in jobs.
+
+    When the transpile cache is enabled, a cached transpile for the same input, pass pipeline and
+    transpiler versions is copied instead. The remaining jobs are transpiled concurrently.
+
+    Returns:
+        tuple: (gate counts, pass report or None) of each transpiled circuit, in the order of jobs.
+    """
+    cache = None
+    if config['transpile_cache'] != "0":
+        cache_dir = config['transpile_cache_path'] or Path(config['system_state_path']) / "transpile_cache"
+        cache = TranspileCache(cache_dir, config['transpile_cache_size_mb'])
+
+    gate_counts = [None] * len(jobs)
+    pass_reports = [None] * len(jobs)
+    keys = [None] * len(jobs)
+    pending = []
+    for i, (source_path, dest_path) in enumerate(jobs):
+        json_file = Path(source_path) / f"{stripped_circuit_name}.json"
+        if cache is not None:
+            keys[i] = transpile_cache_key(json_file, config['transpile_script'], config['python_bin'], transpile_formats(config), config['transpile_preset'])
+            meta = cache.get(keys[i], transpiled_files(config, stripped_circuit_name, dest_path))
+            if meta is not None:
+                print(f"Transpile cache hit for {json_file} ({keys[i][:16]})")
+                gate_counts[i] = meta["gate_counts"]
+                pass_reports[i] = meta.get("passes")
+                continue
+        pending.append(i)
+
+    with ThreadPoolExecutor(max_workers=max(len(pending), 1)) as executor:
+        results = list(executor.map(lambda i: run_transpile(config, stripped_circuit_name, *jobs[i]), pending))
+
+    for i, transpile_result in zip(pending, results):
+        print(f"Isolated script output:\n{transpile_result['stdout']}")
+        if(transpile_result['stderr']):
+            print(f"Isolated script errors:\n{transpile_result['stderr']}")
+
+        if transpile_result['returncode'] != 0:
+            print("Error: Transpilation subprocess failed.")
+            sys.exit(1)
+
+        output_files = transpiled_files(config, stripped_circuit_name, jobs[i][1])
+        gate_counts[i] = transpiled_gate_counts(output_files)
+        # A custom transpile_script may not write a pass report
+        report_file = Path(jobs[i][1]) / f"{stripped_circuit_name}.passes.json"
+        if report_file.exists():
+            with open(report_file, "r") as f:
+                pass_reports[i] = json.load(f)["passes"]
+        if cache is not None:
+            cache.put(keys[i], output_files, stripped_circuit_name, gate_counts[i], pass_reports[i])
+
+    return gate_counts, pass_reports
+
+def build_quantum_circuit(gate_file):
+    """
+    Builds a QuantumRingsLib circuit directly from a gate_ir file, without going through QASM.
+
+    Returns:
+        tuple: (QuantumCircuit, gate counts)
+    """
+    header, gates = read_gate_file(gate_file)
+
+    qr = QuantumRegister(header["num_qubits"], "q")
+    if header["num_clbits"]:
+        cr = ClassicalRegister(header["num_clbits"], "c")
+        qc = QuantumCircuit(qr, cr)
+    else:
+        qc = QuantumCircuit(qr)
+
+    u3, cx, h, x, measure = (gate_ir.OPCODE[name] for name in ("u3", "cx", "h", "x", "measure"))
+    for opcode, q0, q1, params in zip(gates["opcode"].tolist(), gates["q0"].tolist(), gates["q1"].tolist(), gates["params"].tolist()):
+        if opcode == u3:
+            qc.u3(params[0], params[1], params[2], q0)
+        elif opcode == cx:
+            qc.cx(q0, q1)
+        elif opcode == h:
+            qc.h(q0)
+        elif opcode == x:
+            qc.x(q0)
+        elif opcode == measure:
+            qc.measure(q0, q1)
+
+    return qc, gate_ir.gate_counts(gates)
+
+def load_circuit(config, circuit_path, stripped_circuit_name):
+    """
+    Loads a transpiled circuit from its gate file, or from its QASM file when circuit_format is qasm.
+
+    Returns:
+        tuple: (QuantumCircuit, gate counts)
+    """
+    if config['circuit_format'] == "qasm":
+        qc = QuantumCircuit.from_qasm_file(str(Path(circuit_path) / f"{stripped_circuit_name}.qasm"))
+        return qc, qc.count_ops()
+    return build_quantum_circuit(Path(circuit_path) / f"{stripped_circuit_name}.gates")
+
+def transpiled_circuit_exists(config, circuit_path, stripped_circuit_name):
+    suffix = "qasm" if config['circuit_format'] == "qasm" else "gates"
+    return (Path(circuit_path) / f"{stripped_circuit_name}.{suffix}").exists()
+
+def run_job(backend, qc, shots, threshold):
+    """Runs qc synchronously with the custom threshold, or with balancedAccuracy if threshold is None, and returns the finished job."""
+    if threshold is not None:
+        job = backend.run(qc, shots=shots, mode="sync", generate_amplitude = False, quiet=True, performance="custom", threshold=threshold)
+    else:
+        job = backend.run(qc, shots=shots, mode="sync", performance = "balancedAccuracy", generate_amplitude = False, quiet=True)
+
+    job_monitor(job, quiet=True)
+    return job
+
+def sample_expectations(backend, system_state_file, table, shots, threshold):
+    """
+    Estimates the expectation values of table from samples instead of exact evaluation.
+
+    The operators are split into qubit-wise commuting groups. Each group costs one sampled
+    run of the saved state with one basis-rotation layer (h for X, sdg then h for Y), and
+    every operator of the group is estimated from the same bitstrings.
+
+    Returns:
+        tuple: (estimates, standard errors, group index), one entry per operator of table.
+               Identity operators are 1 with no error and group -1.
+    """
+    codes = table.unique_codes()
+    num_unique = len(codes)
+    estimates = np.ones(num_unique)
+    std_errors = np.zeros(num_unique)
+    groups = np.full(num_unique, -1)
+
+    for group, (basis, rows) in enumerate(qwc_groups(table)):
+        start_time = now()
+
+        qc = QuantumCircuit(simulation_state_file = system_state_file)
+        for qubit in np.nonzero(basis == 1)[0].tolist():
+            qc.h(qubit)
+        for qubit in np.nonzero(basis == 3)[0].tolist():
+            qc.sdg(qubit)
+            qc.h(qubit)
+        qc.measure_all()
+
+        job = run_job(backend, qc, shots, threshold)
+        bits = memory_to_bits(job.result().get_memory(), table.num_qubits)
+        estimates[rows], std_errors[rows] = estimate_from_bits(bits, codes[rows])
+        groups[rows] = group
+
+        print(f"Group {group}: {len(rows)} operators, {shots} shots, {now() - start_time} seconds")
 
-    return config, provider, backends, backend_index, circuit_name, gpu_index, threshold, exp_data
+    return estimates[table.inverse].tolist(), std_errors[table.inverse].tolist(), groups[table.inverse].tolist()
+
+def outcome_probabilities(backend, system_state_file, outcomes, threshold):
+    """
+    Probability of each outcome in the saved state, one backend run per outcome.
+
+    X gates on the qubits that are 1 map the outcome to all zeros, and get_fidelity() of the
+    run is taken as the probability of all zeros, as for the mirror circuit of STEP 6.
+    estimate_fidelity checks that the results are probabilities.
+
+    Args:
+        outcomes (np.ndarray): (outcomes, num_qubits) 0/1 values, column k holding qubit k.
+    """
+    probabilities = []
+    for outcome in outcomes:
+        qc = QuantumCircuit(simulation_state_file = system_state_file)
+        for qubit in np.nonzero(outcome)[0].tolist():
+            qc.x(qubit)
+        job = run_job(backend, qc, 1, threshold)
+        probabilities.append(job.result().get_fidelity())
+    return probabilities
+
+def fidelity_reference_threshold(config, threshold):
+    """Threshold of the reference run of STEP 5: fidelity_reference_threshold, by default 4 times threshold; None without either."""
+    if config['fidelity_reference_threshold']:
+        return int(config['fidelity_reference_threshold'])
+    return 4 * threshold if threshold is not None else None
+
+def sample_reference(config, backend, stripped_circuit_name, reference_threshold, reference_state_file, shots):
+    """
+    Simulates the transpiled circuit again at reference_threshold, saves the state to
+    reference_state_file and samples shots of it.
+
+    Returns:
+        np.ndarray: (shots, num_qubits) shots, column k holding qubit k.
+    """
+    qc, _ = load_circuit(config, config['transpiled_circuit_path'], stripped_circuit_name)
+    OptimizeQuantumCircuit(qc)
+    run_job(backend, qc, 1, reference_threshold).result().SaveSystemStateToDiskFile(reference_state_file)
+
+    qc = QuantumCircuit(simulation_state_file = reference_state_file)
+    qc.measure_all()
+    job = run_job(backend, qc, shots, reference_threshold)
+    return memory_to_bits(job.result().get_memory(), qc.num_qubits)
 
 def now():
     return time.time_ns() / (10 ** 9)
 
-def main():
-    config, provider, backends, backend_index, circuit_name, gpu_index, threshold, exp_data = setup()
+def state_handoff_file(config, stripped_circuit_name):
+    """
+    File the prepared state is handed from STEP 2 to STEP 3, 4 and 6 through.
+
+    With state_handoff=memory it lives on an in-memory filesystem (state_handoff_path, by
+    default /dev/shm), so the handoff never touches the disk; otherwise it is the state file
+    in system_state_path.
+    """
+    if config['state_handoff'] != "memory":
+        return str(Path(config['system_state_path']) / f"{stripped_circuit_name}.bin")
+    handoff_path = config['state_handoff_path'] or ("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+    return str(Path(handoff_path) / f"{stripped_circuit_name}.{os.getpid()}.bin")
+
+def handoff_fallback(handoff_file, system_state_file, prediction=None):
+    """
+    handoff_file, or system_state_file if the in-memory filesystem has less free space than the
+    predicted state size (see predict_run). In-memory filesystems are often small, e.g. 64 MB in Docker.
+    """
+    if handoff_file == system_state_file or prediction is None:
+        return handoff_file
+    free_mb = shutil.disk_usage(os.path.dirname(handoff_file)).free / 1024 / 1024
+    if prediction['final_state_memory'] < free_mb:
+        return handoff_file
+    print(f"Warning: {os.path.dirname(handoff_file)} has {free_mb:.1f} MB free, less than the predicted state size of "
+          f"{prediction['final_state_memory']:.1f} MB; saving the state to {system_state_file} instead.")
+    return system_state_file
+
+def save_handoff_state(result, handoff_file, system_state_file, prediction=None):
+    """
+    Saves the state of result to handoff_file, or to system_state_file if the in-memory
+    filesystem is too small (see handoff_fallback) or the save to it fails.
+
+    Returns:
+        str: The file the state was saved to.
+    """
+    handoff_file = handoff_fallback(handoff_file, system_state_file, prediction)
+    try:
+        result.SaveSystemStateToDiskFile(handoff_file)
+    except Exception as e:
+        if handoff_file == system_state_file:
+            raise
+        print(f"Warning: Could not save the state to {handoff_file} ({e}), saving it to {system_state_file} instead.")
+        if os.path.exists(handoff_file):
+            os.remove(handoff_file)
+        handoff_file = system_state_file
+        result.SaveSystemStateToDiskFile(handoff_file)
+    return handoff_file
+
+def checkpoint_state(handoff_file, system_state_file):
+    """Copies the handoff state to system_state_file atomically and returns the time taken."""
+    start_time = time.perf_counter()
+    temp_file = f"{system_state_file}.{os.getpid()}.tmp"
+    shutil.copyfile(handoff_file, temp_file)
+    os.replace(temp_file, system_state_file)
+    return time.perf_counter() - start_time
+
+REPEAT_PHASES = ["state_preparation", "save_state", "expectation", "shots", "mirror_fidelity"]
+
+def run_repeats(config, backend, circuit_name, threshold, exp_data, scratch_state_file, span):
+    """
+    Reruns the timed phases of a circuit warmup + repeat times, reusing its transpiled circuit and dagger.
+
+    Every iteration prepares the state (backend.run, then SaveSystemStateToDiskFile to
+    scratch_state_file, which the caller removes; never the checkpointed state file), evaluates the Pauli expectation values
+    without the memo, samples the shots without writing them and runs the mirror circuit. Per-iteration timings go to <circuit>.repeat.csv, with the phases
+    outside Tukey's fences listed in its outlier column. The statistics of the measured
+    iterations go to <circuit>.repeat_summary.csv.
+
+    Returns:
+        dict: Statistics per phase, see timing_stats.summarize.
+    """
+    stripped_circuit_name = Path(circuit_name).stem
+    transpiled_dagger_path = config['transpiled_dagger_path']
+    repeat_file = Path(config['results_path']) / f"{stripped_circuit_name}.repeat.csv"
+    repeat_summary_file = Path(config['results_path']) / f"{stripped_circuit_name}.repeat_summary.csv"
+
+    repeat = int(config['repeat'])
+    warmup = int(config['warmup'])
+    number_of_shots = int(config['shots'])
+    shot_chunk_size = int(config['shot_chunk_size'])
+
+    with span("load circuit", format=config['circuit_format']):
+        qc1, _ = load_circuit(config, config['transpiled_circuit_path'], stripped_circuit_name)
+        OptimizeQuantumCircuit(qc1)
+        qc2 = None
+        if transpiled_circuit_exists(config, transpiled_dagger_path, stripped_circuit_name):
+            qc2, _ = load_circuit(config, transpiled_dagger_path, stripped_circuit_name)
+
+    table = None
+    if stripped_circuit_name in exp_data.keys():
+        table = PauliTable(exp_data[stripped_circuit_name].keys(), qc1.num_qubits)
+
+    iterations = []
+    for iteration in range(warmup + repeat):
+        is_warmup = iteration < warmup
+        timings = {}
+
+        with span("iteration", iteration=iteration, warmup=is_warmup):
+            with span("state_preparation") as phase:
+                job = run_job(backend, qc1, 1, threshold)
+                result = job.result()
+            timings["state_preparation"] = phase.duration
+
+            with span("save_state") as phase:
+                result.SaveSystemStateToDiskFile(scratch_state_file)
+            timings["save_state"] = phase.duration
+
+            with span("expectation", mode=config['expectation_mode']) as phase:
+                if table is not None:
+                    if config['expectation_mode'] == "sampled":
+                        sample_expectations(backend, scratch_state_file, table, int(config['expectation_shots']), threshold)
+                    else:
+                        evaluate_expectations(result, table, int(config['expectation_workers']))
+            timings["expectation"] = phase.duration
+
+            with span("shots", shots=number_of_shots) as phase:
+                remaining_shots = number_of_shots
+                while remaining_shots > 0:
+                    chunk_shots = min(shot_chunk_size, remaining_shots)
+                    qc = QuantumCircuit(simulation_state_file = scratch_state_file)
+                    qc.measure_all()
+                    job = run_job(backend, qc, chunk_shots, threshold)
+                    memory_to_bits(job.result().get_memory(), qc.num_qubits)
+                    remaining_shots -= chunk_shots
+            timings["shots"] = phase.duration
+
+            with span("mirror_fidelity") as phase:
+                if qc2 is not None and (qc2.num_qubits, qc2.num_clbits) == (qc1.num_qubits, qc1.num_clbits):
+                    qc = QuantumCircuit(simulation_state_file = scratch_state_file)
+                    qc.append(qc2)
+                    job = run_job(backend, qc, 1, threshold)
+                    job.result().get_fidelity()
+            timings["mirror_fidelity"] = phase.duration
+
+        print(f"{'Warmup' if is_warmup else 'Iteration'} {iteration if is_warmup else iteration - warmup}: " + ", ".join(f"{name} {timings[name]:.6f}" for name in REPEAT_PHASES))
+        iterations.append((is_warmup, timings))
+
+    measured = [timings for is_warmup, timings in iterations if not is_warmup]
+    statistics = {name: summarize([timings[name] for timings in measured]) for name in REPEAT_PHASES}
+    outliers = {name: outlier_mask([timings[name] for timings in measured]) for name in REPEAT_PHASES}
+
+    write_csv_line(repeat_file, ["iteration", "warmup"] + REPEAT_PHASES + ["outlier"], mode='w')
+    measured_index = 0
+    for iteration, (is_warmup, timings) in enumerate(iterations):
+        outlier_phases = []
+        if not is_warmup:
+            outlier_phases = [name for name in REPEAT_PHASES if outliers[name][measured_index]]
+            measured_index += 1
+            if outlier_phases:
+                print(f"Warning: Iteration {iteration - warmup} is an outlier in {', '.join(outlier_phases)}")
+        write_csv_line(repeat_file, [iteration, int(is_warmup)] + [timings[name] for name in REPEAT_PHASES] + [";".join(outlier_phases)])
+
+    write_csv_line(repeat_summary_file, ["phase"] + STAT_FIELDNAMES, mode='w')
+    print(f"\n{'phase':<18}" + "".join(f"{field:>12}" for field in ("min", "median", "iqr", "stdev", "outliers")))
+    for name in REPEAT_PHASES:
+        stats = statistics[name]
+        write_csv_line(repeat_summary_file, [name] + [stats[field] for field in STAT_FIELDNAMES])
+        print(f"{name:<18}{stats['min']:>12.6f}{stats['median']:>12.6f}{stats['iqr']:>12.6f}{stats['stdev']:>12.6f}{stats['outliers']:>12}")
+
+    print("Repeated timings written to: ", repeat_file, repeat_summary_file)
+
+    return statistics
+
+def transpile_step(config, circuit_name, span):
+    """
+    STEP 0: transpiles a circuit and its dagger, or generates the dagger from the transpiled
+    circuit when there is no dagger file (see generate_dagger).
 
+    The time and gate counts of every pass of transpile_preset are written to <circuit>.passes.csv
+    in results_path.
+    """
+    stripped_circuit_name = Path(circuit_name).stem
+    transpiled_circuit_path = config['transpiled_circuit_path']
+    transpiled_dagger_path = config['transpiled_dagger_path']
+    transpile_jobs = [(config['pytket_circuit_path'], transpiled_circuit_path)]
+
+    dagger_circuit_path = Path(config["pytket_dagger_path"]) / circuit_name
+    transpile_dagger = dagger_circuit_path.exists() and config['generate_dagger'] != "always"
+    if transpile_dagger:
+        transpile_jobs.append((config['pytket_dagger_path'], transpiled_dagger_path))
+
+    with span("transpile", circuits=len(transpile_jobs), preset=config['transpile_preset']):
+        _, pass_reports = transpile_circuits(config, stripped_circuit_name, transpile_jobs)
+
+    rows = [{"circuit": role, **p} for role, report in zip(["circuit", "dagger"], pass_reports) for p in report or []]
+    if rows:
+        with open(Path(config['results_path']) / f"{stripped_circuit_name}.passes.csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    if not transpile_dagger and config['generate_dagger'] != "never":
+        circuit_files = transpiled_files(config, stripped_circuit_name, transpiled_circuit_path)
+        dagger_files = transpiled_files(config, stripped_circuit_name, transpiled_dagger_path)
+        try:
+            with span("generate dagger"):
+                if "gates" in dagger_files:
+                    dagger_gate_count = write_dagger_gate_file(circuit_files["gates"], dagger_files["gates"])
+                if "qasm" in dagger_files:
+                    dagger_gate_count = write_dagger_qasm(circuit_files["qasm"], dagger_files["qasm"])
+            print(f"Generated dagger circuit {list(dagger_files.values())} with {dagger_gate_count} gates")
+        except ValueError as e:
+            print(f"Warning: Could not generate the dagger circuit: {e}")
+
+def pass_config(config):
+    """Settings of STEP 0 that change the transpiled circuit and its dagger."""
+    return {
+        "transpile_script": file_digest(config['transpile_script']),
+        "transpile_preset": config['transpile_preset'],
+        "circuit_format": config['circuit_format'],
+        "generate_dagger": config['generate_dagger'],
+    }
+
+def open_run_checkpoint(config, circuit_name, threshold, backend_index):
+    """
+    Opens the checkpoint manifest of one run, keyed by the circuit's content hash, the threshold,
+    the backend and the pass configuration. Its completed steps are only reused with --resume.
+    """
+    json_file = Path(config['pytket_circuit_path']) / circuit_name
+    params = {"circuit_name": circuit_name, "threshold": threshold, "backend_index": backend_index, "pass_config": pass_config(config)}
+    key = run_key(file_digest(json_file), threshold, backend_index, params["pass_config"])
+    checkpoint_dir = config['checkpoint_path'] or Path(config['system_state_path']) / "checkpoints"
+    return RunCheckpoint(checkpoint_dir, key, params, config['resume'] != "0")
+
+def state_file_info(system_state_file):
+    stat = os.stat(system_state_file)
+    return {"state_size": stat.st_size, "state_mtime_ns": stat.st_mtime_ns}
+
+def predict_run(config, stripped_circuit_name, threshold):
+    """
+    Predicts the state preparation time and state size of a transpiled circuit with the model in
+    prediction_model (see runtime_model.py), and exits if the predicted state exceeds memory_budget_mb.
+
+    Returns:
+        dict: The prediction, or None without a model or transpiled circuit.
+    """
+    if not config['prediction_model']:
+        return None
+    circuit_file = transpiled_circuit_file(config['transpiled_circuit_path'], stripped_circuit_name)
+    if circuit_file is None:
+        return None
+    try:
+        model = RuntimeModel.load(config['prediction_model'])
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Warning: Could not load the prediction model {config['prediction_model']}: {e}")
+        return None
+
+    prediction = model.predict(circuit_file_features(circuit_file, threshold))
+    print(f"Predicted state preparation time: {prediction['simulation_time']:.2f} seconds, state size: {prediction['final_state_memory']:.1f} MB")
+    if config['memory_budget_mb'] and prediction['final_state_memory'] > float(config['memory_budget_mb']):
+        print(f"Error: The predicted state size of {prediction['final_state_memory']:.1f} MB exceeds memory_budget_mb={config['memory_budget_mb']}.")
+        sys.exit(1)
+    return prediction
+
+def step_watchdog(config, name, predicted_time, cleanup=None):
+    """
+    Ends the process if a step runs longer than step_timeout_factor times its predicted time.
+
+    A synchronous backend.run cannot be interrupted, so the whole process exits; a batch worker
+    is then replaced and the circuit reported as failed. os._exit skips every finally block, so
+    cleanup, if given, is called first to remove temporary files and write the trace. Returns
+    the timer to cancel when the step finishes, or None if timeouts are off.
+    """
+    factor = float(config['step_timeout_factor'])
+    if predicted_time is None or factor <= 0:
+        return None
+    timeout = step_timeout(predicted_time, factor)
+
+    def expire():
+        print(f"Error: {name} exceeded its timeout of {timeout:.0f} seconds.")
+        if cleanup is not None:
+            try:
+                cleanup()
+            except Exception as e:
+                print(f"Warning: Cleanup after the timeout failed: {e}")
+        sys.stdout.flush()
+        os._exit(1)
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+def run_circuit(config, backend, backend_index, circuit_name, threshold, exp_data):
+    """
+    Runs STEP 0 to STEP 6 for one circuit on an already opened backend and writes its CSV.
+
+    Every step and its main substeps are traced as spans, written to <circuit>.trace.jsonl
+    and <circuit>.trace.json (Chrome trace events). The timing columns of the CSV are the
+    durations of those spans.
+
+    Completed steps are recorded in the run's checkpoint manifest (see open_run_checkpoint),
+    STEP 3 per operator and STEP 4 per shot chunk. With --resume, a run continues after the
+    last completed unit of work of an earlier run with the same parameters.
+
+    STEP 5 estimates the fidelity to a reference run at fidelity_reference_threshold from
+    fidelity_samples of the STEP 4 shots (see xeb_fidelity.py), when fidelity_method is
+    estimate or both; the default is the mirror fidelity of STEP 6 only.
+
+    With prediction_model, a circuit whose predicted state exceeds memory_budget_mb is rejected
+    before STEP 1, and step_timeout_factor bounds the backend runs of STEP 2 and STEP 6.
+
+    Args:
+        config (dict): Resolved configuration (paths, transpile script, ...).
+        backend: Backend returned by open_backend, or any object with the same run() interface.
+        backend_index (int): Backend index, part of the checkpoint key.
+        circuit_name (str): Circuit file name, e.g. 'bell_circuit.json'.
+        threshold (int or None): Simulation threshold, None for the balancedAccuracy default.
+        exp_data (dict): Pauli operators per circuit, as loaded from json_file.
+
+    Returns:
+        dict: The row written to the circuit's CSV file.
+    """
+    load_sdk()
+
+    system_state_file = str(Path(config['system_state_path']) / f"{Path(circuit_name).stem}.bin")
+    handoff_file = state_handoff_file(config, Path(circuit_name).stem)
+    try:
+        return run_circuit_steps(config, backend, backend_index, circuit_name, threshold, exp_data, handoff_file)
+    finally:
+        # A failed step would otherwise leave a whole state behind in memory
+        remove_handoff_file(handoff_file, system_state_file)
+
+def remove_handoff_file(handoff_file, system_state_file):
+    """Removes the in-memory handoff file, but never the state file in system_state_path."""
+    if handoff_file != system_state_file and os.path.exists(handoff_file):
+        os.remove(handoff_file)
+
+def run_circuit_steps(config, backend, backend_index, circuit_name, threshold, exp_data, handoff_file):
+    """The steps of run_circuit, handing the prepared state on through handoff_file (see state_handoff_file)."""
     stripped_circuit_name = Path(circuit_name).stem
     system_state_path = Path(config['system_state_path'])
     system_state_file = str(Path(system_state_path) / f"{stripped_circuit_name}.bin")
-    pytket_circuit_path = config['pytket_circuit_path']
-    pytket_dagger_path = config['pytket_dagger_path']
     transpiled_circuit_path = config['transpiled_circuit_path']
     transpiled_dagger_path = config['transpiled_dagger_path']
     results_path = config['results_path']
     csv_file = Path(results_path) / f"{stripped_circuit_name}.csv"
     shots_output_file = Path(results_path) / f"{stripped_circuit_name}.shots.txt"
+    shots_packed_file = Path(results_path) / f"{stripped_circuit_name}.shots.bin"
+    shots_summary_file = Path(results_path) / f"{stripped_circuit_name}.shots_summary.json"
+    fidelity_estimate_file = Path(results_path) / f"{stripped_circuit_name}.fidelity_estimate.json"
     exp_output_file = Path(results_path) / f"{stripped_circuit_name}.exp.json"
-
-    backend = provider.get_backend(backends[backend_index], gpu=gpu_index)
-
-    print("Account Name: ", provider.active_account()["name"], "\nMax Qubits: ", provider.active_account()["max_qubits"])
-
-    partial_data = load_partial_results(system_state_path, stripped_circuit_name)
-
-    if partial_data:
-        print(f"Skipping steps 1–3 for {stripped_circuit_name}, using cached partial results.")
-        expectation_value_time = partial_data["expectation_value_time"]
-        threshold = partial_data["threshold"]
-        backend_index = partial_data["backend_index"]
-
-        transpiling_time = partial_data["transpiling_time"]
-        pre_processing_time = partial_data["pre_processing_time"]
-        state_preparation_time = partial_data["state_preparation_time"]
-        total_prep_time = partial_data["total_prep_time"]
-        final_state_memory = partial_data["final_state_memory"]
+    exp_timings_file = Path(results_path) / f"{stripped_circuit_name}.exp_timings.csv"
+    exp_sampled_file = Path(results_path) / f"{stripped_circuit_name}.exp_sampled.csv"
+    trace_jsonl_file = Path(results_path) / f"{stripped_circuit_name}.trace.jsonl"
+    trace_chrome_file = Path(results_path) / f"{stripped_circuit_name}.trace.json"
+
+    tracer = Tracer(trace_jsonl_file if config['trace'] != "0" else None)
+    span = tracer.span
+
+    def abort_run():
+        """Cleanup for step_watchdog, which exits without running the finally of run_circuit."""
+        remove_handoff_file(handoff_file, system_state_file)
+        tracer.abort()
+        if config['trace'] != "0":
+            tracer.write_chrome_trace(trace_chrome_file)
+            print("Trace of the unfinished run written to: ", trace_jsonl_file, trace_chrome_file)
+
+    run = open_run_checkpoint(config, circuit_name, threshold, backend_index)
+    if run.resumed:
+        completed_steps = [name for name, step in run.manifest["steps"].items() if step.get("completed")]
+        print(f"Resuming {stripped_circuit_name} from {run.manifest_file}, completed steps: {completed_steps}")
+
+    checkpoint = None
+    checkpoint_time = 0
+
+    if run.completed("transpile") and transpiled_circuit_exists(config, transpiled_circuit_path, stripped_circuit_name):
+        print("\nSTEP 0: Transpiling (checkpointed)")
+        transpiling_time = run.step("transpile")["time"]
 
     else:
         print("\nSTEP 0: Transpiling")
 
-        start_time = now()
-
-        transpile_circuit_result = subprocess.run([
-                config['python_bin'], 
-                config['transpile_script'],
-                stripped_circuit_name,
-                pytket_circuit_path,
-                transpiled_circuit_path
-            ], capture_output=True, text=True)
-        print(f"Isolated script output:\n{transpile_circuit_result.stdout}")
-        if(transpile_circuit_result.stderr):
-            print(f"Isolated script errors:\n{transpile_circuit_result.stderr}")
-
-        if transpile_circuit_result.returncode != 0:
-            print("Error: Transpilation subprocess failed.")
-            sys.exit(1)
+        with span("STEP 0: Transpiling") as step:
+            transpile_step(config, circuit_name, span)
 
-        dagger_circuit_path = Path(config["pytket_dagger_path"]) / circuit_name
-        if dagger_circuit_path.exists():
-            transpile_dagger_result = subprocess.run([
-                    config['python_bin'], 
-                    config['transpile_script'],
-                    stripped_circuit_name,
-                    pytket_dagger_path,
-                    transpiled_dagger_path
-                ], capture_output=True, text=True)
-            print(f"Isolated script output:\n{transpile_dagger_result.stdout}")
-            if(transpile_dagger_result.stderr):
-                print(f"Isolated script errors:\n{transpile_dagger_result.stderr}")
-
-            if transpile_dagger_result.returncode != 0:
-                print("Error: Transpilation subprocess failed.")
-                sys.exit(1)
+        transpiling_time = step.duration
 
-        end_time = now()
+        print(f"Transpiling time: {transpiling_time}")
 
-        transpiling_time = end_time - start_time
+        if not transpiled_circuit_exists(config, transpiled_circuit_path, stripped_circuit_name):
+            print(f"Error: Transpiled circuit {stripped_circuit_name} not found in {transpiled_circuit_path}.")
 
-        print(f"Transpiling time: {transpiling_time}")
+        run.complete("transpile", time=transpiling_time)
 
-        transpiled_circuit_file = Path(transpiled_circuit_path) / f"{stripped_circuit_name}.qasm"
+    # The state checkpoint is only reused if it is still the file the manifest recorded
+    state_step = run.step("state_preparation")
+    state_restored = state_step.get("completed", False) and os.path.exists(system_state_file) and \
+        state_file_info(system_state_file) == {key: state_step[key] for key in ("state_size", "state_mtime_ns")}
+    if not state_restored and state_step:
+        print(f"State checkpoint {system_state_file} is missing or was overwritten, resuming from STEP 1.")
+    if not state_restored:
+        run.reset(["preprocessing", "state_preparation", "expectation", "shots", "fidelity_estimate", "mirror_fidelity"])
 
-        if not Path(transpiled_circuit_file).exists():
-            print(f"Error: Transpiled circuit {transpiled_circuit_file} not found.")
+    result = None
+    prediction = None
 
-        print("\nSTEP 1: Pre-Processing")
+    if state_restored:
+        print("\nSTEP 1: Pre-Processing (checkpointed)")
+        print("\nSTEP 2: State Preparation (checkpointed)")
+        pre_processing_time = run.step("preprocessing")["time"]
+        state_preparation_time = state_step["time"]
+        state_preparation_wall_time = state_step["wall_time"]
+        final_state_memory = state_step["final_state_memory"]
+        num_qubits = state_step["num_qubits"]
+        checkpoint_time = state_step.get("checkpoint_time", 0)
 
-        total_prep_start_time = now()
+        # STEP 3 to STEP 6 read the state checkpointed by the earlier run
+        state_file = system_state_file
 
-        start_time = now()
+    else:
+        prediction = predict_run(config, stripped_circuit_name, threshold)
 
-        qc1 = QuantumCircuit.from_qasm_file(str(transpiled_circuit_file))
+        print("\nSTEP 1: Pre-Processing")
 
-        OptimizeQuantumCircuit(qc1)
+        with span("STEP 1: Pre-Processing") as step:
+            with span("load circuit", format=config['circuit_format']):
+                qc1, gate_counts = load_circuit(config, transpiled_circuit_path, stripped_circuit_name)
 
-        end_time = now()
+            with span("OptimizeQuantumCircuit"):
+                OptimizeQuantumCircuit(qc1)
 
-        pre_processing_time = end_time - start_time
+        pre_processing_time = step.duration
+        num_qubits = qc1.num_qubits
 
         print("Number of Qubits: ", qc1.num_qubits)
-        gate_counts = qc1.count_ops()
         print(f"Circuit operations: {gate_counts}")
         total_count = sum(gate_counts.values())
 
@@ -281,196 +1073,420 @@ def main():
 
         print(f"Pre-processing time: {pre_processing_time}")
 
+        run.complete("preprocessing", time=pre_processing_time, num_qubits=num_qubits, gate_counts=dict(gate_counts))
+
         print("\nSTEP 2: State Preparation")
 
         number_of_shots = 1
-        start_time = now()
 
-        if threshold is not None:
-            job = backend.run(qc1, shots=number_of_shots, mode="sync", generate_amplitude = False, quiet=True, performance="custom", threshold=threshold)
-        else:
-            job = backend.run(qc1, shots=number_of_shots, mode="sync", performance = "balancedAccuracy", generate_amplitude = False, quiet=True)
+        with span("STEP 2: State Preparation", threshold=threshold) as prep_step:
+            watchdog = step_watchdog(config, "STEP 2: State Preparation", prediction and prediction['simulation_time'], abort_run)
+            with span("backend.run") as run_span:
+                job = run_job(backend, qc1, number_of_shots, threshold)
+            if watchdog is not None:
+                watchdog.cancel()
 
-        job_monitor(job, quiet=True)
-        end_time = now()
+            state_preparation_time = run_span.duration
 
-        state_preparation_time = end_time - start_time
+            print(f"Initial State Preparation Time taken: {state_preparation_time} seconds")
 
-        print(f"Initial State Preparation Time taken: {state_preparation_time} seconds")
-
-        result = job.result()
+            with span("job.result"):
+                result = job.result()
 
-        result.SaveSystemStateToDiskFile(system_state_file)
-        print("State Preparation: Time taken: ", end_time - start_time, "seconds.")
+            with span("SaveSystemStateToDiskFile", handoff=config['state_handoff']) as save_span:
+                handoff_file = save_handoff_state(result, handoff_file, system_state_file, prediction)
+            print("State Preparation: Time taken: ", state_preparation_time, "seconds.")
 
-        final_state_memory = os.path.getsize(system_state_file)/1024/1024
+        state_preparation_wall_time = prep_step.duration
+        final_state_memory = os.path.getsize(handoff_file)/1024/1024
         print("Final State Memory: ", final_state_memory, "MB")
 
+        state_file = handoff_file
+        state_record = {
+            "time": state_preparation_time,
+            "wall_time": state_preparation_wall_time,
+            "final_state_memory": final_state_memory,
+            "num_qubits": num_qubits,
+        }
+
+        if handoff_file == system_state_file:
+            checkpoint_time = save_span.duration
+            run.complete("state_preparation", **state_record, checkpoint_time=checkpoint_time, **state_file_info(system_state_file))
+        elif config['state_checkpoint'] != "0":
+            # The disk checkpoint is only needed to resume, so it is written while STEP 3 to 6 run
+            def complete_after_checkpoint(future):
+                if future.exception() is None:
+                    run.complete("state_preparation", **state_record, checkpoint_time=future.result(), **state_file_info(system_state_file))
+
+            checkpoint_executor = ThreadPoolExecutor(max_workers=1)
+            checkpoint = checkpoint_executor.submit(checkpoint_state, handoff_file, system_state_file)
+            checkpoint.add_done_callback(complete_after_checkpoint)
+            checkpoint_executor.shutdown(wait=False)
+
+    if run.completed("expectation"):
+        print("\nSTEP 3: Pauli Expectation Value (checkpointed)")
+        expectation_step = run.step("expectation")
+        expectation_value_time = expectation_step["time"]
+        expectation_wall_time = expectation_step["wall_time"]
+        expectation_memo_hits = expectation_step.get("memo_hits", "")
+
+    else:
         print("\nSTEP 3: Pauli Expectation Value")
 
         average_expectation_value = 0
-        expectation_values = []
+        expectation_memo_hits = ""
 
-        if stripped_circuit_name in exp_data.keys():
-            qubit_list = list(range(qc1.num_qubits))
-            exp_values = exp_data[stripped_circuit_name]
+        with span("STEP 3: Pauli Expectation Value", mode=config['expectation_mode']) as exp_step:
+            if stripped_circuit_name in exp_data.keys():
+                exp_values = exp_data[stripped_circuit_name]
 
-            print("Pauli Operators:")
-            exp_sum = 0
-            expectation_values = []
+                print("Pauli Operators:")
 
-            start_time = now()
+                with span("parse operators", operators=len(exp_values)):
+                    table = PauliTable(exp_values.keys(), num_qubits)
 
-            for exp_value in exp_values:
-                reversed = exp_value[::-1]
+                if config['expectation_mode'] != "sampled":
+                    # Hashing the state reads the whole file, so it is kept out of the expectation time
+                    memo = None
+                    if config['expectation_memo'] != "0":
+                        with span("hash state") as hash_span:
+                            memo = ExpectationMemo(Path(system_state_path) / "expectation_memo", state_file)
+                        print(f"State hash for expectation memo: {memo.state_hash[:16]} ({hash_span.duration} seconds)")
 
-                exp_val = result.get_pauliexpectationvalue(reversed, qubit_list, 0, 0)
-                expectation_value = exp_val.real
+                    with span("exact expectation") as exact_span:
+                        operator_log = run.log("expectation")
+                        if operator_log.values:
+                            print(f"Resuming with {len(operator_log.values)} checkpointed operators")
 
-                exp_values[exp_value] = str(expectation_value)
-                print("Expectation Value for ", exp_value, " = ", expectation_value)
+                        known = set(memo.values if memo is not None else ()) | set(operator_log.values)
+                        if result is None and any(not table.unique_is_identity[row] and table.canonical(row) not in known for row in range(len(table.first_index))):
+                            with span("state reload"):
+                                result = run_job(backend, QuantumCircuit(simulation_state_file = state_file), 1, threshold).result()
 
-                exp_sum += expectation_value
+                        with span("evaluate operators"):
+                            operator_values, operator_timings = evaluate_expectations(result, table, int(config['expectation_workers']), memo, now, operator_log)
+                        operator_log.close()
 
-            average_expectation_value = exp_sum / len(exp_values)
+                    expectation_value_time = exact_span.duration
 
-            end_time = now()
-        
-            expectation_value_time = end_time - start_time
+                    write_csv_line(exp_timings_file, ["operator", "source", "latency"], mode='w')
+                    for timing in operator_timings:
+                        write_csv_line(exp_timings_file, timing)
 
-            print(f"Average Expectation Value = {average_expectation_value}")
-            print(f"Expectation Value Calculation Time taken: {expectation_value_time} seconds")
+                    sources = Counter(source for _, source, _ in operator_timings)
+                    print(f"Operators: {len(operator_timings)} ({dict(sources)}), simulator time {sum(latency for _, _, latency in operator_timings)} seconds")
+                    expectation_memo_hits = sources["memo"]
+                    if expectation_memo_hits:
+                        print(f"Warning: {expectation_memo_hits} operators were taken from the expectation memo, "
+                              f"so expectation_value_time does not include their simulator time.")
 
-            exp_out = {}
-            exp_out[stripped_circuit_name] = exp_values
-            with open(exp_output_file, 'w') as f:
-                json.dump(exp_out, f, indent=4)
-            print("Expectation values written to: ", exp_output_file)
-
-        else:
-            print(f"Pauli operator for circuit {stripped_circuit_name} is not found.")
-            expectation_value_time = 0
-
-        total_prep_end_time = now()
-        total_prep_time = total_prep_end_time - total_prep_start_time
-
-        save_partial_results(system_state_path, stripped_circuit_name, {
-            "circuit_name": stripped_circuit_name,
-            "expectation_value_time": expectation_value_time,
-            "threshold": threshold,
-            "backend_index": backend_index,
-            "transpiling_time": transpiling_time,
-            "pre_processing_time": pre_processing_time,
-            "state_preparation_time": state_preparation_time,
-            "total_prep_time": total_prep_time,
-            "final_state_memory": final_state_memory,
-        })
+                if config['expectation_mode'] != "exact":
+                    with span("sampled expectation", shots=int(config['expectation_shots'])) as sampled_span:
+                        sampled_values, sampled_errors, operator_groups = sample_expectations(backend, state_file, table, int(config['expectation_shots']), threshold)
 
-    print("\nSTEP 4: First 100 shots:")
+                    sampled_expectation_time = sampled_span.duration
+                    print(f"Sampled Expectation Value Time taken: {sampled_expectation_time} seconds")
 
-    total_runtime_start_time = now()
+                    write_csv_line(exp_sampled_file, ["operator", "group", "estimate", "std_error", "exact"], mode='w')
+                    for i, exp_value in enumerate(table.operators):
+                        exact = operator_values[i] if config['expectation_mode'] == "both" else ""
+                        write_csv_line(exp_sampled_file, [exp_value, operator_groups[i], sampled_values[i], sampled_errors[i], exact])
+                    print("Sampled expectation values written to: ", exp_sampled_file)
 
-    start_time = now()
+                    if config['expectation_mode'] == "sampled":
+                        operator_values = sampled_values
+                        expectation_value_time = sampled_expectation_time
 
-    qc1 = QuantumCircuit(simulation_state_file = system_state_file)
-    qc1.measure_all()
-    number_of_shots = 100
+                for exp_value, expectation_value in zip(table.operators, operator_values):
+                    exp_values[exp_value] = str(expectation_value)
+                    print("Expectation Value for ", exp_value, " = ", expectation_value)
 
-    if threshold is not None:
-        job = backend.run(qc1, shots=number_of_shots, mode="sync", generate_amplitude = False, quiet=True, performance="custom", threshold=threshold)
-    else:
-        job = backend.run(qc1, shots=number_of_shots, mode="sync", performance = "balancedAccuracy", generate_amplitude = False, quiet=True)
+                average_expectation_value = sum(operator_values) / len(operator_values)
 
-    job_monitor(job, quiet=True)
+                print(f"Average Expectation Value = {average_expectation_value}")
+                print(f"Expectation Value Calculation Time taken: {expectation_value_time} seconds")
 
-    result = job.result()
-    shots = result.get_memory()
+                exp_out = {}
+                exp_out[stripped_circuit_name] = exp_values
+                with open(exp_output_file, 'w') as f:
+                    json.dump(exp_out, f, indent=4)
+                print("Expectation values written to: ", exp_output_file)
 
-    with open(shots_output_file, "w") as f:
-        for i in range(len(shots)):
-
-            reversed_sample = shots[i][::-1]
-            f.write(reversed_sample + "\n")
+            else:
+                print(f"Pauli operator for circuit {stripped_circuit_name} is not found.")
+                expectation_value_time = 0
 
-    print("Shots written to: ", shots_output_file)
+        expectation_wall_time = exp_step.duration
+        run.complete("expectation", time=expectation_value_time, wall_time=expectation_wall_time, average=average_expectation_value,
+                     memo_hits=expectation_memo_hits)
 
-    end_time = now()
+    # The state is not needed any more, only its file
+    result = None
+    total_prep_time = pre_processing_time + state_preparation_wall_time + expectation_wall_time
 
-    shots_time = end_time - start_time
+    number_of_shots = int(config['shots'])
+    shot_chunk_size = int(config['shot_chunk_size'])
 
-    print(f"First 100 Shots Time taken: {shots_time}")
+    packed_shots_file = shots_packed_file if config['shots_format'] != "text" else None
+    text_shots_file = shots_output_file if config['shots_format'] != "packed" else None
 
-    print("\nSTEP 6: Mirror Fidelity")
+    # Shots are only resumed into the same files they were written to
+    shots_record = {"shots": number_of_shots, "shots_format": config['shots_format']}
+    shots_step = run.step("shots")
+    if any(shots_step.get(key) != value for key, value in shots_record.items()):
+        shots_step = {}
+    completed_shots = shots_step.get("completed_shots", 0)
+    previous_shots_time = shots_step.get("time", 0)
 
-    mirror_fidelity = -1
-    mirror_fidelity_time = 0
+    if shots_step.get("completed"):
+        print(f"\nSTEP 4: {number_of_shots} shots (checkpointed)")
+        shots_time = previous_shots_time
 
-    dagger_circuit_file = Path(transpiled_dagger_path) / f"{stripped_circuit_name}.qasm"
+    else:
+        print(f"\nSTEP 4: {number_of_shots} shots:")
+
+        with span("STEP 4: Shots", shots=number_of_shots) as shots_step_span:
+            shots_start_time = time.perf_counter()
+            shot_writer = None
+            shot_accumulator = None
+
+            if completed_shots:
+                print(f"Resuming after {completed_shots} checkpointed shots")
+                with span("replay shots", shots=completed_shots):
+                    shot_writer = ShotWriter(packed_shots_file, num_qubits, text_shots_file, resume_shots=completed_shots)
+                    shot_accumulator = ShotAccumulator(num_qubits, int(config['shot_histogram_limit']))
+                    for bits in read_shot_chunks(num_qubits, packed_shots_file, text_shots_file, completed_shots, shot_chunk_size):
+                        shot_accumulator.update(bits)
+
+            remaining_shots = number_of_shots - completed_shots
+            while remaining_shots > 0:
+                chunk_shots = min(shot_chunk_size, remaining_shots)
+
+                with span("state reload"):
+                    qc1 = QuantumCircuit(simulation_state_file = state_file)
+                    qc1.measure_all()
+
+                with span("backend.run", shots=chunk_shots):
+                    job = run_job(backend, qc1, chunk_shots, threshold)
+
+                with span("get_memory"):
+                    result = job.result()
+                    bits = memory_to_bits(result.get_memory(), qc1.num_qubits)
+
+                with span("write shots"):
+                    if shot_writer is None:
+                        shot_writer = ShotWriter(packed_shots_file, qc1.num_qubits, text_shots_file)
+                        shot_accumulator = ShotAccumulator(qc1.num_qubits, int(config['shot_histogram_limit']))
+                    shot_writer.write(bits)
+                    shot_accumulator.update(bits)
+                    shot_writer.flush()
+
+                remaining_shots -= chunk_shots
+                run.update("shots", **shots_record, completed_shots=number_of_shots - remaining_shots,
+                           time=previous_shots_time + time.perf_counter() - shots_start_time)
+
+            if shot_writer is not None:
+                shot_writer.close()
+                with open(shots_summary_file, "w") as f:
+                    json.dump(shot_accumulator.summary(), f, indent=4)
+
+        shots_time = previous_shots_time + shots_step_span.duration
+        run.complete("shots", **shots_record, completed_shots=number_of_shots, time=shots_time)
+
+        print("Shots written to: ", ", ".join(str(f) for f in (packed_shots_file, text_shots_file) if f))
+
+    shots_per_second = number_of_shots / shots_time if shots_time > 0 else 0
+
+    print(f"{number_of_shots} Shots Time taken: {shots_time} ({shots_per_second} shots/sec)")
+
+    fidelity_estimate = ""
+    fidelity_estimate_time = ""
+    fidelity_samples = min(int(config['fidelity_samples']), number_of_shots)
+    reference_threshold = fidelity_reference_threshold(config, threshold)
+    # The estimate is only reused if the shots it was computed from were not resampled
+    fidelity_record = {**shots_record, "fidelity_samples": fidelity_samples, "reference_threshold": reference_threshold}
+    fidelity_step = run.step("fidelity_estimate")
+
+    if config['fidelity_method'] == "mirror" or fidelity_samples <= 0:
+        pass
+
+    elif reference_threshold is None:
+        print("\nWarning: Skipping STEP 5, the fidelity estimate needs --fidelity_reference_threshold when the run has no threshold.")
+
+    elif shots_step.get("completed") and fidelity_step.get("completed") and \
+            all(fidelity_step.get(key) == value for key, value in fidelity_record.items()):
+        print("\nSTEP 5: Fidelity Estimate (checkpointed)")
+        fidelity_estimate = fidelity_step["fidelity"]
+        fidelity_estimate_time = fidelity_step["time"]
 
-    if dagger_circuit_file.exists():
-        qc1 = QuantumCircuit(simulation_state_file = system_state_file)
-        qc2 =  QuantumCircuit.from_qasm_file(str(dagger_circuit_file))
-    
-        num_qubits = qc1.num_qubits
-        num_clbits = qc1.num_clbits
+    else:
+        print(f"\nSTEP 5: Fidelity Estimate ({fidelity_samples} of {number_of_shots} shots, reference threshold {reference_threshold})")
+        if threshold is not None and reference_threshold <= threshold:
+            print(f"Warning: The reference threshold {reference_threshold} is not above the threshold {threshold}, so truncation errors may cancel out.")
 
-        print("Number of qubits: ", num_qubits)
-        gate_counts = qc2.count_ops()
-        print(f"Circuit operations: {gate_counts}")
-        total_count = 0
-        for gate, count in gate_counts.items():
-            total_count += count
+        reference_state_file = str(Path(system_state_file).with_name(f"{stripped_circuit_name}.reference.{os.getpid()}.bin"))
+        try:
+            with span("STEP 5: Fidelity Estimate", samples=fidelity_samples, reference_threshold=reference_threshold) as fidelity_step_span:
+                with span("read shots"):
+                    bits = read_shot_rows(num_qubits, sample_indices(number_of_shots, fidelity_samples), packed_shots_file, text_shots_file)
+
+                with span("reference run"):
+                    reference_bits = sample_reference(config, backend, stripped_circuit_name, reference_threshold, reference_state_file, fidelity_samples)
+
+                with span("outcome probabilities"):
+                    estimate = estimate_fidelity(bits, reference_bits,
+                                                 lambda outcomes: outcome_probabilities(backend, reference_state_file, outcomes, reference_threshold))
+        finally:
+            if os.path.exists(reference_state_file):
+                os.remove(reference_state_file)
+
+        fidelity_estimate = estimate["fidelity_estimate"]
+        fidelity_estimate_time = fidelity_step_span.duration
+        if estimate["error"]:
+            print(f"Warning: No fidelity estimate, {estimate['error']}.")
+        print(f"Fidelity Estimate: {fidelity_estimate} +- {estimate['std_error']} (linear XEB {estimate['xeb']}, "
+              f"reference {estimate['reference_xeb']}, {estimate['distinct_outcomes']} distinct outcomes)")
+        print(f"Fidelity Estimate Time taken: {fidelity_estimate_time} ({estimate['time_per_evaluation']} seconds per outcome)")
+
+        with open(fidelity_estimate_file, "w") as f:
+            json.dump({**estimate, "wall_time": fidelity_estimate_time}, f, indent=4)
+        run.complete("fidelity_estimate", **fidelity_record, fidelity=fidelity_estimate, time=fidelity_estimate_time)
+
+    if run.completed("mirror_fidelity"):
+        print("\nSTEP 6: Mirror Fidelity (checkpointed)")
+        mirror_step = run.step("mirror_fidelity")
+        mirror_fidelity = mirror_step["fidelity"]
+        mirror_fidelity_time = mirror_step["time"]
+        mirror_wall_time = mirror_step["wall_time"]
+
+    elif config['fidelity_method'] == "estimate":
+        mirror_fidelity = -1
+        mirror_fidelity_time = 0
+        mirror_wall_time = 0
 
-        print(f"Total number of gate operations in dagger circuit: {total_count}\n")
+    else:
+        print("\nSTEP 6: Mirror Fidelity")
 
-        if (num_qubits != qc2.num_qubits):
-            print("Mismatch in the number of qubits between the circuit and its dagger")
-        else:
-            if (num_clbits != qc2.num_clbits):
-                print("Mismatch in the number of classical bits between the circuit and its dagger")
-            else:
-                qc1.append(qc2)
+        mirror_fidelity = -1
+        mirror_fidelity_time = 0
 
-                number_of_shots = 1
-                start_time = now()
+        with span("STEP 6: Mirror Fidelity") as mirror_step_span:
+            if transpiled_circuit_exists(config, transpiled_dagger_path, stripped_circuit_name):
+                with span("state reload"):
+                    qc1 = QuantumCircuit(simulation_state_file = state_file)
+                with span("load dagger", format=config['circuit_format']):
+                    qc2, gate_counts = load_circuit(config, transpiled_dagger_path, stripped_circuit_name)
 
-                if threshold is not None:
-                    job = backend.run(qc1, shots=number_of_shots, mode="sync", generate_amplitude = False, quiet=True, performance="custom", threshold=threshold)
-                else:
-                    job = backend.run(qc1, shots=number_of_shots, mode="sync", performance = "balancedAccuracy", generate_amplitude = False, quiet=True)
+                num_qubits = qc1.num_qubits
+                num_clbits = qc1.num_clbits
 
-                job_monitor(job, quiet=True)
-                end_time = now()
+                print("Number of qubits: ", num_qubits)
+                print(f"Circuit operations: {gate_counts}")
+                total_count = 0
+                for gate, count in gate_counts.items():
+                    total_count += count
 
-                result = job.result()
-                mirror_fidelity = result.get_fidelity()
-                print(f"\nMirror Circuit Fidelity:  {mirror_fidelity}")
-                mirror_fidelity_time = end_time - start_time
-                print(f"Mirror Fidelity Time taken: {mirror_fidelity_time}")
+                print(f"Total number of gate operations in dagger circuit: {total_count}\n")
 
-    total_runtime_end_time = now()
+                if (num_qubits != qc2.num_qubits):
+                    print("Mismatch in the number of qubits between the circuit and its dagger")
+                else:
+                    if (num_clbits != qc2.num_clbits):
+                        print("Mismatch in the number of classical bits between the circuit and its dagger")
+                    else:
+                        with span("append"):
+                            qc1.append(qc2)
+
+                        number_of_shots = 1
+
+                        # The mirror circuit is the circuit and its dagger, about twice the work of STEP 2
+                        watchdog = step_watchdog(config, "STEP 6: Mirror Fidelity", prediction and 2 * prediction['simulation_time'], abort_run)
+                        with span("backend.run") as run_span:
+                            job = run_job(backend, qc1, number_of_shots, threshold)
+                        if watchdog is not None:
+                            watchdog.cancel()
+
+                        with span("job.result"):
+                            result = job.result()
+                            mirror_fidelity = result.get_fidelity()
+                        print(f"\nMirror Circuit Fidelity:  {mirror_fidelity}")
+                        mirror_fidelity_time = run_span.duration
+                        print(f"Mirror Fidelity Time taken: {mirror_fidelity_time}")
+
+        mirror_wall_time = mirror_step_span.duration
+        run.complete("mirror_fidelity", fidelity=mirror_fidelity, time=mirror_fidelity_time, wall_time=mirror_wall_time)
+
+    if fidelity_estimate != "" and mirror_fidelity != -1:
+        print(f"Fidelity Estimate {fidelity_estimate} in {fidelity_estimate_time} seconds, "
+              f"Mirror Fidelity {mirror_fidelity} in {mirror_wall_time} seconds")
+
+    if checkpoint is not None:
+        with span("wait for checkpoint") as wait_span:
+            checkpoint_error = checkpoint.exception()
+        if checkpoint_error is None:
+            checkpoint_time = checkpoint.result()
+            print(f"State checkpoint written to {system_state_file} in the background in {checkpoint_time} seconds (waited {wait_span.duration} seconds for it)")
+        else:
+            print(f"Warning: Could not write the state checkpoint {system_state_file}: {checkpoint_error}")
+            checkpoint_time = ""
 
     total_runtime = transpiling_time + pre_processing_time + state_preparation_time + shots_time
-    other_time = (total_runtime_end_time - total_runtime_start_time) + total_prep_time - (total_runtime + expectation_value_time)
+    # Wall time of all steps that is not accounted for by the other columns
+    other_time = transpiling_time + total_prep_time + shots_time + mirror_wall_time - (total_runtime + expectation_value_time)
+
+    row = {
+        "circuit_name": stripped_circuit_name,
+        "mirror_fidelity": "" if mirror_fidelity == -1 else mirror_fidelity,
+        "fidelity_estimate": fidelity_estimate,
+        "total_runtime": total_runtime,
+        "simulation_time": state_preparation_time,
+        "preprocessing_time": transpiling_time + pre_processing_time,
+        "shot_time": shots_time,
+        "shots_per_second": shots_per_second,
+        "expectation_value_time": expectation_value_time,
+        "other_time": other_time,
+        "final_state_memory": final_state_memory,
+        "checkpoint_time": checkpoint_time,
+        "threshold": threshold if threshold is not None else "",
+        "transpile_preset": config['transpile_preset'],
+        "fidelity_estimate_time": fidelity_estimate_time,
+        "expectation_memo_hits": expectation_memo_hits,
+    }
 
     with open(csv_file, "w", newline="") as csvfile:
-        fieldnames = ["circuit_name", "mirror_fidelity", "fidelity_estimate", "total_runtime", "simulation_time", "preprocessing_time", "shot_time", "expectation_value_time", "other_time", "final_state_memory"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer = csv.DictWriter(csvfile, fieldnames=CSV_FIELDNAMES)
         writer.writeheader()
-        writer.writerow({
-            "circuit_name": stripped_circuit_name,
-            "mirror_fidelity": "" if mirror_fidelity == -1 else mirror_fidelity,
-            "fidelity_estimate": "",
-            "total_runtime": total_runtime,
-            "simulation_time": state_preparation_time,
-            "preprocessing_time": transpiling_time + pre_processing_time,
-            "shot_time": shots_time,
-            "expectation_value_time": expectation_value_time,
-            "other_time": other_time,
-            "final_state_memory": final_state_memory
-        })
+        writer.writerow(row)
+
+    # <circuit>.csv only keeps the latest run, the results store keeps every run
+    record_result({**config, 'run_id': config['run_id'] or new_run_id()}, stripped_circuit_name, threshold, backend_index, row)
+
+    if int(config['repeat']) > 1 or int(config['warmup']) > 0:
+        print(f"\nSTEP 7: Repeated measurement ({config['warmup']} warmup, {config['repeat']} measured iterations)")
+        with span("STEP 7: Repeated measurement", repeat=int(config['repeat']), warmup=int(config['warmup'])):
+            # Next to the handoff file, so a resumed run still finds the checkpointed state in system_state_file
+            repeat_state_file = str(Path(handoff_file).with_name(f"{stripped_circuit_name}.repeat.{os.getpid()}.bin"))
+            try:
+                run_repeats(config, backend, circuit_name, threshold, exp_data, repeat_state_file, span)
+            finally:
+                if os.path.exists(repeat_state_file):
+                    os.remove(repeat_state_file)
+
+    tracer.close()
+    if config['trace'] != "0":
+        tracer.write_chrome_trace(trace_chrome_file)
+        print("Trace written to: ", trace_jsonl_file, trace_chrome_file)
 
     print(f"Done processing {circuit_name}\n\n")
 
+    return row
+
+def main():
+    config, backend_index, circuit_name, gpu_index, threshold, exp_data = setup()
+
+    backend = open_backend(config, backend_index, gpu_index)
+
+    run_circuit(config, backend, backend_index, circuit_name, threshold, exp_data)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,261 @@
+import os
+import sys
+sys.stdout.reconfigure(line_buffering=True) # Prevent buffering when running with nohup
+import json
+import time
+import socket
+from pathlib import Path
+from platform import python_version
+
+import benchmark_circuit
+from benchmark_circuit import DEFAULT_CONFIG, parse_optional_args, write_csv_line
+from benchmark_batch import load_circuit_list, run_batch
+from timing_stats import summarize, OUTLIER_FENCE
+from results_store import new_run_id
+import stub_backend
+
+# Small, fast circuits of circuit_list.json that every regression run measures
+REGRESSION_CIRCUITS = ["diamond_steane", "linear_steane", "t_injections_steane", "mvsp_gaussian2d_fourier_d5_n10", "mvsp_cauchy2d_chebyshev_d5_n10"]
+
+# Phases compared against the baseline: the batch wall time and the columns of <circuit>.csv
+TIMING_PHASES = ["wall_time", "total_runtime", "simulation_time", "preprocessing_time", "shot_time", "expectation_value_time", "fidelity_estimate_time", "other_time"]
+MEMORY_PHASES = ["final_state_memory"]
+
+REGRESSION_CONFIG = {
+    **DEFAULT_CONFIG,
+    "circuit_list": "circuit_list.json",
+    "regression_circuits": ",".join(REGRESSION_CIRCUITS),
+    "backend": "stub",
+    "rounds": "5",
+    "warmup_rounds": "1",
+    "baseline_file": "",
+    "update_baseline": "0",
+    "regression_report": "regression_report.csv",
+    "relative_tolerance": "0.1",
+    "min_delta": "0.01",
+    "memory_tolerance": "0.01",
+    # Every round measures the whole pipeline, transpiling included
+    "transpile_cache": "0",
+}
+
+# Only needed to log in to the real SDK
+SDK_REQUIRED_KEYS = ["token", "email"]
+
+REPORT_FIELDNAMES = ["circuit_name", "phase", "baseline_median", "median", "delta", "delta_percent", "allowed", "baseline_iqr", "iqr", "status"]
+
+def print_usage(config):
+    print("Usage:")
+    print(f"  {config['python_bin']} {Path(__file__).name} <backend_index> <gpu_index> [--key=value ...]\n")
+    print("Runs the pinned regression circuits and compares their phase timings and state sizes with the baseline.")
+    print("With --backend=stub no SDK is needed, and --token and --email can be left out.")
+    print("\nOptional config overrides:")
+    for key in REGRESSION_CONFIG:
+        print(f"  --{key}=<value> (default: {config[key]})")
+    sys.exit(1)
+
+def baseline_file(config):
+    return config['baseline_file'] or Path(config['results_path']) / "regression_baseline.json"
+
+def load_baseline(baseline_file):
+    if not os.path.exists(baseline_file):
+        return None
+    with open(baseline_file, "r") as f:
+        return json.load(f)
+
+def save_baseline(baseline_file, baseline):
+    temp_file = f"{baseline_file}.{os.getpid()}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(baseline, f, indent=2)
+    os.replace(temp_file, baseline_file)
+
+def measure_rounds(config, slot, circuits, exp_data, backend_factory, rounds, warmup_rounds):
+    """
+    Runs every circuit warmup_rounds + rounds times, one batch per round, and collects the phases of the measured rounds.
+
+    Returns:
+        tuple: ({circuit_name: {phase: [value per measured round]}}, {circuit_name: error of its last failure})
+    """
+    samples = {}
+    failures = {}
+    for round_index in range(warmup_rounds + rounds):
+        is_warmup = round_index < warmup_rounds
+        label = f"Warmup {round_index + 1}" if is_warmup else f"Round {round_index - warmup_rounds + 1}"
+        print(f"\n{label} of {len(circuits)} circuits")
+
+        round_config = {**config, 'run_id': f"{config['run_id']}-{round_index}"}
+        for status, _, circuit_name, payload, wall_time in run_batch(round_config, [slot], circuits, exp_data, backend_factory):
+            stripped_circuit_name = Path(circuit_name).stem
+            if status != "done":
+                failures[stripped_circuit_name] = payload
+                print(f"  {stripped_circuit_name}: failed\n{payload}")
+                continue
+            print(f"  {stripped_circuit_name}: {wall_time:.3f}s, {payload['final_state_memory']:.4g} MB")
+            if is_warmup:
+                continue
+            phases = samples.setdefault(stripped_circuit_name, {})
+            for phase in TIMING_PHASES + MEMORY_PHASES:
+                value = wall_time if phase == "wall_time" else payload.get(phase, "")
+                if value != "":
+                    phases.setdefault(phase, []).append(float(value))
+
+    return samples, failures
+
+def compare(baseline, statistics, relative_tolerance, min_delta, memory_tolerance):
+    """
+    Compares the median of every phase with its baseline.
+
+    A timing regresses if its median grew by more than the largest of relative_tolerance of
+    the baseline median, OUTLIER_FENCE times the larger IQR of the baseline and this run, and
+    min_delta seconds, so noisy phases need a larger change than stable ones. The state size
+    is deterministic for a given backend and regresses if it grew by more than memory_tolerance.
+    A phase that shrank by as much is reported as improved, one without a baseline as new.
+    Circuits of the baseline without statistics are left to the caller.
+
+    Returns:
+        list: One dict per circuit and phase with the fields of REPORT_FIELDNAMES.
+    """
+    rows = []
+    for circuit_name, phases in statistics.items():
+        for phase, stats in phases.items():
+            base = baseline.get(circuit_name, {}).get(phase)
+            row = {"circuit_name": circuit_name, "phase": phase, "median": stats["median"], "iqr": stats["iqr"],
+                   "baseline_median": "", "baseline_iqr": "", "delta": "", "delta_percent": "", "allowed": "", "status": "new"}
+            if base is not None:
+                delta = stats["median"] - base["median"]
+                if phase in MEMORY_PHASES:
+                    allowed = memory_tolerance * base["median"]
+                else:
+                    allowed = max(relative_tolerance * base["median"], OUTLIER_FENCE * max(base["iqr"], stats["iqr"]), min_delta)
+                row.update({
+                    "baseline_median": base["median"],
+                    "baseline_iqr": base["iqr"],
+                    "delta": delta,
+                    "delta_percent": 100 * delta / base["median"] if base["median"] else "",
+                    "allowed": allowed,
+                    "status": "regressed" if delta > allowed else "improved" if delta < -allowed else "ok",
+                })
+            rows.append(row)
+    return rows
+
+def print_report(rows):
+    print(f"\n{'circuit':<34}{'phase':<24}{'baseline':>12}{'median':>12}{'delta':>12}{'delta %':>9}{'allowed':>12}  status")
+    for row in rows:
+        numbers = "".join(f"{row[field]:>12.4g}" if row[field] != "" else f"{'':>12}" for field in ("baseline_median", "median", "delta"))
+        percent = f"{row['delta_percent']:>+8.1f}%" if row["delta_percent"] != "" else f"{'':>9}"
+        allowed = f"{row['allowed']:>12.4g}" if row["allowed"] != "" else f"{'':>12}"
+        print(f"{row['circuit_name']:<34}{row['phase']:<24}{numbers}{percent}{allowed}  {row['status']}")
+
+def main():
+    config = REGRESSION_CONFIG.copy()
+
+    positional_args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    optional_args = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+    config = parse_optional_args(config, optional_args)
+
+    if len(positional_args) < 2:
+        print("Error: Missing required arguments.\n")
+        print_usage(config)
+
+    if config['backend'] not in ("stub", "sdk"):
+        print("Error: backend must be 'stub' or 'sdk'.\n")
+        print_usage(config)
+    if config['backend'] == "stub":
+        for key in SDK_REQUIRED_KEYS:
+            if config[key] is None:
+                config[key] = ""
+
+    benchmark_circuit.validate_config(config, print_usage)
+
+    try:
+        slot = (int(positional_args[0]), int(positional_args[1]))
+        rounds = int(config['rounds'])
+        warmup_rounds = int(config['warmup_rounds'])
+        relative_tolerance = float(config['relative_tolerance'])
+        min_delta = float(config['min_delta'])
+        memory_tolerance = float(config['memory_tolerance'])
+    except ValueError:
+        print("Error: Backend and GPU index, rounds and tolerances must be numbers.\n")
+        print_usage(config)
+
+    if rounds < 1:
+        print("Error: rounds must be at least 1.\n")
+        print_usage(config)
+
+    thresholds = dict(load_circuit_list(config['circuit_list']))
+    available = benchmark_circuit.list_circuit_files(config['pytket_circuit_path'])
+    circuits = []
+    for name in [name for name in config['regression_circuits'].split(",") if name]:
+        if name not in thresholds:
+            print(f"Error: Regression circuit '{name}' is not in {config['circuit_list']}.\n")
+            print_usage(config)
+        if f"{name}.json" not in available:
+            print(f"Error: Regression circuit file '{name}.json' not found in {config['pytket_circuit_path']}.\n")
+            print_usage(config)
+        circuits.append((f"{name}.json", thresholds[name]))
+
+    baseline_path = baseline_file(config)
+    baseline = load_baseline(baseline_path)
+    if baseline is not None and baseline["backend"] != config['backend']:
+        print(f"Error: The baseline {baseline_path} was recorded with --backend={baseline['backend']}, not {config['backend']}.")
+        sys.exit(1)
+    if baseline is not None and config['update_baseline'] == "0":
+        for circuit_name, threshold in circuits:
+            recorded_threshold = baseline["thresholds"].get(Path(circuit_name).stem, threshold)
+            if recorded_threshold != threshold:
+                print(f"Error: The baseline of {Path(circuit_name).stem} was recorded at threshold {recorded_threshold}, "
+                      f"{config['circuit_list']} now has {threshold}. Rerun with --update_baseline=1.")
+                sys.exit(1)
+
+    exp_data = benchmark_circuit.load_exp_data(config['json_file'])
+    config['run_id'] = config['run_id'] or f"regression-{new_run_id()}"
+    backend_factory = stub_backend.open_stub_backend if config['backend'] == "stub" else benchmark_circuit.open_backend
+
+    print(f"Measuring {len(circuits)} regression circuits, {warmup_rounds} warmup and {rounds} measured rounds, on the {config['backend']} backend")
+    samples, failures = measure_rounds(config, slot, circuits, exp_data, backend_factory, rounds, warmup_rounds)
+    statistics = {circuit_name: {phase: summarize(values) for phase, values in phases.items()} for circuit_name, phases in samples.items()}
+
+    baseline_circuits = baseline["circuits"] if baseline else {}
+    rows = compare(baseline_circuits, statistics, relative_tolerance, min_delta, memory_tolerance)
+    # A circuit that failed in any round, or that has a baseline but was not run, fails the suite
+    for circuit_name in failures:
+        rows.append({**{field: "" for field in REPORT_FIELDNAMES}, "circuit_name": circuit_name, "phase": "all", "status": "failed"})
+    for circuit_name in baseline_circuits:
+        if circuit_name not in statistics and circuit_name not in failures:
+            rows.append({**{field: "" for field in REPORT_FIELDNAMES}, "circuit_name": circuit_name, "phase": "all", "status": "missing"})
+
+    report_file = Path(config['results_path']) / config['regression_report']
+    write_csv_line(report_file, REPORT_FIELDNAMES, mode='w')
+    for row in rows:
+        write_csv_line(report_file, [row[field] for field in REPORT_FIELDNAMES])
+
+    print_report(rows)
+    print(f"\nRegression report written to {report_file}")
+
+    failed = [row for row in rows if row["status"] in ("regressed", "missing", "failed")]
+
+    if config['update_baseline'] != "0":
+        if failures:
+            print(f"Error: Not updating the baseline, {len(failures)} circuits failed.")
+            sys.exit(1)
+        save_baseline(baseline_path, {
+            "backend": config['backend'],
+            "recorded": time.time(),
+            "host": socket.gethostname(),
+            "python": python_version(),
+            "rounds": rounds,
+            "thresholds": {Path(name).stem: threshold for name, threshold in circuits},
+            "circuits": statistics,
+        })
+        print(f"Baseline written to {baseline_path}")
+    elif baseline is None:
+        print(f"No baseline at {baseline_path}; run with --update_baseline=1 to record one.")
+
+    if failed:
+        print(f"FAIL: {len(failed)} of {len(rows)} checks regressed or failed.")
+        if config['update_baseline'] == "0":
+            sys.exit(1)
+    else:
+        print(f"PASS: {len(rows)} checks within the noise thresholds of the baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+
+def run_key(circuit_digest, threshold, backend_index, pass_config):
+    """
+    Key of the checkpoints of one run.
+
+    A checkpoint is only resumed by a run of the same circuit (content hash of its JSON), with
+    the same threshold, on the same backend and with the same transpile pass configuration.
+    """
+    key = {
+        "circuit": circuit_digest,
+        "threshold": threshold,
+        "backend_index": backend_index,
+        "pass_config": pass_config,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def write_json_atomic(filename, data):
+    temp_file = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_file, filename)
+
+class ValueLog:
+    """
+    Append-only JSON-lines log of (key, value) pairs, one line per finished unit of work.
+
+    Every line is flushed as soon as it is written. A line torn by a crash is ignored when the
+    log is read back, so the log always holds exactly the units that completed.
+    """
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.values = {}
+        self.lock = threading.Lock()
+        valid_size = 0
+        try:
+            with open(log_file, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        key, value = json.loads(line)
+                    except ValueError:
+                        break
+                    self.values[key] = value
+                    valid_size += len(line)
+        except FileNotFoundError:
+            pass
+        self.f = open(log_file, "ab")
+        self.f.truncate(valid_size)
+
+    def record(self, key, value):
+        with self.lock:
+            self.values[key] = value
+            self.f.write(json.dumps([key, value]).encode() + b"\n")
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class RunCheckpoint:
+    """
+    Manifest of the completed steps of one run, stored as <checkpoint_dir>/<key>/manifest.json.
+
+    Each step records its outputs (timings, values, file sizes) once it is completed, and the
+    manifest is rewritten atomically after every update, so a crash leaves either the old or
+    the new manifest. Steps with finer units of work keep their progress in the same step
+    entry or in a ValueLog in the checkpoint directory.
+    """
+
+    def __init__(self, checkpoint_dir, key, params, resume):
+        self.directory = Path(checkpoint_dir) / key
+        self.manifest_file = self.directory / "manifest.json"
+        self.lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self.manifest = None
+        if resume:
+            try:
+                with open(self.manifest_file, "r") as f:
+                    self.manifest = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+
+        self.resumed = self.manifest is not None
+        if not self.resumed:
+            for log_file in self.directory.glob("*.jsonl"):
+                log_file.unlink()
+            self.manifest = {"key": key, "params": params, "created": time.time(), "steps": {}}
+            self.save()
+
+    def save(self):
+        write_json_atomic(self.manifest_file, self.manifest)
+
+    def step(self, name):
+        """Returns the recorded entry of a step, empty if nothing was recorded."""
+        with self.lock:
+            return dict(self.manifest["steps"].get(name, {}))
+
+    def completed(self, name):
+        return self.step(name).get("completed", False)
+
+    def update(self, name, **values):
+        with self.lock:
+            self.manifest["steps"].setdefault(name, {}).update(values)
+            self.manifest["updated"] = time.time()
+            self.save()
+
+    def complete(self, name, **values):
+        self.update(name, completed=True, **values)
+
+    def reset(self, names):
+        """Forgets the given steps and their logs, e.g. because the state they were computed from is gone."""
+        with self.lock:
+            if not any(name in self.manifest["steps"] for name in names):
+                return
+            for name in names:
+                self.manifest["steps"].pop(name, None)
+                log_file = self.directory / f"{name}.jsonl"
+                if log_file.exists():
+                    log_file.unlink()
+            self.save()
+
+    def log(self, name):
+        return ValueLog(self.directory / f"{name}.jsonl")
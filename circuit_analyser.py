@@ -0,0 +1,282 @@
+import os
+import re
+import sys
+import csv
+import json
+import time
+from pathlib import Path
+from itertools import islice
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+import gate_ir
+
+# A gate statement with one or two qubit operands. Measurements (operand followed by ->),
+# barriers over more than two qubits and the bodies of gate definitions do not match.
+QASM_GATE = re.compile(r"^[ \t]*([a-z_]\w*)(?:\([^)]*\))?[ \t]+(\w+)\[(\d+)\](?:[ \t]*,[ \t]*(\w+)\[(\d+)\])?[ \t]*;", re.M)
+QASM_QREG = re.compile(r"^[ \t]*qreg[ \t]+(\w+)\[(\d+)\][ \t]*;", re.M)
+QASM_NON_GATES = {"qreg", "creg", "barrier", "reset", "measure"}
+
+ANALYSIS_FIELDNAMES = [
+    "circuit", "num_qubits", "gates", "one_qubit_gates", "two_qubit_gates", "depth", "two_qubit_depth",
+    "interaction_edges", "max_degree", "max_cut_width", "max_cut_gates", "max_cut_position", "max_entanglement_bound", "analysis_time",
+]
+
+def qasm_chunks(qasm_file, chunk_lines=65536):
+    """
+    Streams the one- and two-qubit gates of a QASM file, chunk_lines lines at a time.
+
+    Yields:
+        tuple: (num_qubits declared so far, q0 array, q1 array with -1 for single-qubit gates)
+    """
+    offsets = {}
+    num_qubits = 0
+    with open(qasm_file, "r") as f:
+        while True:
+            text = "".join(islice(f, chunk_lines))
+            if not text:
+                break
+            for name, size in QASM_QREG.findall(text):
+                offsets[name] = num_qubits
+                num_qubits += int(size)
+            gates = [g for g in QASM_GATE.findall(text) if g[0] not in QASM_NON_GATES]
+            if not gates:
+                continue
+            if len(offsets) > 1:
+                q0 = np.array([offsets[g[1]] + int(g[2]) for g in gates], dtype=np.int64)
+                q1 = np.array([offsets[g[3]] + int(g[4]) if g[3] else -1 for g in gates], dtype=np.int64)
+            else:
+                columns = list(zip(*gates))
+                q0 = np.array(columns[2], dtype=np.int64)
+                q1 = np.array([b or -1 for b in columns[4]], dtype=np.int64)
+            yield num_qubits, q0, q1
+
+def gate_file_chunks(gate_file, chunk_size=1 << 20):
+    """Streams the gates of a gate_ir file from its memory map, like qasm_chunks."""
+    header, gates = gate_ir.read_gate_file(gate_file)
+    for start in range(0, len(gates), chunk_size):
+        chunk = gates[start:start + chunk_size]
+        chunk = chunk[chunk["opcode"] != gate_ir.OPCODE["measure"]]
+        q1 = np.where(chunk["opcode"] == gate_ir.OPCODE["cx"], chunk["q1"], -1)
+        yield header["num_qubits"], np.asarray(chunk["q0"], dtype=np.int64), np.asarray(q1, dtype=np.int64)
+
+def circuit_chunks(circuit_file, chunk_lines=65536):
+    if str(circuit_file).endswith(".gates"):
+        return gate_file_chunks(circuit_file)
+    return qasm_chunks(circuit_file, chunk_lines)
+
+class CircuitAnalysis:
+    """
+    Structure metrics of a circuit, accumulated over a stream of gate chunks in bounded memory.
+
+    The memory is O(num_qubits^2) for the interaction graph, whatever the number of gates.
+    Cuts are taken under the linear qubit ordering: cut k separates qubits 0..k from k+1..n-1.
+    A two-qubit gate across cut k can at most double the Schmidt rank there twice, and the
+    rank is at most 2^min(k + 1, n - k - 1), so the entanglement bound of the cut is
+    min(2 * crossing gates, k + 1, n - k - 1) ebits. The entanglement profile samples the
+    largest bound over all cuts every profile_interval gates.
+    """
+
+    def __init__(self, profile_interval=10000):
+        self.profile_interval = profile_interval
+        self.num_qubits = 0
+        self.gates = 0
+        self.two_qubit_gates = 0
+        self.level = []
+        self.two_qubit_level = []
+        self.interactions = np.zeros((0, 0), dtype=np.int64)
+        self.crossings = np.zeros(0, dtype=np.int64)
+        self.profile = []
+
+    def resize(self, num_qubits):
+        if num_qubits <= self.num_qubits:
+            return
+        grow = num_qubits - self.num_qubits
+        self.interactions = np.pad(self.interactions, ((0, grow), (0, grow)))
+        self.crossings = np.pad(self.crossings, (0, grow))
+        self.level += [0] * grow
+        self.two_qubit_level += [0] * grow
+        self.num_qubits = num_qubits
+
+    def entanglement_bound(self):
+        n = self.num_qubits
+        if n < 2:
+            return 0
+        k = np.arange(n - 1)
+        return int(np.minimum(2 * self.crossings[:n - 1], np.minimum(k + 1, n - k - 1)).max())
+
+    def add(self, num_qubits, q0, q1):
+        self.resize(max(num_qubits, int(q0.max(initial=-1)) + 1, int(q1.max(initial=-1)) + 1))
+
+        level = self.level
+        two_qubit_level = self.two_qubit_level
+        for a, b in zip(q0.tolist(), q1.tolist()):
+            if b < 0:
+                level[a] += 1
+            else:
+                level[a] = level[b] = max(level[a], level[b]) + 1
+                two_qubit_level[a] = two_qubit_level[b] = max(two_qubit_level[a], two_qubit_level[b]) + 1
+
+        two_qubit = q1 >= 0
+        lo = np.minimum(q0[two_qubit], q1[two_qubit])
+        hi = np.maximum(q0[two_qubit], q1[two_qubit])
+        np.add.at(self.interactions, (lo, hi), 1)
+
+        # Sample the profile at every multiple of profile_interval inside this chunk
+        positions = np.cumsum(two_qubit) if len(q0) else np.zeros(0, dtype=np.int64)
+        start = 0
+        next_sample = (self.gates // self.profile_interval + 1) * self.profile_interval
+        while start < len(q0):
+            end = min(len(q0), start + next_sample - self.gates)
+            first = positions[start - 1] if start > 0 else 0
+            last = positions[end - 1]
+            diff = np.zeros(self.num_qubits + 1, dtype=np.int64)
+            np.add.at(diff, lo[first:last], 1)
+            np.add.at(diff, hi[first:last], -1)
+            self.crossings += np.cumsum(diff)[:self.num_qubits]
+            self.gates += end - start
+            if self.gates == next_sample:
+                self.profile.append((self.gates, self.entanglement_bound()))
+                next_sample += self.profile_interval
+            start = end
+        self.two_qubit_gates += int(np.count_nonzero(two_qubit))
+
+    def result(self):
+        n = self.num_qubits
+        edges = np.argwhere(self.interactions > 0)
+        weights = self.interactions[edges[:, 0], edges[:, 1]] if len(edges) else np.zeros(0, dtype=np.int64)
+        cut_width = np.zeros(n + 1, dtype=np.int64)
+        cut_gates = np.zeros(n + 1, dtype=np.int64)
+        np.add.at(cut_width, edges[:, 0], 1)
+        np.add.at(cut_width, edges[:, 1], -1)
+        np.add.at(cut_gates, edges[:, 0], weights)
+        np.add.at(cut_gates, edges[:, 1], -weights)
+        cut_width = np.cumsum(cut_width)[:max(n - 1, 0)]
+        cut_gates = np.cumsum(cut_gates)[:max(n - 1, 0)]
+        degree = np.bincount(edges.ravel(), minlength=n) if n else np.zeros(0, dtype=np.int64)
+
+        if not self.profile or self.profile[-1][0] != self.gates:
+            self.profile.append((self.gates, self.entanglement_bound()))
+
+        return {
+            "num_qubits": n,
+            "gates": self.gates,
+            "one_qubit_gates": self.gates - self.two_qubit_gates,
+            "two_qubit_gates": self.two_qubit_gates,
+            "depth": max(self.level, default=0),
+            "two_qubit_depth": max(self.two_qubit_level, default=0),
+            "interaction_edges": len(edges),
+            "max_degree": int(degree.max(initial=0)),
+            "max_cut_width": int(cut_width.max(initial=0)),
+            "max_cut_gates": int(cut_gates.max(initial=0)),
+            "max_cut_position": int(cut_width.argmax()) if len(cut_width) else 0,
+            "max_entanglement_bound": self.profile[-1][1],
+            "cut_width": cut_width.tolist(),
+            "cut_gates": cut_gates.tolist(),
+            "entanglement_profile": self.profile,
+            "interaction_graph": [[int(a), int(b), int(w)] for (a, b), w in zip(edges.tolist(), weights.tolist())],
+        }
+
+def analyse_circuit(circuit_file, profile_interval=10000, chunk_lines=65536):
+    """
+    Analyses a transpiled QASM or gate file in one streaming pass.
+
+    Returns:
+        dict: The ANALYSIS_FIELDNAMES values, plus the per-cut widths (cut_width, cut_gates), the
+              entanglement_profile as (gates, ebits) pairs and the interaction_graph as (a, b, gates) edges.
+    """
+    start_time = time.perf_counter()
+    analysis = CircuitAnalysis(profile_interval)
+    for num_qubits, q0, q1 in circuit_chunks(circuit_file, chunk_lines):
+        analysis.add(num_qubits, q0, q1)
+    result = analysis.result()
+    result["circuit"] = Path(circuit_file).stem
+    result["analysis_time"] = time.perf_counter() - start_time
+    return result
+
+def circuit_files(paths, names=None):
+    """
+    The circuit files in paths (files or directories), the gate file of a circuit taking
+    precedence over its QASM. With names, only those circuits are kept.
+    """
+    found = {}
+    for path in map(Path, paths):
+        files = sorted(path.iterdir()) if path.is_dir() else [path]
+        for circuit_file in files:
+            if circuit_file.suffix not in (".gates", ".qasm") or (names is not None and circuit_file.stem not in names):
+                continue
+            key = (circuit_file.parent, circuit_file.stem)
+            if circuit_file.suffix == ".gates" or key not in found:
+                found[key] = circuit_file
+    return list(found.values())
+
+def analyse_circuits(files, workers=None, profile_interval=10000, chunk_lines=65536):
+    """
+    Analyses files in parallel worker processes, largest file first.
+
+    Yields:
+        tuple: (circuit file, analysis dict or None, error or None) as each analysis finishes,
+               so the order is that of completion, not of files.
+    """
+    files = sorted(files, key=lambda f: os.path.getsize(f), reverse=True)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=mp.get_context("spawn")) as pool:
+        futures = {pool.submit(analyse_circuit, str(f), profile_interval, chunk_lines): f for f in files}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Static structure report of transpiled circuits (QASM or gate files), without simulating them.")
+    parser.add_argument("paths", type=str, nargs="+",
+                        help="Circuit files or directories of them, e.g. the transpiled or transpiled dagger path.")
+    parser.add_argument("--circuit_list", type=str, default=None,
+                        help="Only analyse the circuits of this circuit list.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (default: one per CPU).")
+    parser.add_argument("--output", type=str, default="circuit_analysis.csv",
+                        help="CSV report, one row per circuit. The full analysis (cut and entanglement profiles, "
+                             "interaction graph) is written next to it as JSON.")
+    parser.add_argument("--profile_interval", type=int, default=10000,
+                        help="Gates between two points of the entanglement profile (default 10000).")
+    parser.add_argument("--chunk_lines", type=int, default=65536,
+                        help="QASM lines parsed at a time, which bounds the memory (default 65536).")
+
+    args = parser.parse_args()
+
+    names = None
+    if args.circuit_list:
+        with open(args.circuit_list, "r") as f:
+            names = {item["name"] for item in json.load(f)}
+
+    files = circuit_files(args.paths, names)
+    if not files:
+        print("Error: No .qasm or .gates files found.")
+        sys.exit(1)
+
+    start_time = time.perf_counter()
+    analyses = []
+    failed = 0
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=ANALYSIS_FIELDNAMES, extrasaction="ignore")
+        writer.writeheader()
+        for circuit_file, analysis, error in analyse_circuits(files, args.workers, args.profile_interval, args.chunk_lines):
+            if error is not None:
+                failed += 1
+                print(f"{circuit_file}: failed: {error}")
+                continue
+            writer.writerow(analysis)
+            analyses.append(analysis)
+            print(f"{analysis['circuit']}: {analysis['num_qubits']} qubits, {analysis['two_qubit_gates']} two-qubit gates, depth {analysis['depth']}, "
+                  f"max cut width {analysis['max_cut_width']} at qubit {analysis['max_cut_position']}, "
+                  f"entanglement bound {analysis['max_entanglement_bound']} ebits ({analysis['analysis_time']:.2f}s)")
+
+    with open(Path(args.output).with_suffix(".json"), "w") as f:
+        json.dump(analyses, f)
+
+    print(f"Analysed {len(analyses)} circuits in {time.perf_counter() - start_time:.2f}s ({failed} failed). Report written to {args.output}")
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,149 @@
+import os
+import json
+import struct
+import numpy as np
+
+GATE_FILE_MAGIC = b"QRGATES1"
+
+# Opcode of a gate is its index in this list
+OPCODES = ["u3", "cx", "h", "x", "measure"]
+OPCODE = {name: i for i, name in enumerate(OPCODES)}
+
+# For measure, q1 holds the classical bit
+GATE_DTYPE = np.dtype([
+    ("opcode", np.uint8),
+    ("q0", np.int32),
+    ("q1", np.int32),
+    ("params", np.float64, (3,)),
+])
+
+HEADER_ALIGNMENT = 64
+
+def write_gate_header(f, num_qubits, num_clbits, num_gates):
+    header = json.dumps({
+        "num_qubits": int(num_qubits),
+        "num_clbits": int(num_clbits),
+        "num_gates": int(num_gates),
+        "opcodes": OPCODES,
+    }).encode()
+    prefix_size = len(GATE_FILE_MAGIC) + 4
+    header += b" " * (-(prefix_size + len(header)) % HEADER_ALIGNMENT)
+
+    f.write(GATE_FILE_MAGIC)
+    f.write(struct.pack("<I", len(header)))
+    f.write(header)
+
+def write_gate_file(gate_file, gates, num_qubits, num_clbits):
+    """
+    Writes a gate array to gate_file.
+
+    The file holds GATE_FILE_MAGIC, a little-endian uint32 header length, a JSON header
+    padded to HEADER_ALIGNMENT bytes and then the raw GATE_DTYPE records, so read_gate_file
+    can memory-map the records without parsing them.
+
+    Args:
+        gate_file (str): Output file, normally <circuit>.gates.
+        gates (np.ndarray): Array of GATE_DTYPE records in circuit order.
+        num_qubits (int): Number of qubits of the circuit.
+        num_clbits (int): Number of classical bits of the circuit.
+    """
+    temp_file = f"{gate_file}.{os.getpid()}.tmp"
+    with open(temp_file, "wb") as f:
+        write_gate_header(f, num_qubits, num_clbits, len(gates))
+        np.ascontiguousarray(gates, dtype=GATE_DTYPE).tofile(f)
+    os.replace(temp_file, gate_file)
+
+def read_gate_file(gate_file, mmap=True):
+    """
+    Reads a file written by write_gate_file.
+
+    Returns:
+        tuple: (header dict, gate array). With mmap the array is a read-only memory map of the file.
+    """
+    with open(gate_file, "rb") as f:
+        if f.read(len(GATE_FILE_MAGIC)) != GATE_FILE_MAGIC:
+            raise ValueError(f"{gate_file} is not a gate file")
+        (header_size,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_size))
+        offset = f.tell()
+
+    if header["opcodes"] != OPCODES[:len(header["opcodes"])]:
+        raise ValueError(f"{gate_file} was written with an incompatible opcode table")
+
+    if header["num_gates"] == 0:
+        return header, np.empty(0, dtype=GATE_DTYPE)
+    if mmap:
+        gates = np.memmap(gate_file, dtype=GATE_DTYPE, mode="r", offset=offset, shape=(header["num_gates"],))
+    else:
+        gates = np.fromfile(gate_file, dtype=GATE_DTYPE, count=header["num_gates"], offset=offset)
+    return header, gates
+
+def gate_counts(gates):
+    counts = np.bincount(gates["opcode"], minlength=len(OPCODES))
+    return {OPCODES[i]: int(count) for i, count in enumerate(counts) if count}
+
+def invert_gates(gates):
+    """
+    Returns the inverse circuit of a gate array: gates in reverse order, u3(theta,phi,lambda)
+    replaced by u3(-theta,-lambda,-phi) and measurements dropped. cx, h and x are self-inverse.
+    """
+    inverse = np.array(gates[::-1][gates["opcode"][::-1] != OPCODE["measure"]])
+    is_u3 = inverse["opcode"] == OPCODE["u3"]
+    params = inverse["params"][is_u3]
+    inverse["params"][is_u3] = -params[:, [0, 2, 1]]
+    return inverse
+
+def write_dagger_gate_file(gate_file, dagger_file, chunk_size=1 << 20):
+    """
+    Writes the inverse of gate_file to dagger_file, chunk_size gates at a time.
+
+    Returns:
+        int: Number of gates written.
+    """
+    header, gates = read_gate_file(gate_file)
+    keep = gates["opcode"] != OPCODE["measure"]
+    num_gates = int(np.count_nonzero(keep))
+
+    temp_file = f"{dagger_file}.{os.getpid()}.tmp"
+    with open(temp_file, "wb") as f:
+        write_gate_header(f, header["num_qubits"], header["num_clbits"], num_gates)
+        for end in range(len(gates), 0, -chunk_size):
+            invert_gates(gates[max(end - chunk_size, 0):end]).tofile(f)
+    os.replace(temp_file, dagger_file)
+    return num_gates
+
+def gates_to_qasm(gate_file, qasm_file):
+    """Exports a gate file as OpenQASM 2.0, for debugging."""
+    header, gates = read_gate_file(gate_file)
+    with open(qasm_file, "w") as f:
+        f.write('OPENQASM 2.0;\ninclude "qelib1.inc";\n')
+        f.write(f"qreg q[{header['num_qubits']}];\n")
+        if header["num_clbits"]:
+            f.write(f"creg c[{header['num_clbits']}];\n")
+        for opcode, q0, q1, params in zip(gates["opcode"].tolist(), gates["q0"].tolist(), gates["q1"].tolist(), gates["params"].tolist()):
+            name = OPCODES[opcode]
+            if name == "u3":
+                f.write(f"u3({params[0]!r},{params[1]!r},{params[2]!r}) q[{q0}];\n")
+            elif name == "cx":
+                f.write(f"cx q[{q0}],q[{q1}];\n")
+            elif name == "measure":
+                f.write(f"measure q[{q0}] -> c[{q1}];\n")
+            else:
+                f.write(f"{name} q[{q0}];\n")
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Inspect or convert a binary gate file.")
+    parser.add_argument("gate_file", type=str,
+                        help="The gate file written by transpile_pytket.py.")
+    parser.add_argument("--qasm", type=str, default=None,
+                        help="Export the circuit as QASM to this file.")
+
+    args = parser.parse_args()
+
+    header, gates = read_gate_file(args.gate_file)
+    print(f"Qubits: {header['num_qubits']} Classical bits: {header['num_clbits']} Gates: {header['num_gates']}")
+    print(f"Circuit operations: {gate_counts(gates)}")
+    if args.qasm:
+        gates_to_qasm(args.gate_file, args.qasm)
+        print(f"QASM written to {args.qasm}")
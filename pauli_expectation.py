@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from transpile_cache import file_digest
+
+class PauliTable:
+    """
+    Pauli operators of one circuit as packed X/Z bit masks.
+
+    Row i of x and z holds the bits of operators[i]; character k of an operator string
+    acts on qubit k. Operators that only differ in case or in trailing identities share a
+    row of unique_x/unique_z, and inverse maps every operator to its unique row.
+    """
+
+    def __init__(self, operators, num_qubits):
+        self.operators = list(operators)
+        self.num_qubits = num_qubits
+
+        chars = np.full((len(self.operators), num_qubits), ord("I"), dtype=np.uint8)
+        for i, operator in enumerate(self.operators):
+            if len(operator) > num_qubits:
+                raise ValueError(f"Pauli operator {operator} acts on more than {num_qubits} qubits")
+            chars[i, :len(operator)] = np.frombuffer(operator.upper().encode(), dtype=np.uint8)
+
+        valid = np.isin(chars, np.frombuffer(b"IXYZ", dtype=np.uint8))
+        if not valid.all():
+            row = int(np.nonzero(~valid.all(axis=1))[0][0])
+            raise ValueError(f"Invalid Pauli operator {self.operators[row]}")
+
+        x = (chars == ord("X")) | (chars == ord("Y"))
+        z = (chars == ord("Z")) | (chars == ord("Y"))
+        self.x = np.packbits(x, axis=1)
+        self.z = np.packbits(z, axis=1)
+
+        packed = np.concatenate([self.x, self.z], axis=1)
+        unique_rows, first_index, self.inverse = np.unique(packed, axis=0, return_index=True, return_inverse=True)
+        self.inverse = self.inverse.reshape(-1)
+        self.first_index = first_index
+        width = self.x.shape[1]
+        self.unique_x = unique_rows[:, :width]
+        self.unique_z = unique_rows[:, width:]
+        self.unique_is_identity = ~unique_rows.any(axis=1)
+
+    def canonical(self, unique_row):
+        """Returns the upper-case operator string of a unique row, one character per qubit."""
+        x = np.unpackbits(self.unique_x[unique_row])[:self.num_qubits].astype(bool)
+        z = np.unpackbits(self.unique_z[unique_row])[:self.num_qubits].astype(bool)
+        chars = np.full(self.num_qubits, ord("I"), dtype=np.uint8)
+        chars[x & ~z] = ord("X")
+        chars[x & z] = ord("Y")
+        chars[~x & z] = ord("Z")
+        return chars.tobytes().decode()
+
+    def unique_codes(self):
+        """Returns one row per unique operator with 0 for I, 1 for X, 2 for Z and 3 for Y on every qubit."""
+        x = np.unpackbits(self.unique_x, axis=1)[:, :self.num_qubits]
+        z = np.unpackbits(self.unique_z, axis=1)[:, :self.num_qubits]
+        return x | (z << 1)
+
+class ExpectationMemo:
+    """
+    Expectation values already computed for one saved state, stored as <memo_dir>/<state hash>.json.
+
+    The state file is hashed by content, so a memo is only reused for an identical state.
+    """
+
+    def __init__(self, memo_dir, system_state_file):
+        self.state_hash = file_digest(system_state_file)
+        self.memo_file = os.path.join(memo_dir, f"{self.state_hash}.json")
+        os.makedirs(memo_dir, exist_ok=True)
+        try:
+            with open(self.memo_file, "r") as f:
+                self.values = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.values = {}
+
+    def save(self):
+        temp_file = f"{self.memo_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.values, f)
+        os.replace(temp_file, self.memo_file)
+
+def evaluate_expectations(result, table, workers=1, memo=None, now=time.perf_counter, checkpoint=None):
+    """
+    Computes the expectation value of every operator of table against a prepared state.
+
+    Identity operators are 1 without calling the simulator, each distinct operator is
+    evaluated once, memoized and checkpointed values are reused and the remaining operators
+    are evaluated on a thread pool, all against the same result object. result is only
+    used when an operator has to be computed.
+
+    Args:
+        result: Job result holding the prepared state (get_pauliexpectationvalue).
+        table (PauliTable): Operators to evaluate.
+        workers (int, optional): Number of threads calling the simulator. Defaults to 1.
+        memo (ExpectationMemo, optional): Values of earlier runs on the same state.
+        now (callable, optional): Clock used for the per-operator latency, in seconds.
+        checkpoint (checkpoint.ValueLog, optional): Values of an interrupted evaluation of the
+            same run. Every computed value is recorded in it as soon as it is known.
+
+    Returns:
+        tuple: (list of values in table.operators order,
+                list of (operator, source, latency) rows with source identity/memo/checkpoint/computed/duplicate)
+    """
+    qubit_list = list(range(table.num_qubits))
+    num_unique = len(table.first_index)
+    values = [None] * num_unique
+    sources = [None] * num_unique
+    latencies = [0.0] * num_unique
+    pending = []
+
+    for row in range(num_unique):
+        canonical = table.canonical(row)
+        if table.unique_is_identity[row]:
+            values[row], sources[row] = 1.0, "identity"
+        elif memo is not None and canonical in memo.values:
+            values[row], sources[row] = memo.values[canonical], "memo"
+        elif checkpoint is not None and canonical in checkpoint.values:
+            values[row], sources[row] = checkpoint.values[canonical], "checkpoint"
+        else:
+            pending.append(row)
+
+    def evaluate(row):
+        operator = table.operators[table.first_index[row]]
+        start_time = now()
+        exp_val = result.get_pauliexpectationvalue(operator[::-1], qubit_list, 0, 0)
+        return exp_val.real, now() - start_time
+
+    def finished(row, value, latency):
+        values[row], sources[row], latencies[row] = value, "computed", latency
+        if memo is not None:
+            memo.values[table.canonical(row)] = value
+        if checkpoint is not None:
+            checkpoint.record(table.canonical(row), value)
+
+    if workers > 1 and len(pending) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(evaluate, row): row for row in pending}
+            for future in as_completed(futures):
+                finished(futures[future], *future.result())
+    else:
+        for row in pending:
+            finished(row, *evaluate(row))
+
+    if memo is not None and pending:
+        memo.save()
+
+    operator_values = []
+    timings = []
+    seen = set()
+    for i, operator in enumerate(table.operators):
+        row = int(table.inverse[i])
+        operator_values.append(values[row])
+        if row in seen:
+            timings.append((operator, "duplicate", 0.0))
+        else:
+            seen.add(row)
+            timings.append((operator, sources[row], latencies[row]))
+
+    return operator_values, timings
+
+def qwc_groups(table):
+    """
+    Partitions the non-identity unique operators of table into qubit-wise commuting groups.
+
+    Operators are placed greedily, heaviest first, into the first group whose measurement
+    basis agrees with them on every qubit both act on.
+
+    Returns:
+        list: (basis, rows) per group. basis holds the code (see PauliTable.unique_codes) each
+              qubit is measured in, 0 if no operator of the group acts on it. rows are unique rows.
+    """
+    codes = table.unique_codes()
+    weights = np.count_nonzero(codes, axis=1)
+    bases = np.zeros((0, table.num_qubits), dtype=codes.dtype)
+    members = []
+
+    for row in np.argsort(-weights, kind="stable"):
+        if weights[row] == 0:
+            continue
+        code = codes[row]
+        compatible = np.all((code == 0) | (bases == 0) | (bases == code), axis=1)
+        if compatible.any():
+            group = int(np.argmax(compatible))
+            bases[group] = np.where(code != 0, code, bases[group])
+            members[group].append(int(row))
+        else:
+            bases = np.vstack([bases, code])
+            members.append([int(row)])
+
+    return [(bases[i], members[i]) for i in range(len(members))]
+
+def memory_to_bits(memory, num_qubits):
+    """
+    Converts sampled bitstrings to a (shots, num_qubits) uint8 array with column k holding qubit k.
+
+    Bitstrings are little-endian like qiskit's: the last character is qubit 0.
+    """
+    joined = "".join(sample.replace(" ", "") for sample in memory).encode()
+    bits = np.frombuffer(joined, dtype=np.uint8).reshape(len(memory), -1) - ord("0")
+    return bits[:, ::-1][:, :num_qubits]
+
+def estimate_from_bits(bits, codes):
+    """
+    Estimates the expectation values of qubit-wise commuting operators from samples taken in their common basis.
+
+    Args:
+        bits (np.ndarray): (shots, num_qubits) samples from memory_to_bits.
+        codes (np.ndarray): (operators, num_qubits) operator codes, see PauliTable.unique_codes.
+
+    Returns:
+        tuple: (estimates, standard errors), one entry per operator.
+    """
+    support = (codes != 0).astype(np.int32)
+    parity = (bits.astype(np.int32) @ support.T) & 1
+    estimates = 1.0 - 2.0 * parity.mean(axis=0)
+    std_errors = np.sqrt(np.maximum(1.0 - estimates ** 2, 0.0) / bits.shape[0])
+    return estimates, std_errors
@@ -0,0 +1,138 @@
+import os
+import re
+import ast
+import math
+import operator
+from pathlib import Path
+
+QASM_HEADER_STATEMENTS = ("OPENQASM", "include", "qreg", "creg")
+
+SELF_INVERSE_GATES = {"id", "x", "y", "z", "h", "cx", "cy", "cz", "ch", "swap", "ccx", "cswap", "barrier"}
+
+INVERSE_GATE_NAMES = {"s": "sdg", "sdg": "s", "t": "tdg", "tdg": "t", "sx": "sxdg", "sxdg": "sx"}
+
+# Gates whose inverse is the same gate with every angle negated
+NEGATED_ANGLE_GATES = {"rx", "ry", "rz", "u1", "p", "crx", "cry", "crz", "cu1", "cp", "rxx", "ryy", "rzz"}
+
+GATE_PATTERN = re.compile(r"^(\w+)\s*(?:\((.*)\))?\s*([^()]*);$")
+
+BINARY_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv, ast.Pow: operator.pow}
+UNARY_OPERATORS = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+QASM_FUNCTIONS = {"sin": math.sin, "cos": math.cos, "tan": math.tan, "exp": math.exp, "ln": math.log, "sqrt": math.sqrt}
+
+def eval_param(expression):
+    """Evaluates an OpenQASM 2 parameter expression such as '3*pi/4' without using eval()."""
+    def evaluate(node):
+        if isinstance(node, ast.Expression):
+            return evaluate(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return float(node.value)
+        if isinstance(node, ast.Name) and node.id == "pi":
+            return math.pi
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            return BINARY_OPERATORS[type(node.op)](evaluate(node.left), evaluate(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            return UNARY_OPERATORS[type(node.op)](evaluate(node.operand))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in QASM_FUNCTIONS and len(node.args) == 1:
+            return QASM_FUNCTIONS[node.func.id](evaluate(node.args[0]))
+        raise ValueError(f"Unsupported QASM parameter expression: {expression}")
+
+    return evaluate(ast.parse(expression.replace("^", "**"), mode="eval"))
+
+def invert_statement(statement):
+    """
+    Returns the inverse of one QASM gate statement, or None if the statement is dropped from the dagger.
+
+    u3(theta,phi,lambda) becomes u3(-theta,-lambda,-phi), self-inverse gates are kept as they are.
+    """
+    match = GATE_PATTERN.match(statement)
+    if match is None:
+        raise ValueError(f"Cannot parse QASM statement: {statement}")
+    gate, params, qubits = match.group(1), match.group(2), match.group(3).strip()
+    angles = [eval_param(p) for p in params.split(",")] if params else []
+
+    if gate == "measure":
+        return None
+    if gate in SELF_INVERSE_GATES:
+        return statement
+    if gate in INVERSE_GATE_NAMES:
+        return f"{INVERSE_GATE_NAMES[gate]} {qubits};"
+    if gate in ("u3", "u", "U", "cu3") and len(angles) == 3:
+        theta, phi, lam = angles
+        return f"{gate}({-theta!r},{-lam!r},{-phi!r}) {qubits};"
+    if gate == "u2" and len(angles) == 2:
+        phi, lam = angles
+        return f"u3({-math.pi / 2!r},{-lam!r},{-phi!r}) {qubits};"
+    if gate in NEGATED_ANGLE_GATES:
+        return f"{gate}({','.join(repr(-a) for a in angles)}) {qubits};"
+
+    raise ValueError(f"Cannot invert QASM gate '{gate}'")
+
+def reverse_lines(f, end, start, block_size=1 << 20):
+    """Yields the lines of the binary file f between byte offsets start and end, last line first, reading block_size bytes at a time."""
+    position = end
+    remainder = b""
+    while position > start:
+        read_size = min(block_size, position - start)
+        position -= read_size
+        f.seek(position)
+        block = f.read(read_size) + remainder
+        lines = block.split(b"\n")
+        remainder = lines.pop(0)
+        for line in reversed(lines):
+            yield line.decode()
+    yield remainder.decode()
+
+def write_dagger_qasm(qasm_file, dagger_file, block_size=1 << 20):
+    """
+    Writes the inverse of a transpiled QASM circuit.
+
+    The header (OPENQASM, include, qreg, creg) is copied, the gate statements are written in
+    reverse order with each gate inverted, and measurements are dropped. The input is read
+    backwards in blocks, so memory use does not grow with the size of the circuit.
+
+    Args:
+        qasm_file (str): Transpiled circuit, one statement per line as written by qiskit.qasm2.dump.
+        dagger_file (str): Output file for the inverse circuit.
+        block_size (int, optional): Number of bytes read at a time. Defaults to 1 MB.
+
+    Returns:
+        int: Number of gate statements written.
+    """
+    temp_file = f"{dagger_file}.{os.getpid()}.tmp"
+    gate_count = 0
+
+    with open(qasm_file, "rb") as f, open(temp_file, "w") as out:
+        body_start = 0
+        for line in f:
+            statement = line.decode().strip()
+            if statement and not statement.startswith("//") and not statement.startswith(QASM_HEADER_STATEMENTS):
+                break
+            out.write(line.decode())
+            body_start = f.tell()
+
+        f.seek(0, os.SEEK_END)
+        for line in reverse_lines(f, f.tell(), body_start, block_size):
+            statement = line.strip()
+            if not statement or statement.startswith("//"):
+                continue
+            inverse = invert_statement(statement)
+            if inverse is not None:
+                out.write(inverse + "\n")
+                gate_count += 1
+
+    os.replace(temp_file, dagger_file)
+    return gate_count
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Write the inverse (dagger) of a transpiled QASM circuit.")
+    parser.add_argument("qasm_file", type=str,
+                        help="The transpiled QASM circuit.")
+    parser.add_argument("dagger_file", type=str,
+                        help="The path where the dagger circuit will be saved.")
+
+    args = parser.parse_args()
+
+    gate_count = write_dagger_qasm(args.qasm_file, args.dagger_file)
+    print(f"Wrote {gate_count} gates to {Path(args.dagger_file)}")
@@ -0,0 +1,219 @@
+import os
+import csv
+import time
+import uuid
+import socket
+import sqlite3
+from pathlib import Path
+
+# Columns of a result row that identify the run rather than measure a phase of it
+IDENTITY_COLUMNS = {"circuit_name", "threshold"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT NOT NULL,
+    circuit_name TEXT NOT NULL,
+    threshold INTEGER,
+    backend_index INTEGER,
+    phase TEXT NOT NULL,
+    value,
+    recorded REAL NOT NULL,
+    host TEXT,
+    pid INTEGER,
+    UNIQUE (run_id, circuit_name, threshold, backend_index, phase)
+);
+CREATE INDEX IF NOT EXISTS results_phase ON results (phase, circuit_name, recorded);
+"""
+
+# UNIQUE treats NULLs as distinct, so a run without a threshold would be recorded again on every
+# retry. This index compares a missing threshold or backend as -1, which neither can be.
+UNIQUE_INDEX = "results_unique"
+UNIQUE_KEY = "run_id, circuit_name, COALESCE(threshold, -1), COALESCE(backend_index, -1), phase"
+UNIQUE_SCHEMA = [
+    f"DELETE FROM results WHERE rowid NOT IN (SELECT MIN(rowid) FROM results GROUP BY {UNIQUE_KEY})",
+    f"CREATE UNIQUE INDEX IF NOT EXISTS {UNIQUE_INDEX} ON results ({UNIQUE_KEY})",
+]
+
+# One query for all three views of a phase: the per-circuit trend over runs (runs, mean, best),
+# the delta of every run to the previous run of the same circuit, and the total of each run
+AGGREGATE_QUERY = """
+WITH per_run AS (
+    SELECT run_id, circuit_name, threshold, backend_index, MIN(recorded) AS recorded, value
+    FROM results
+    WHERE phase = ? AND value IS NOT NULL
+    GROUP BY run_id, circuit_name, threshold, backend_index
+)
+SELECT run_id, recorded, circuit_name, threshold, backend_index, value,
+       value - LAG(value) OVER circuit_runs AS delta,
+       COUNT(*) OVER circuit AS runs,
+       AVG(value) OVER circuit AS mean,
+       MIN(value) OVER circuit AS best,
+       SUM(value) OVER run AS run_total,
+       COUNT(*) OVER run AS run_circuits
+FROM per_run
+WINDOW circuit AS (PARTITION BY circuit_name, threshold, backend_index),
+       circuit_runs AS (PARTITION BY circuit_name, threshold, backend_index ORDER BY recorded),
+       run AS (PARTITION BY run_id)
+ORDER BY circuit_name, threshold, backend_index, recorded
+"""
+
+AGGREGATE_FIELDNAMES = ["run_id", "recorded", "circuit_name", "threshold", "backend_index", "value", "delta", "runs", "mean", "best", "run_total", "run_circuits"]
+
+def new_run_id():
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+def results_db_file(config):
+    return config['results_db'] or Path(config['results_path']) / "results.db"
+
+class ResultsStore:
+    """
+    Append-only SQLite store of benchmark results, one row per (run id, circuit, threshold, backend, phase).
+
+    The database runs in WAL mode, so readers never block the writers, and every process
+    writes its rows in one short transaction. Concurrent writers wait for each other for up to
+    busy_timeout seconds. WAL needs shared memory between the writers, so the database must be
+    on a local file system, not NFS.
+    """
+
+    def __init__(self, db_file, busy_timeout=60):
+        self.db_file = str(db_file)
+        self.conn = sqlite3.connect(self.db_file, timeout=busy_timeout, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if not self.has_unique_index():
+            self.create_unique_index()
+
+    def has_unique_index(self):
+        return self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (UNIQUE_INDEX,)).fetchone() is not None
+
+    def create_unique_index(self):
+        """
+        Creates UNIQUE_INDEX, first deleting the duplicates that databases written before it may hold
+        (runs without a threshold), keeping the first. Checked again under the write lock, since
+        other processes may open the same new database at the same time.
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not self.has_unique_index():
+                for statement in UNIQUE_SCHEMA:
+                    self.conn.execute(statement)
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def record(self, run_id, circuit_name, threshold, backend_index, row):
+        """
+        Appends the phases of one result row (as written to <circuit>.csv). Empty values are stored as NULL.
+        A row that was already recorded for the same run is ignored, so retrying is safe.
+        """
+        recorded = time.time()
+        host = socket.gethostname()
+        values = [(run_id, circuit_name, threshold, backend_index, phase, None if value == "" else value, recorded, host, os.getpid())
+                  for phase, value in row.items() if phase not in IDENTITY_COLUMNS]
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany("INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def aggregate(self, phase):
+        """Returns the rows of AGGREGATE_QUERY for phase as dicts."""
+        cursor = self.conn.execute(AGGREGATE_QUERY, (phase,))
+        return [dict(zip(AGGREGATE_FIELDNAMES, row)) for row in cursor]
+
+    def export(self, fieldnames, run_id=None):
+        """
+        Pivots the store back into result rows with the given columns, one per run and circuit,
+        in the order they were recorded. Phases that are not columns are left out.
+        """
+        query = "SELECT run_id, circuit_name, threshold, backend_index, phase, value FROM results"
+        params = ()
+        if run_id is not None:
+            query += " WHERE run_id = ?"
+            params = (run_id,)
+        rows = {}
+        for run, circuit_name, threshold, backend_index, phase, value in self.conn.execute(query + " ORDER BY recorded, rowid", params):
+            row = rows.setdefault((run, circuit_name, threshold, backend_index), {key: "" for key in fieldnames})
+            row["circuit_name"] = circuit_name
+            if "threshold" in row:
+                row["threshold"] = "" if threshold is None else threshold
+            if phase in row:
+                row[phase] = "" if value is None else value
+        return list(rows.values())
+
+    def close(self):
+        self.conn.close()
+
+def record_result(config, circuit_name, threshold, backend_index, row):
+    """Records a result row in the results store of config, unless results_store is 0. A failing store only warns."""
+    if config['results_store'] == "0":
+        return
+    db_file = results_db_file(config)
+    try:
+        store = ResultsStore(db_file)
+        try:
+            store.record(config['run_id'], circuit_name, threshold, backend_index, row)
+        finally:
+            store.close()
+    except sqlite3.Error as e:
+        print(f"Warning: Could not record the result in {db_file}: {e}")
+
+def print_aggregate(rows, phase):
+    print(f"Per-circuit trend of {phase} (latest run, delta to the previous run, mean and best over all runs):")
+    latest = {}
+    for row in rows:
+        latest[(row["circuit_name"], row["threshold"], row["backend_index"])] = row
+    for (circuit_name, threshold, backend_index), row in latest.items():
+        delta = "" if row["delta"] is None else f"{row['delta']:+.4g}"
+        print(f"  {circuit_name} (threshold {threshold}, backend {backend_index}): {row['value']:.4g} {delta:>10}  "
+              f"over {row['runs']} runs: mean {row['mean']:.4g}, best {row['best']:.4g}")
+
+    print(f"\nSuite totals of {phase} per run:")
+    totals = {}
+    for row in rows:
+        totals.setdefault(row["run_id"], (row["recorded"], row["run_total"], row["run_circuits"]))
+    for run_id, (recorded, total, circuits) in sorted(totals.items(), key=lambda item: item[1][0]):
+        print(f"  {run_id} ({time.ctime(recorded)}): {total:.4g} over {circuits} circuits")
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Aggregate or export the benchmark results store.")
+    parser.add_argument("command", choices=["aggregate", "export"],
+                        help="'aggregate' shows per-circuit trends, run-to-run deltas and suite totals of a phase, "
+                             "'export' writes the results as rows with the columns of <circuit>.csv.")
+    parser.add_argument("db_file", type=str,
+                        help="The results database (default location: <results_path>/results.db).")
+    parser.add_argument("--phase", type=str, default="total_runtime",
+                        help="Phase (CSV column) to aggregate (default total_runtime).")
+    parser.add_argument("--run_id", type=str, default=None,
+                        help="Only export the rows of this run.")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write the aggregate or export as CSV to this file instead of printing it.")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_file):
+        parser.error(f"{args.db_file} does not exist")
+    store = ResultsStore(args.db_file)
+
+    if args.command == "aggregate":
+        rows = store.aggregate(args.phase)
+        fieldnames = AGGREGATE_FIELDNAMES
+        if args.output is None:
+            print_aggregate(rows, args.phase)
+    else:
+        from benchmark_circuit import CSV_FIELDNAMES
+        rows = store.export(CSV_FIELDNAMES, args.run_id)
+        fieldnames = CSV_FIELDNAMES
+        if args.output is None:
+            args.output = "/dev/stdout"
+
+    if args.output is not None:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,223 @@
+import os
+import csv
+import json
+import math
+from pathlib import Path
+import numpy as np
+
+from scheduler import DEFAULT_THRESHOLD, result_wall_time
+from circuit_analyser import analyse_circuit
+
+FEATURE_NAMES = ["num_qubits", "one_qubit_gates", "two_qubit_gates", "depth", "cut_width", "threshold"]
+TARGET_NAMES = ["simulation_time", "final_state_memory", "wall_time"]
+
+# A step may take this many times its predicted time before it is stopped, and at least MIN_STEP_TIMEOUT seconds
+STEP_TIMEOUT_FACTOR = 3
+MIN_STEP_TIMEOUT = 60
+
+# Ridge penalty that keeps the fit stable with few historical rows
+RIDGE = 1e-3
+
+def circuit_file_features(circuit_file, threshold):
+    """
+    Features of a transpiled circuit for the prediction model, from circuit_analyser.
+
+    depth counts layers of gates on disjoint qubits. cut_width is the largest number of distinct
+    interacting qubit pairs that a cut between qubit k and k + 1 separates.
+    """
+    analysis = analyse_circuit(circuit_file)
+    return {
+        "num_qubits": analysis["num_qubits"],
+        "one_qubit_gates": analysis["one_qubit_gates"],
+        "two_qubit_gates": analysis["two_qubit_gates"],
+        "depth": analysis["depth"],
+        "cut_width": analysis["max_cut_width"],
+        "threshold": threshold if threshold is not None else DEFAULT_THRESHOLD,
+    }
+
+def transpiled_circuit_file(transpiled_circuit_path, stripped_circuit_name):
+    """The gate file of a transpiled circuit, or its QASM if there is no gate file; None if neither exists."""
+    for suffix in ("gates", "qasm"):
+        circuit_file = Path(transpiled_circuit_path) / f"{stripped_circuit_name}.{suffix}"
+        if circuit_file.exists():
+            return circuit_file
+    return None
+
+def load_result_rows(results_paths, thresholds=None):
+    """
+    Reads every result row (<circuit>.csv, batch summaries) in results_paths.
+
+    Rows written before the threshold column existed take the threshold of their circuit
+    from thresholds (e.g. circuit_list.json). A run that appears in several files is kept once.
+
+    Returns:
+        list: dicts with circuit_name, threshold, simulation_time, final_state_memory and
+              wall_time (see scheduler.result_wall_time).
+    """
+    thresholds = thresholds or {}
+    rows = {}
+    for results_path in results_paths:
+        for csv_file in sorted(Path(results_path).glob("*.csv")):
+            with open(csv_file, "r", newline="") as f:
+                for row in csv.DictReader(f):
+                    if row.get("status", "done") != "done":
+                        continue
+                    try:
+                        threshold = row.get("threshold") or thresholds.get(row["circuit_name"])
+                        threshold = int(threshold) if threshold not in (None, "", "None") else None
+                        rows[(row["circuit_name"], row["total_runtime"])] = {
+                            "circuit_name": row["circuit_name"],
+                            "threshold": threshold,
+                            "simulation_time": float(row["simulation_time"]),
+                            "final_state_memory": float(row["final_state_memory"]),
+                            "wall_time": result_wall_time(row),
+                        }
+                    except (KeyError, ValueError, TypeError):
+                        continue
+    return list(rows.values())
+
+def design_matrix(features):
+    return np.array([[1.0] + [math.log1p(f[name]) for name in FEATURE_NAMES] for f in features])
+
+class RuntimeModel:
+    """
+    Log-log ridge regression of state preparation time, state size and wall time on circuit features.
+
+    Every target is modelled as log(target) = w . [1, log(1 + feature) ...], so the weights
+    are exponents of a power law in the features.
+    """
+
+    def __init__(self, weights=None, rows=0):
+        self.weights = weights or {}
+        self.rows = rows
+
+    def fit(self, features, targets):
+        X = design_matrix(features)
+        penalty = RIDGE * np.eye(X.shape[1])
+        penalty[0, 0] = 0
+        for name in TARGET_NAMES:
+            y = np.log(np.maximum([t[name] for t in targets], 1e-9))
+            self.weights[name] = np.linalg.solve(X.T @ X + penalty, X.T @ y).tolist()
+        self.rows = len(features)
+        return self
+
+    def predict(self, features):
+        x = design_matrix([features])[0]
+        return {name: float(math.exp(x @ np.array(weights))) for name, weights in self.weights.items()}
+
+    def save(self, model_file):
+        temp_file = f"{model_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"features": FEATURE_NAMES, "weights": self.weights, "rows": self.rows}, f, indent=2)
+        os.replace(temp_file, model_file)
+
+    @classmethod
+    def load(cls, model_file):
+        with open(model_file, "r") as f:
+            data = json.load(f)
+        if data["features"] != FEATURE_NAMES:
+            raise ValueError(f"{model_file} was trained on different features")
+        return cls(data["weights"], data["rows"])
+
+def holdout_error(features, targets, holdout=0.2, seed=0):
+    """
+    Fits on a random (1 - holdout) share of the rows and measures the error on the rest.
+
+    Returns:
+        dict: per target, the median and 90th percentile of |predicted / actual - 1| on the
+              held-out rows, and the number of training and held-out rows.
+    """
+    order = np.random.default_rng(seed).permutation(len(features))
+    test_size = max(1, int(round(len(features) * holdout)))
+    test, train = order[:test_size], order[test_size:]
+    model = RuntimeModel().fit([features[i] for i in train], [targets[i] for i in train])
+
+    errors = {}
+    for name in TARGET_NAMES:
+        ratios = np.array([abs(model.predict(features[i])[name] / max(targets[i][name], 1e-9) - 1) for i in test])
+        errors[name] = {
+            "median_relative_error": float(np.median(ratios)),
+            "p90_relative_error": float(np.percentile(ratios, 90)),
+            "train_rows": len(train),
+            "test_rows": len(test),
+        }
+    return errors
+
+def training_set(results_paths, transpiled_circuit_path, thresholds=None):
+    """Joins the historical result rows with the features of their transpiled circuits."""
+    features = []
+    targets = []
+    cache = {}
+    for row in load_result_rows(results_paths, thresholds):
+        circuit_file = transpiled_circuit_file(transpiled_circuit_path, row["circuit_name"])
+        if circuit_file is None:
+            continue
+        if circuit_file not in cache:
+            cache[circuit_file] = circuit_file_features(circuit_file, None)
+        features.append({**cache[circuit_file], "threshold": row["threshold"] if row["threshold"] is not None else DEFAULT_THRESHOLD})
+        targets.append(row)
+    return features, targets
+
+def train(results_paths, transpiled_circuit_path, thresholds=None, holdout=0.2):
+    """
+    Trains a RuntimeModel on all historical rows.
+
+    Returns:
+        tuple: (model or None with fewer rows than features, held-out errors or None)
+    """
+    features, targets = training_set(results_paths, transpiled_circuit_path, thresholds)
+    if len(features) < len(FEATURE_NAMES) + 2:
+        print(f"Only {len(features)} historical rows with a transpiled circuit, at least {len(FEATURE_NAMES) + 2} are needed to train")
+        return None, None
+    errors = holdout_error(features, targets, holdout)
+    return RuntimeModel().fit(features, targets), errors
+
+def step_timeout(predicted_time, factor=STEP_TIMEOUT_FACTOR):
+    return max(predicted_time * factor, MIN_STEP_TIMEOUT)
+
+def load_model(config, thresholds=None):
+    """
+    The model in config['prediction_model'] if that file exists, otherwise a model trained on the
+    results in config['results_path']. Returns None if neither is available.
+    """
+    if config.get('prediction_model') and os.path.exists(config['prediction_model']):
+        return RuntimeModel.load(config['prediction_model'])
+    if not os.path.isdir(config['results_path']):
+        return None
+    model, errors = train([config['results_path']], config['transpiled_circuit_path'], thresholds)
+    if model is not None:
+        print_holdout_error(errors)
+    return model
+
+def print_holdout_error(errors):
+    for name, error in errors.items():
+        print(f"Held-out error of {name}: median {error['median_relative_error']:.1%}, 90th percentile {error['p90_relative_error']:.1%} "
+              f"({error['train_rows']} training rows, {error['test_rows']} held-out rows)")
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Train the runtime and memory prediction model on historical results.")
+    parser.add_argument("results_paths", type=str, nargs="+",
+                        help="Directories with <circuit>.csv and batch result files.")
+    parser.add_argument("--transpiled_circuit_path", type=str, required=True,
+                        help="Directory with the transpiled circuits the results were measured on.")
+    parser.add_argument("--circuit_list", type=str, default=None,
+                        help="Circuit list giving the threshold of rows without a threshold column.")
+    parser.add_argument("--model", type=str, required=True,
+                        help="Output file of the trained model (JSON).")
+    parser.add_argument("--holdout", type=float, default=0.2,
+                        help="Share of the rows held out to measure the prediction error (default 0.2).")
+
+    args = parser.parse_args()
+
+    thresholds = {}
+    if args.circuit_list:
+        with open(args.circuit_list, "r") as f:
+            thresholds = {item["name"]: item.get("threshold") for item in json.load(f)}
+
+    model, errors = train(args.results_paths, args.transpiled_circuit_path, thresholds, args.holdout)
+    if model is None:
+        raise SystemExit(1)
+    print_holdout_error(errors)
+    model.save(args.model)
+    print(f"Model trained on {model.rows} rows written to {args.model}")
@@ -0,0 +1,310 @@
+import csv
+import json
+import time
+from pathlib import Path
+from collections import Counter
+
+import gate_ir
+from transpile_cache import qasm_gate_counts
+
+TWO_QUBIT_GATES = {
+    "cx", "cy", "cz", "ch", "swap", "iswap", "ecr", "cp", "cu1", "cu3", "crx", "cry", "crz", "csx", "cv",
+    "rxx", "ryy", "rzz", "zzphase", "zzmax", "xxphase", "yyphase", "tk2",
+}
+NON_GATES = {"measure", "barrier", "reset"}
+
+# Threshold assumed for circuits run with the balancedAccuracy default
+DEFAULT_THRESHOLD = 1024
+
+# A two-qubit gate costs the simulator about this many single-qubit gates
+TWO_QUBIT_WEIGHT = 10
+
+# Weight of the latest observation in the running ratios of actual to estimated runtime
+DRIFT_WEIGHT = 0.5
+
+def circuit_features(config, circuit_name, threshold):
+    """
+    Static features of one circuit: num_qubits, one_qubit_gates, two_qubit_gates and threshold.
+
+    Gate counts are taken from the transpiled gate file or QASM when the circuit was transpiled
+    before, and from the pytket circuit JSON otherwise.
+    """
+    stripped_circuit_name = Path(circuit_name).stem
+    gate_file = Path(config['transpiled_circuit_path']) / f"{stripped_circuit_name}.gates"
+    qasm_file = Path(config['transpiled_circuit_path']) / f"{stripped_circuit_name}.qasm"
+
+    if gate_file.exists():
+        header, gates = gate_ir.read_gate_file(gate_file)
+        num_qubits, counts = header["num_qubits"], gate_ir.gate_counts(gates)
+    elif qasm_file.exists():
+        counts = qasm_gate_counts(qasm_file)
+        with open(qasm_file, "r") as f:
+            num_qubits = sum(int(line.split("[", 1)[1].split("]", 1)[0]) for line in f if line.startswith("qreg"))
+    else:
+        with open(Path(config['pytket_circuit_path']) / circuit_name, "r") as f:
+            circuit = json.load(f)
+        num_qubits = len(circuit.get("qubits", []))
+        counts = Counter(command["op"]["type"] for command in circuit.get("commands", []))
+
+    counts = {gate.lower(): count for gate, count in counts.items() if gate.lower() not in NON_GATES}
+    two_qubit_gates = sum(count for gate, count in counts.items() if gate in TWO_QUBIT_GATES)
+    return {
+        "num_qubits": num_qubits,
+        "one_qubit_gates": sum(counts.values()) - two_qubit_gates,
+        "two_qubit_gates": two_qubit_gates,
+        "threshold": threshold if threshold is not None else DEFAULT_THRESHOLD,
+    }
+
+def result_wall_time(row):
+    """
+    Wall time of a result row (<circuit>.csv) as the sum of its steps:
+    total_runtime + expectation_value_time + other_time + fidelity_estimate_time.
+    Rows written before the fidelity_estimate_time column existed, or without a STEP 5, count it as 0.
+    """
+    return float(row["total_runtime"]) + float(row["expectation_value_time"]) + float(row["other_time"]) \
+        + float(row.get("fidelity_estimate_time") or 0)
+
+def load_history(results_path):
+    """
+    Wall time (see result_wall_time) and final_state_memory of earlier runs, read from the
+    <circuit>.csv files in results_path.
+
+    Returns:
+        dict: (wall time, final_state_memory in MB) per stripped circuit name.
+    """
+    history = {}
+    for csv_file in Path(results_path).glob("*.csv"):
+        with open(csv_file, "r", newline="") as f:
+            reader = csv.DictReader(f)
+            # Batch summaries, reports and <circuit>.repeat.csv share the directory
+            if "circuit_name" not in (reader.fieldnames or []):
+                continue
+            for row in reader:
+                if row["circuit_name"] != csv_file.stem:
+                    continue
+                try:
+                    history[row["circuit_name"]] = (result_wall_time(row), float(row["final_state_memory"]))
+                except (KeyError, ValueError, TypeError):
+                    continue
+    return history
+
+class Job:
+    def __init__(self, circuit_name, threshold, features):
+        self.circuit_name = circuit_name
+        self.threshold = threshold
+        self.features = features
+        self.stripped_circuit_name = Path(circuit_name).stem
+
+class CostModel:
+    """
+    Expected wall time and state size of a job.
+
+    A circuit with history uses the values of its last run. Otherwise the cost is
+    (one_qubit_gates + TWO_QUBIT_WEIGHT * two_qubit_gates) * threshold and the state size is
+    num_qubits * threshold. Both are converted to seconds and MB by the median ratio of the
+    circuits that have history. Without history the state size is unknown (None). Every finished
+    job updates a running ratio of actual to estimated time, which scales all later estimates.
+
+    With a predictor (runtime_model.RuntimeModel), circuits without history whose features include
+    depth and cut_width take its predicted wall time and state size instead.
+    """
+
+    def __init__(self, history, predictor=None):
+        self.history = dict(history)
+        self.predictor = predictor
+        self.predictions = {}
+        self.drift = 1.0
+        self.time_scale = None
+        self.memory_scale = None
+
+    def static_time(self, features):
+        return (features["one_qubit_gates"] + TWO_QUBIT_WEIGHT * features["two_qubit_gates"]) * features["threshold"]
+
+    def static_memory(self, features):
+        return features["num_qubits"] * features["threshold"]
+
+    def calibrate(self, jobs):
+        time_ratios = []
+        memory_ratios = []
+        for job in jobs:
+            if job.stripped_circuit_name in self.history:
+                wall_time, memory = self.history[job.stripped_circuit_name]
+                if self.static_time(job.features) > 0:
+                    time_ratios.append(wall_time / self.static_time(job.features))
+                if self.static_memory(job.features) > 0:
+                    memory_ratios.append(memory / self.static_memory(job.features))
+        if time_ratios:
+            self.time_scale = sorted(time_ratios)[len(time_ratios) // 2]
+        if memory_ratios:
+            self.memory_scale = sorted(memory_ratios)[len(memory_ratios) // 2]
+
+    def prediction(self, job):
+        if self.predictor is None or "cut_width" not in job.features:
+            return None
+        if job.circuit_name not in self.predictions:
+            self.predictions[job.circuit_name] = self.predictor.predict(job.features)
+        return self.predictions[job.circuit_name]
+
+    def expected_time(self, job):
+        if job.stripped_circuit_name in self.history:
+            return self.history[job.stripped_circuit_name][0] * self.drift
+        if self.prediction(job) is not None:
+            return self.prediction(job)["wall_time"] * self.drift
+        return self.static_time(job.features) * (self.time_scale or 1.0) * self.drift
+
+    def expected_memory(self, job):
+        if job.stripped_circuit_name in self.history:
+            return self.history[job.stripped_circuit_name][1]
+        if self.prediction(job) is not None:
+            return self.prediction(job)["final_state_memory"]
+        if self.memory_scale is None:
+            return None
+        return self.static_memory(job.features) * self.memory_scale
+
+    def observe(self, job, wall_time, final_state_memory=None):
+        expected = self.expected_time(job) / self.drift
+        if expected > 0 and wall_time > 0:
+            self.drift = (1 - DRIFT_WEIGHT) * self.drift + DRIFT_WEIGHT * wall_time / expected
+        if final_state_memory is not None:
+            self.history[job.stripped_circuit_name] = (wall_time, final_state_memory)
+
+class Scheduler:
+    """
+    Places jobs on worker slots, longest expected job first, within a memory budget per device.
+
+    Slots are opaque: slots[i] is the device (e.g. (backend_index, gpu_index)) worker i runs on,
+    and several workers may share a device. Jobs are handed out one at a time as workers become
+    idle, so every placement uses the estimates as updated by the jobs finished so far. Each
+    device also keeps a running speed, the ratio of actual to expected time of its jobs. An idle
+    worker skips a long job if a faster device is expected to finish it earlier, and falls back
+    to the shortest job when it would skip every job.
+
+    Args:
+        jobs (list): Job objects.
+        slots (list): Device of each worker.
+        model (CostModel): Estimates of the jobs.
+        memory_budgets (dict, optional): Budget in MB per device. Devices without a budget accept any job.
+        clock (callable, optional): Time source, in seconds.
+    """
+
+    def __init__(self, jobs, slots, model, memory_budgets=None, clock=time.monotonic):
+        self.slots = list(slots)
+        self.model = model
+        self.memory_budgets = memory_budgets or {}
+        self.clock = clock
+        self.pending = list(jobs)
+        self.running = {}
+        self.speed = {device: 1.0 for device in self.slots}
+
+    def budget(self, device):
+        return self.memory_budgets.get(device)
+
+    def unschedulable(self):
+        """Removes and returns the pending jobs that exceed the memory budget of every device."""
+        rejected = []
+        for job in list(self.pending):
+            memory = self.model.expected_memory(job)
+            budgets = [self.budget(device) for device in set(self.slots)]
+            if memory is not None and budgets and all(budget is not None and memory > budget for budget in budgets):
+                self.pending.remove(job)
+                rejected.append(job)
+        return rejected
+
+    def expected_free_time(self, worker):
+        if worker not in self.running:
+            return self.clock()
+        job, start_time = self.running[worker]
+        return max(start_time + self.model.expected_time(job) * self.speed[self.slots[worker]], self.clock())
+
+    def next_job(self, worker):
+        """Returns the job worker should run next and marks it running, or None if no pending job fits now."""
+        device = self.slots[worker]
+        budget = self.budget(device)
+        used = sum(self.model.expected_memory(job) or 0 for w, (job, _) in self.running.items() if self.slots[w] == device)
+
+        fitting = [job for job in self.pending if budget is None or (self.model.expected_memory(job) or 0) + used <= budget]
+        if not fitting:
+            return None
+        fitting.sort(key=self.model.expected_time, reverse=True)
+
+        now = self.clock()
+        others = [w for w in range(len(self.slots)) if w != worker and self.slots[w] != device]
+        chosen = fitting[-1]
+        for job in fitting:
+            expected = self.model.expected_time(job)
+            finish = now + expected * self.speed[device]
+            if all(self.expected_free_time(w) + expected * self.speed[self.slots[w]] >= finish for w in others):
+                chosen = job
+                break
+
+        self.pending.remove(chosen)
+        self.running[worker] = (chosen, now)
+        return chosen
+
+    def finished(self, worker, wall_time, final_state_memory=None):
+        """Records the end of the job running on worker and returns it."""
+        job, _ = self.running.pop(worker)
+        device = self.slots[worker]
+        expected = self.model.expected_time(job)
+        if expected > 0 and wall_time > 0:
+            self.speed[device] = (1 - DRIFT_WEIGHT) * self.speed[device] + DRIFT_WEIGHT * wall_time / expected
+        self.model.observe(job, wall_time, final_state_memory)
+        return job
+
+class FifoScheduler(Scheduler):
+    """Hands out jobs in list order, ignoring estimates and memory budgets."""
+
+    def next_job(self, worker):
+        if not self.pending:
+            return None
+        job = self.pending.pop(0)
+        self.running[worker] = (job, self.clock())
+        return job
+
+    def unschedulable(self):
+        return []
+
+    def finished(self, worker, wall_time, final_state_memory=None):
+        job, _ = self.running.pop(worker)
+        return job
+
+def parse_memory_budgets(spec, slots):
+    """
+    Parses slot_memory_mb: either one budget in MB for every device, or gpu_index:MB pairs
+    separated by commas (e.g. '0:40000,1:80000'). Returns the budget per device of slots.
+    """
+    if not spec:
+        return {}
+    if ":" not in spec:
+        return {device: float(spec) for device in slots}
+    per_gpu = {int(gpu): float(budget) for gpu, budget in (item.split(":", 1) for item in spec.split(",") if item)}
+    return {device: per_gpu.get(device[1]) for device in slots}
+
+def simulate_makespan(scheduler, model, durations):
+    """
+    Replays a schedule with a simulated clock and returns its makespan.
+
+    Args:
+        scheduler (Scheduler): Scheduler whose clock is replaced by the simulated one.
+        model (CostModel): Gives the duration of circuits missing from durations.
+        durations (dict): Actual wall time per circuit name.
+    """
+    clock = [0.0]
+    scheduler.clock = lambda: clock[0]
+    finish_times = {}
+
+    def dispatch():
+        for worker in range(len(scheduler.slots)):
+            if worker not in finish_times:
+                job = scheduler.next_job(worker)
+                if job is not None:
+                    finish_times[worker] = clock[0] + durations.get(job.circuit_name, model.expected_time(job))
+
+    dispatch()
+    while finish_times:
+        worker = min(finish_times, key=finish_times.get)
+        clock[0] = finish_times.pop(worker)
+        job, start_time = scheduler.running[worker]
+        scheduler.finished(worker, clock[0] - start_time)
+        dispatch()
+    return clock[0]
@@ -0,0 +1,193 @@
+import os
+import json
+import struct
+import numpy as np
+
+SHOTS_FILE_MAGIC = b"QRSHOTS1"
+
+class ShotWriter:
+    """
+    Streams sampled shots to a bit-packed file, and optionally to the text format of <circuit>.shots.txt.
+
+    The packed file holds SHOTS_FILE_MAGIC, a little-endian uint32 header length, a JSON
+    header and then one row of bytes_per_shot bytes per shot. Bit order is "little": qubit k
+    is bit k % 8 of byte k // 8. The shot count follows from the file size, so the header
+    never needs rewriting.
+
+    With resume_shots, existing files are reopened and cut back to their first resume_shots
+    shots, dropping any shots written after the last checkpoint.
+    """
+
+    def __init__(self, packed_file, num_qubits, text_file=None, resume_shots=0):
+        self.num_qubits = num_qubits
+        self.bytes_per_shot = (num_qubits + 7) // 8
+        self.shots = resume_shots
+        self.packed = None
+        self.text = None
+
+        if packed_file:
+            header = json.dumps({"num_qubits": num_qubits, "bit_order": "little", "bytes_per_shot": self.bytes_per_shot}).encode()
+            if resume_shots:
+                self.packed = open(packed_file, "r+b")
+                self.packed.truncate(len(SHOTS_FILE_MAGIC) + 4 + len(header) + resume_shots * self.bytes_per_shot)
+                self.packed.seek(0, os.SEEK_END)
+            else:
+                self.packed = open(packed_file, "wb")
+                self.packed.write(SHOTS_FILE_MAGIC)
+                self.packed.write(struct.pack("<I", len(header)))
+                self.packed.write(header)
+
+        if text_file:
+            if resume_shots:
+                self.text = open(text_file, "r+b")
+                self.text.truncate(resume_shots * (num_qubits + 1))
+                self.text.seek(0, os.SEEK_END)
+            else:
+                self.text = open(text_file, "wb")
+
+    def write(self, bits):
+        """Appends a (shots, num_qubits) array of 0/1 values with column k holding qubit k."""
+        if self.packed:
+            self.packed.write(np.packbits(bits, axis=1, bitorder="little").tobytes())
+        if self.text:
+            # One line per shot, qubit 0 first, like the reversed bitstrings of get_memory()
+            lines = np.empty((bits.shape[0], self.num_qubits + 1), dtype=np.uint8)
+            lines[:, :-1] = bits + ord("0")
+            lines[:, -1] = ord("\n")
+            self.text.write(lines.tobytes())
+        self.shots += bits.shape[0]
+
+    def flush(self):
+        for f in (self.packed, self.text):
+            if f:
+                f.flush()
+
+    def close(self):
+        for f in (self.packed, self.text):
+            if f:
+                f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_packed_shots(packed_file):
+    """Returns the header of a file written by ShotWriter and a (shots, bytes_per_shot) memory map of its rows."""
+    with open(packed_file, "rb") as f:
+        if f.read(len(SHOTS_FILE_MAGIC)) != SHOTS_FILE_MAGIC:
+            raise ValueError(f"{packed_file} is not a shots file")
+        (header_size,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_size))
+        offset = f.tell()
+
+    shots = (os.path.getsize(packed_file) - offset) // header["bytes_per_shot"]
+    if shots == 0:
+        return header, np.zeros((0, header["bytes_per_shot"]), dtype=np.uint8)
+    return header, np.memmap(packed_file, dtype=np.uint8, mode="r", offset=offset, shape=(shots, header["bytes_per_shot"]))
+
+def read_shots(packed_file):
+    """
+    Reads a file written by ShotWriter.
+
+    Returns:
+        tuple: (header dict, (shots, num_qubits) uint8 array of 0/1 values).
+    """
+    header, packed = open_packed_shots(packed_file)
+    return header, np.unpackbits(packed, axis=1, count=header["num_qubits"], bitorder=header["bit_order"])
+
+def read_shot_chunks(num_qubits, packed_file=None, text_file=None, shots=None, chunk_size=100000):
+    """
+    Yields the first shots shots (all if None) of a packed file, or else of a text shots file,
+    as (chunk, num_qubits) arrays of 0/1 values.
+    """
+    if packed_file:
+        header, rows = open_packed_shots(packed_file)
+        unpack = lambda chunk: np.unpackbits(chunk, axis=1, count=num_qubits, bitorder=header["bit_order"])
+    else:
+        rows = np.memmap(text_file, dtype=np.uint8, mode="r")
+        rows = rows[:len(rows) - len(rows) % (num_qubits + 1)].reshape(-1, num_qubits + 1)
+        unpack = lambda chunk: chunk[:, :-1] - ord("0")
+
+    rows = rows[:shots]
+    for start in range(0, len(rows), chunk_size):
+        yield unpack(np.asarray(rows[start:start + chunk_size]))
+
+def read_shot_rows(num_qubits, indices, packed_file=None, text_file=None):
+    """Reads the shots at indices of a packed file, or else of a text shots file, as a (len(indices), num_qubits) array of 0/1 values."""
+    if packed_file:
+        header, rows = open_packed_shots(packed_file)
+        return np.unpackbits(np.asarray(rows[indices]), axis=1, count=num_qubits, bitorder=header["bit_order"])
+    rows = np.memmap(text_file, dtype=np.uint8, mode="r")
+    rows = rows[:len(rows) - len(rows) % (num_qubits + 1)].reshape(-1, num_qubits + 1)
+    return np.asarray(rows[indices, :-1]) - ord("0")
+
+def outcome_keys(bits):
+    """
+    One fixed-width key per shot: its bit-packed row viewed as a single np.void value.
+
+    Keys compare and sort as whole rows, so np.unique and np.searchsorted group identical
+    outcomes without a Python loop over shots or outcomes.
+    """
+    packed = np.ascontiguousarray(np.packbits(bits, axis=1, bitorder="little"))
+    return packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+
+class ShotAccumulator:
+    """
+    Running per-qubit marginals and outcome histogram of streamed shots.
+
+    Memory is bounded: at most histogram_limit distinct outcomes are tracked, and shots with
+    any other outcome are only counted in untracked_shots.
+    """
+
+    def __init__(self, num_qubits, histogram_limit=65536):
+        self.num_qubits = num_qubits
+        self.histogram_limit = histogram_limit
+        self.shots = 0
+        self.ones = np.zeros(num_qubits, dtype=np.int64)
+        # Tracked outcomes as sorted keys (see outcome_keys) and their shots
+        self.keys = outcome_keys(np.zeros((0, num_qubits), dtype=np.uint8))
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.untracked_shots = 0
+
+    def update(self, bits):
+        self.shots += bits.shape[0]
+        self.ones += bits.sum(axis=0, dtype=np.int64)
+
+        keys, counts = np.unique(outcome_keys(bits), return_counts=True)
+        positions = np.searchsorted(self.keys, keys)
+        tracked = positions < len(self.keys)
+        tracked[tracked] = self.keys[positions[tracked]] == keys[tracked]
+        self.counts[positions[tracked]] += counts[tracked]
+
+        # New outcomes are tracked in key order until the histogram is full
+        room = self.histogram_limit - len(self.keys)
+        new_keys, new_counts = keys[~tracked][:room], counts[~tracked][:room]
+        self.untracked_shots += int(counts[~tracked][room:].sum())
+        if len(new_keys):
+            keys = np.concatenate([self.keys, new_keys])
+            order = np.argsort(keys, kind="stable")
+            self.keys = keys[order]
+            self.counts = np.concatenate([self.counts, new_counts])[order]
+
+    def marginals(self):
+        """Probability of measuring 1 on each qubit."""
+        return (self.ones / max(self.shots, 1)).tolist()
+
+    def top_outcomes(self, count=20):
+        """Most frequent outcomes as (bitstring with qubit 0 first, shots)."""
+        top = np.argsort(-self.counts, kind="stable")[:count]
+        packed = self.keys[top].view(np.uint8).reshape(len(top), -1)
+        bits = np.unpackbits(packed, axis=1, count=self.num_qubits, bitorder="little") + ord("0")
+        return [(row.tobytes().decode(), int(shots)) for row, shots in zip(bits, self.counts[top])]
+
+    def summary(self, top_count=20):
+        return {
+            "num_qubits": self.num_qubits,
+            "shots": self.shots,
+            "distinct_outcomes": len(self.keys),
+            "untracked_shots": self.untracked_shots,
+            "marginals": self.marginals(),
+            "top_outcomes": self.top_outcomes(top_count),
+        }
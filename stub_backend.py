@@ -0,0 +1,198 @@
+import re
+import sys
+import json
+import math
+import zlib
+from collections import Counter
+import numpy as np
+
+# Stand-in for QuantumRingsLib, for running the harness without the SDK or a GPU. Install it with
+# benchmark_circuit.load_sdk(stub_backend), or in batch workers with backend_factory=open_stub_backend.
+# Every result is a deterministic function of the circuit, the threshold and the shots, so two runs of
+# the same circuit do the same work; the numbers themselves are not physical.
+
+STUB_BACKEND_NAME = "stub_backend"
+
+# Bond dimension when a run has no custom threshold (balancedAccuracy)
+DEFAULT_BOND = 256
+
+# Saved states are capped at this size, so large circuits do not fill the disk
+STATE_SIZE_LIMIT = 64 * 1024 * 1024
+
+# Saved states start with a JSON header padded to this length
+STATE_HEADER_SIZE = 256
+
+QASM_REGISTER = re.compile(r"^\s*(qreg|creg)\s+\w+\s*\[\s*(\d+)\s*\]\s*;")
+QASM_GATE = re.compile(r"^\s*([a-z]\w*)\s*(?:\([^)]*\))?\s+[^;]*;")
+QASM_NON_GATES = {"OPENQASM", "include", "qreg", "creg", "barrier"}
+
+class QuantumRegister:
+    def __init__(self, size, name="q"):
+        self.size = size
+        self.name = name
+
+class ClassicalRegister(QuantumRegister):
+    def __init__(self, size, name="c"):
+        super().__init__(size, name)
+
+AncillaRegister = QuantumRegister
+
+class QuantumCircuit:
+    """
+    Records the operations of a circuit as (name, qubits, params) tuples.
+
+    With simulation_state_file, the circuit starts from a state saved by
+    StubResult.SaveSystemStateToDiskFile and inherits its registers and seed.
+    """
+
+    def __init__(self, *registers, simulation_state_file=None):
+        self.num_qubits = 0
+        self.num_clbits = 0
+        self.ops = []
+        self.state_seed = 0
+        if simulation_state_file is not None:
+            header = read_state_header(simulation_state_file)
+            self.num_qubits = header["num_qubits"]
+            self.num_clbits = header["num_clbits"]
+            self.state_seed = header["seed"]
+        for register in registers:
+            if isinstance(register, ClassicalRegister):
+                self.num_clbits += register.size
+            else:
+                self.num_qubits += register.size
+
+    @classmethod
+    def from_qasm_file(cls, qasm_file):
+        qc = cls()
+        with open(qasm_file, "r") as f:
+            for line in f:
+                register = QASM_REGISTER.match(line)
+                if register:
+                    if register.group(1) == "qreg":
+                        qc.num_qubits += int(register.group(2))
+                    else:
+                        qc.num_clbits += int(register.group(2))
+                    continue
+                gate = QASM_GATE.match(line)
+                if gate and gate.group(1) not in QASM_NON_GATES:
+                    qc.ops.append((gate.group(1), (), ()))
+        return qc
+
+    def u3(self, theta, phi, lam, qubit):
+        self.ops.append(("u3", (qubit,), (theta, phi, lam)))
+
+    def cx(self, control, target):
+        self.ops.append(("cx", (control, target), ()))
+
+    def h(self, qubit):
+        self.ops.append(("h", (qubit,), ()))
+
+    def x(self, qubit):
+        self.ops.append(("x", (qubit,), ()))
+
+    def sdg(self, qubit):
+        self.ops.append(("sdg", (qubit,), ()))
+
+    def measure(self, qubit, clbit):
+        self.ops.append(("measure", (qubit, clbit), ()))
+
+    def measure_all(self):
+        if self.num_clbits < self.num_qubits:
+            self.num_clbits = self.num_qubits
+        self.ops.extend(("measure", (qubit, qubit), ()) for qubit in range(self.num_qubits))
+
+    def append(self, other):
+        self.ops.extend(other.ops)
+
+    def count_ops(self):
+        return dict(Counter(op[0] for op in self.ops))
+
+def read_state_header(state_file):
+    with open(state_file, "rb") as f:
+        return json.loads(f.read(STATE_HEADER_SIZE).rstrip(b" \0"))
+
+def circuit_seed(qc, threshold, shots):
+    """Seed of a run: the starting state, the gate counts, the threshold and the shots."""
+    key = json.dumps([qc.state_seed, qc.num_qubits, sorted(qc.count_ops().items()), threshold, shots])
+    return zlib.crc32(key.encode())
+
+class StubResult:
+    def __init__(self, qc, shots, threshold):
+        self.qc = qc
+        self.shots = shots
+        self.threshold = threshold
+        self.seed = circuit_seed(qc, threshold, shots)
+        self.two_qubit_gates = sum(1 for op in qc.ops if op[0] == "cx")
+
+    def bond_dimension(self):
+        """Bond dimension an MPS of the circuit would reach: doubled by every layer of cx gates, capped by the threshold."""
+        layers = self.two_qubit_gates // max(self.qc.num_qubits // 2, 1)
+        return min(self.threshold or DEFAULT_BOND, 2 ** min(layers, self.qc.num_qubits // 2, 30))
+
+    def SaveSystemStateToDiskFile(self, state_file):
+        """Writes a state of 16 * num_qubits * bond^2 bytes (complex64 tensors), at most STATE_SIZE_LIMIT."""
+        size = min(16 * max(self.qc.num_qubits, 1) * self.bond_dimension() ** 2, STATE_SIZE_LIMIT)
+        header = json.dumps({"num_qubits": self.qc.num_qubits, "num_clbits": self.qc.num_clbits, "seed": self.seed}).encode()
+        with open(state_file, "wb") as f:
+            f.write(header.ljust(STATE_HEADER_SIZE, b" "))
+            f.write(np.random.default_rng(self.seed).bytes(size))
+
+    def get_memory(self):
+        """One bitstring per shot, qubit 0 last as in qiskit."""
+        num_bits = self.qc.num_clbits or self.qc.num_qubits
+        bits = np.random.default_rng(self.seed).integers(0, 2, size=(self.shots, num_bits), dtype=np.uint8)
+        rows = np.frombuffer((bits[:, ::-1] + ord("0")).tobytes(), dtype=f"S{num_bits}")
+        return rows.astype(str).tolist()
+
+    def get_counts(self):
+        return dict(Counter(self.get_memory()))
+
+    def get_fidelity(self):
+        """Decays with the cx gates per unit of bond dimension."""
+        return math.exp(-self.two_qubit_gates / (64 * self.bond_dimension()))
+
+    def get_pauliexpectationvalue(self, operator, qubits, start, end):
+        return complex(math.cos(zlib.crc32(f"{self.seed}:{operator}".encode())), 0)
+
+class StubJob:
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        return self._result
+
+    def status(self):
+        return "JobStatus.DONE"
+
+class StubBackend:
+    def __init__(self, name=STUB_BACKEND_NAME, gpu=0):
+        self.name = name
+        self.gpu = gpu
+
+    def run(self, qc, shots=1, mode="sync", performance="balancedAccuracy", generate_amplitude=False, quiet=True, threshold=None, **kwargs):
+        return StubJob(StubResult(qc, shots, threshold if performance == "custom" else None))
+
+class QuantumRingsProvider:
+    def __init__(self, token=None, name=None):
+        self.name = name or "stub"
+
+    def backends(self):
+        return [STUB_BACKEND_NAME]
+
+    def get_backend(self, name, gpu=0):
+        return StubBackend(name, gpu)
+
+    def active_account(self):
+        return {"name": self.name, "max_qubits": 200}
+
+def job_monitor(job, quiet=True):
+    pass
+
+def OptimizeQuantumCircuit(qc):
+    pass
+
+def open_stub_backend(config, backend_index, gpu_index):
+    """Drop-in backend_factory for benchmark_batch.run_batch: installs this module as the SDK and returns a StubBackend."""
+    import benchmark_circuit
+    benchmark_circuit.load_sdk(sys.modules[__name__])
+    return StubBackend(gpu=gpu_index)
@@ -0,0 +1,268 @@
+import os
+import sys
+sys.stdout.reconfigure(line_buffering=True) # Prevent buffering when running with nohup
+import json
+import math
+import zlib
+from pathlib import Path
+import numpy as np
+
+import benchmark_circuit
+from benchmark_circuit import DEFAULT_CONFIG, parse_optional_args, write_csv_line, now
+from benchmark_batch import load_circuit_list
+from tracing import Tracer
+
+TUNER_CONFIG = {
+    **DEFAULT_CONFIG,
+    "circuit_list": "circuit_list.json",
+    "fidelity_floor": "0.99",
+    "min_threshold": "16",
+    "max_threshold": "8192",
+    "tuning_report": "threshold_tuning.csv",
+    "write_circuit_list": "",
+    "synthetic": "0",
+}
+
+# Only these keys are needed with --synthetic=1, which never touches the SDK or the circuit files
+SYNTHETIC_REQUIRED_KEYS = ["results_path"]
+
+TUNING_FIELDNAMES = ["circuit_name", "threshold", "mirror_fidelity", "state_preparation_time", "mirror_fidelity_time", "final_state_memory", "meets_floor", "pareto", "chosen"]
+
+def print_usage(config):
+    print("Usage:")
+    print(f"  {config['python_bin']} {Path(__file__).name} <backend_index> <gpu_index> [circuit_file_name ...] [--key=value ...]\n")
+    print("Tunes every circuit of circuit_list if no circuit file is given.")
+    print("\nOptional config overrides:")
+    for key in TUNER_CONFIG:
+        print(f"  --{key}=<value> (default: {config[key]})")
+    sys.exit(1)
+
+def threshold_candidates(min_threshold, max_threshold):
+    """Powers of two between min_threshold and max_threshold."""
+    return [2 ** e for e in range(math.ceil(math.log2(min_threshold)), math.floor(math.log2(max_threshold)) + 1)]
+
+def tune_threshold(measure, fidelity_floor, candidates):
+    """
+    Finds the smallest candidate threshold whose mirror fidelity meets fidelity_floor.
+
+    Mirror fidelity is assumed to grow with the threshold. The largest candidate is measured
+    first and the search stops if it misses the floor; then the smallest, and the search
+    stops if it already meets the floor. Otherwise the candidates in between are bisected, so
+    at most 2 + log2(len(candidates)) thresholds are simulated.
+
+    Args:
+        measure (callable): measure(threshold) returns a dict with at least mirror_fidelity,
+            state_preparation_time and final_state_memory.
+        fidelity_floor (float): Lowest acceptable mirror fidelity.
+        candidates (list): Increasing thresholds, see threshold_candidates.
+
+    Returns:
+        tuple: (cheapest measured threshold that meets the floor or None, dict of measurements per threshold)
+    """
+    measurements = {}
+
+    def meets(i):
+        threshold = candidates[i]
+        if threshold not in measurements:
+            measurements[threshold] = measure(threshold)
+            print(f"Threshold {threshold}: mirror fidelity {measurements[threshold]['mirror_fidelity']}, "
+                  f"state preparation {measurements[threshold]['state_preparation_time']} seconds, "
+                  f"state {measurements[threshold]['final_state_memory']} MB")
+        return measurements[threshold]["mirror_fidelity"] >= fidelity_floor
+
+    lo, hi = 0, len(candidates) - 1
+    if not candidates or not meets(hi):
+        return None, measurements
+
+    if not meets(lo):
+        # Invariant: candidates[lo] misses the floor, candidates[hi] meets it
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if meets(mid):
+                hi = mid
+            else:
+                lo = mid
+
+    feasible = [t for t, m in measurements.items() if m["mirror_fidelity"] >= fidelity_floor]
+    return min(feasible, key=lambda t: (measurements[t]["state_preparation_time"], t)), measurements
+
+def pareto_front(measurements):
+    """
+    Thresholds whose measurement no other one beats in mirror fidelity, state preparation time
+    and state size at once.
+    """
+    thresholds = list(measurements)
+    points = np.array([[-measurements[t]["mirror_fidelity"], measurements[t]["state_preparation_time"], measurements[t]["final_state_memory"]] for t in thresholds], dtype=float)
+    if len(points) == 0:
+        return set()
+    # dominated[i, j]: point j is at least as good as point i everywhere and better somewhere
+    no_worse = np.all(points[None, :, :] <= points[:, None, :], axis=2)
+    better = np.any(points[None, :, :] < points[:, None, :], axis=2)
+    dominated = (no_worse & better).any(axis=1)
+    return {t for t, d in zip(thresholds, dominated.tolist()) if not d}
+
+def measure_threshold(config, backend, circuit_name, threshold):
+    """
+    Prepares the state of an already transpiled circuit at one threshold and runs its mirror circuit.
+
+    Returns:
+        dict: mirror_fidelity (-1 without a dagger), state_preparation_time, mirror_fidelity_time
+              and final_state_memory in MB.
+    """
+    stripped_circuit_name = Path(circuit_name).stem
+    handoff_file = benchmark_circuit.state_handoff_file(config, stripped_circuit_name)
+    # Not <circuit>.bin, which may hold the checkpoint of a benchmark run
+    disk_state_file = str(Path(config['system_state_path']) / f"{stripped_circuit_name}.tuner.{os.getpid()}.bin")
+    if config['state_handoff'] != "memory":
+        handoff_file = disk_state_file
+    # The tuner measures thresholds beyond memory_budget_mb on purpose, so only the state size is used
+    prediction = benchmark_circuit.predict_run({**config, 'memory_budget_mb': ""}, stripped_circuit_name, threshold)
+
+    qc1, _ = benchmark_circuit.load_circuit(config, config['transpiled_circuit_path'], stripped_circuit_name)
+    benchmark_circuit.OptimizeQuantumCircuit(qc1)
+
+    state_file = handoff_file
+    try:
+        start_time = now()
+        job = benchmark_circuit.run_job(backend, qc1, 1, threshold)
+        result = job.result()
+        state_preparation_time = now() - start_time
+
+        state_file = benchmark_circuit.save_handoff_state(result, handoff_file, disk_state_file, prediction)
+        final_state_memory = os.path.getsize(state_file)/1024/1024
+        result = None
+
+        mirror_fidelity = -1
+        mirror_fidelity_time = 0
+        if benchmark_circuit.transpiled_circuit_exists(config, config['transpiled_dagger_path'], stripped_circuit_name):
+            qc = benchmark_circuit.QuantumCircuit(simulation_state_file = state_file)
+            qc2, _ = benchmark_circuit.load_circuit(config, config['transpiled_dagger_path'], stripped_circuit_name)
+            qc.append(qc2)
+            start_time = now()
+            job = benchmark_circuit.run_job(backend, qc, 1, threshold)
+            mirror_fidelity = job.result().get_fidelity()
+            mirror_fidelity_time = now() - start_time
+    finally:
+        for temp_file in {handoff_file, state_file}:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    return {
+        "mirror_fidelity": mirror_fidelity,
+        "state_preparation_time": state_preparation_time,
+        "mirror_fidelity_time": mirror_fidelity_time,
+        "final_state_memory": final_state_memory,
+    }
+
+def synthetic_measure(circuit_name):
+    """
+    Synthetic stand-in for measure_threshold, for testing the search without a simulator.
+
+    Fidelity rises as 1 - exp(-threshold / scale) with a scale derived from the circuit name;
+    time and state size grow with the threshold.
+    """
+    scale = 32 * 2 ** (zlib.crc32(circuit_name.encode()) % 6)
+
+    def measure(threshold):
+        return {
+            "mirror_fidelity": 1 - math.exp(-threshold / scale),
+            "state_preparation_time": 0.01 * threshold * math.log2(threshold),
+            "mirror_fidelity_time": 0.02 * threshold * math.log2(threshold),
+            "final_state_memory": 0.016 * threshold,
+        }
+    return measure
+
+def write_circuit_list(circuit_list_file, output_file, chosen):
+    """Writes circuit_list_file to output_file with the thresholds of the tuned circuits replaced."""
+    with open(circuit_list_file, "r") as f:
+        circuit_list = json.load(f)
+    for item in circuit_list:
+        if chosen.get(item["name"]) is not None:
+            item["threshold"] = chosen[item["name"]]
+
+    temp_file = f"{output_file}.{os.getpid()}.tmp"
+    with open(temp_file, "w") as f:
+        f.write("[\n" + ",\n".join(f"  {{ {json.dumps(item)[1:-1]} }}" for item in circuit_list) + "\n]\n")
+    os.replace(temp_file, output_file)
+
+def main():
+    config = TUNER_CONFIG.copy()
+
+    positional_args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    optional_args = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+    config = parse_optional_args(config, optional_args)
+
+    if len(positional_args) < 2:
+        print("Error: Missing required arguments.\n")
+        print_usage(config)
+
+    synthetic = config['synthetic'] != "0"
+    missing_keys = [key for key, val in config.items() if val is None and key != "python_bin" and (not synthetic or key in SYNTHETIC_REQUIRED_KEYS)]
+    if missing_keys:
+        print("Error: Missing required config values.\n")
+        for key in missing_keys:
+            print(f"  --{key}=<value>  (currently missing)")
+        print("")
+        print_usage(config)
+
+    if not synthetic:
+        benchmark_circuit.validate_config(config, print_usage)
+
+    try:
+        backend_index = int(positional_args[0])
+        gpu_index = int(positional_args[1])
+        fidelity_floor = float(config['fidelity_floor'])
+        candidates = threshold_candidates(int(config['min_threshold']), int(config['max_threshold']))
+    except ValueError:
+        print("Error: Backend and GPU index, thresholds and fidelity floor must be numbers.\n")
+        print_usage(config)
+
+    circuits = positional_args[2:] or [f"{name}.json" for name, _ in load_circuit_list(config['circuit_list'])]
+    if not synthetic:
+        available = benchmark_circuit.list_circuit_files(config['pytket_circuit_path'])
+        for circuit_name in circuits:
+            if circuit_name not in available:
+                print(f"Error: Circuit file '{circuit_name}' not found in {config['pytket_circuit_path']}.\n")
+                print_usage(config)
+        backend = benchmark_circuit.open_backend(config, backend_index, gpu_index)
+
+    os.makedirs(config['results_path'], exist_ok=True)
+    tuning_report = Path(config['results_path']) / config['tuning_report']
+    write_csv_line(tuning_report, TUNING_FIELDNAMES, mode='w')
+
+    print(f"Tuning {len(circuits)} circuits over thresholds {candidates} for a mirror fidelity of at least {fidelity_floor}")
+
+    chosen = {}
+    for circuit_name in circuits:
+        stripped_circuit_name = Path(circuit_name).stem
+        print(f"\n{stripped_circuit_name}")
+
+        if synthetic:
+            measure = synthetic_measure(stripped_circuit_name)
+        else:
+            # One transpile (or transpile cache hit) is shared by every threshold tried
+            benchmark_circuit.transpile_step(config, circuit_name, Tracer().span)
+            measure = lambda threshold: measure_threshold(config, backend, circuit_name, threshold)
+
+        threshold, measurements = tune_threshold(measure, fidelity_floor, candidates)
+        chosen[stripped_circuit_name] = threshold
+        pareto = pareto_front(measurements)
+
+        for t in sorted(measurements):
+            m = measurements[t]
+            write_csv_line(tuning_report, [stripped_circuit_name, t, m["mirror_fidelity"], m["state_preparation_time"], m["mirror_fidelity_time"], m["final_state_memory"],
+                                           int(m["mirror_fidelity"] >= fidelity_floor), int(t in pareto), int(t == threshold)])
+
+        if threshold is None:
+            print(f"No threshold up to {candidates[-1] if candidates else config['max_threshold']} reaches a mirror fidelity of {fidelity_floor}")
+        else:
+            print(f"Chosen threshold: {threshold} ({len(measurements)} thresholds simulated, Pareto front {sorted(pareto)})")
+
+    print(f"\nTuning report written to {tuning_report}")
+
+    if config['write_circuit_list']:
+        write_circuit_list(config['circuit_list'], config['write_circuit_list'], chosen)
+        print(f"Circuit list with tuned thresholds written to {config['write_circuit_list']}")
+
+if __name__ == "__main__":
+    main()
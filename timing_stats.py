@@ -0,0 +1,43 @@
+import numpy as np
+
+# Tukey's fences: a value further than OUTLIER_FENCE * IQR outside the quartiles is an outlier
+OUTLIER_FENCE = 1.5
+
+STAT_FIELDNAMES = ["n", "min", "median", "q1", "q3", "iqr", "mean", "stdev", "max", "outliers"]
+
+def outlier_mask(values, fence=OUTLIER_FENCE):
+    """Returns a boolean array marking the values outside Tukey's fences of values."""
+    values = np.asarray(values, dtype=float)
+    if len(values) < 4:
+        return np.zeros(len(values), dtype=bool)
+    q1, q3 = np.percentile(values, [25, 75])
+    iqr = q3 - q1
+    return (values < q1 - fence * iqr) | (values > q3 + fence * iqr)
+
+def summarize(values):
+    """
+    Robust summary of repeated timings of one phase.
+
+    Args:
+        values (list): One timing per measured iteration, in seconds.
+
+    Returns:
+        dict: n, min, median, q1, q3, iqr, mean, stdev (sample standard deviation, 0 for a
+              single value), max and the number of outliers (see outlier_mask).
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return {field: 0 for field in STAT_FIELDNAMES}
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    return {
+        "n": len(values),
+        "min": float(values.min()),
+        "median": float(median),
+        "q1": float(q1),
+        "q3": float(q3),
+        "iqr": float(q3 - q1),
+        "mean": float(values.mean()),
+        "stdev": float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+        "max": float(values.max()),
+        "outliers": int(outlier_mask(values).sum()),
+    }
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+def current_rss_mb():
+    """Resident set size of this process in MB, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+def peak_rss_mb():
+    """High-water mark of the resident set size of this process in MB since the last reset_peak_rss, or None where /proc is not available."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def reset_peak_rss():
+    """Resets the high-water mark of peak_rss_mb to the current resident set size. Returns False where that is not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+class Span:
+    def __init__(self, name, parent, args):
+        self.name = name
+        self.parent = parent
+        self.args = args
+        self.start = None
+        self.duration = 0.0
+        self.cpu_time = 0.0
+        self.child_cpu_time = 0.0
+        self.rss_start_mb = None
+        self.rss_end_mb = None
+        self.peak_rss_mb = None
+        self.tid = None
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "parent": self.parent,
+            "start": self.start,
+            "duration": self.duration,
+            "cpu_time": self.cpu_time,
+            "child_cpu_time": self.child_cpu_time,
+            "rss_start_mb": self.rss_start_mb,
+            "rss_end_mb": self.rss_end_mb,
+            "peak_rss_mb": self.peak_rss_mb,
+            "args": self.args,
+        }
+
+class Tracer:
+    """
+    Records nested spans with wall time, CPU time and memory of the benchmark process.
+
+    Every finished span is appended to a JSON-lines file as it closes, so a trace survives a
+    crash. write_chrome_trace writes the same spans as Chrome trace events (chrome://tracing,
+    Perfetto). CPU time includes all threads of the process; child_cpu_time covers finished
+    subprocesses such as transpiles.
+
+    The peak memory of a span is the high-water mark of the resident set size during the
+    span. The process-wide mark is reset whenever a span starts or ends, after being folded
+    into every open span, so a span is not charged for the peaks of earlier spans or of
+    earlier circuits of a batch worker. Where the mark cannot be reset, the peak is the
+    larger of the resident memory at start and end.
+    """
+
+    def __init__(self, jsonl_file=None):
+        self.spans = []
+        self.stack = []
+        self.origin = time.time()
+        self.origin_counter = time.perf_counter()
+        self.jsonl = open(jsonl_file, "w") if jsonl_file else None
+        self.pid = os.getpid()
+        self.peak_resettable = reset_peak_rss()
+
+    def sample_peak(self):
+        """Folds the high-water mark since the last reset into every open span and resets it."""
+        if not self.peak_resettable:
+            return
+        peak = peak_rss_mb()
+        if peak is not None:
+            for span in self.stack:
+                span.peak_rss_mb = max(span.peak_rss_mb or 0, peak)
+        reset_peak_rss()
+
+    @contextmanager
+    def span(self, name, **args):
+        span = Span(name, self.stack[-1].name if self.stack else None, args)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.sample_peak()
+        span.rss_start_mb = current_rss_mb()
+        start_cpu = time.process_time()
+        start_counter = time.perf_counter()
+        span.start = start_counter - self.origin_counter
+        span.tid = threading.get_ident()
+
+        self.stack.append(span)
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - start_counter
+            span.cpu_time = time.process_time() - start_cpu
+            children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+            span.child_cpu_time = (children_end.ru_utime + children_end.ru_stime) - (children.ru_utime + children.ru_stime)
+            span.rss_end_mb = current_rss_mb()
+            self.sample_peak()
+            span.peak_rss_mb = max(span.peak_rss_mb or 0, span.rss_start_mb or 0, span.rss_end_mb or 0)
+            self.stack.pop()
+            self.spans.append(span)
+            if self.jsonl:
+                self.jsonl.write(json.dumps(span.to_dict()) + "\n")
+                self.jsonl.flush()
+
+    def abort(self):
+        """
+        Finishes the spans that are still open, innermost first, with args unfinished=True, and
+        closes the trace. For a process that is about to exit without unwinding its spans.
+        """
+        now = time.perf_counter() - self.origin_counter
+        while self.stack:
+            span = self.stack.pop()
+            span.duration = now - span.start
+            span.rss_end_mb = current_rss_mb()
+            span.peak_rss_mb = max(span.peak_rss_mb or 0, peak_rss_mb() or 0, span.rss_end_mb or 0)
+            span.args = {**span.args, "unfinished": True}
+            self.spans.append(span)
+            if self.jsonl:
+                self.jsonl.write(json.dumps(span.to_dict()) + "\n")
+        self.close()
+
+    def duration(self, name):
+        """Total wall time of all finished spans called name."""
+        return sum(span.duration for span in self.spans if span.name == name)
+
+    def write_chrome_trace(self, trace_file):
+        events = []
+        for span in self.spans:
+            events.append({
+                "name": span.name,
+                "ph": "X",
+                "ts": span.start * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": self.pid,
+                "tid": span.tid,
+                "args": {key: value for key, value in span.to_dict().items() if key not in ("name", "start", "duration", "args")} | span.args,
+            })
+            if span.rss_end_mb is not None:
+                events.append({"name": "rss_mb", "ph": "C", "ts": (span.start + span.duration) * 1e6, "pid": self.pid, "args": {"rss_mb": span.rss_end_mb}})
+        with open(trace_file, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"start_time": self.origin}}, f)
+
+    def close(self):
+        if self.jsonl:
+            self.jsonl.close()
+            self.jsonl = None
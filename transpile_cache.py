@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import subprocess
+import importlib.metadata
+from pathlib import Path
+from collections import Counter
+from functools import lru_cache
+
+TRANSPILER_PACKAGES = ["qiskit", "pytket", "pytket-qiskit"]
+
+QASM_NON_GATE_STATEMENTS = {"OPENQASM", "include", "qreg", "creg", "barrier", "measure", "reset", "gate", "opaque", "if"}
+
+def file_digest(filename):
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+@lru_cache(maxsize=None)
+def transpiler_versions(python_bin):
+    """
+    Returns the installed versions of the transpiler packages for the interpreter that runs the transpile script.
+
+    The versions are read from package metadata, so neither qiskit nor pytket is imported.
+    """
+    resolved = shutil.which(python_bin)
+    if resolved and os.path.realpath(resolved) == os.path.realpath(sys.executable):
+        versions = {}
+        for package in TRANSPILER_PACKAGES:
+            try:
+                versions[package] = importlib.metadata.version(package)
+            except importlib.metadata.PackageNotFoundError:
+                versions[package] = None
+        return versions
+
+    script = (
+        "import importlib.metadata, json\n"
+        "versions = {}\n"
+        f"for package in {TRANSPILER_PACKAGES!r}:\n"
+        "    try:\n"
+        "        versions[package] = importlib.metadata.version(package)\n"
+        "    except importlib.metadata.PackageNotFoundError:\n"
+        "        versions[package] = None\n"
+        "print(json.dumps(versions))\n"
+    )
+    result = subprocess.run([python_bin, "-c", script], capture_output=True, text=True)
+    if result.returncode != 0:
+        return {package: None for package in TRANSPILER_PACKAGES}
+    return json.loads(result.stdout)
+
+def transpile_cache_key(json_file, transpile_script, python_bin, formats, preset):
+    """
+    Content address of one transpile.
+
+    The key covers the input circuit JSON, the transpile script and the pass preset (which
+    together define the pass pipeline), the qiskit/pytket versions and the output formats.
+    """
+    key = {
+        "input": file_digest(json_file),
+        "pipeline": file_digest(transpile_script),
+        "preset": preset,
+        "versions": transpiler_versions(python_bin),
+        "formats": sorted(formats),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def qasm_gate_counts(qasm_file):
+    counts = Counter()
+    with open(qasm_file, "r") as f:
+        for line in f:
+            statement = line.strip()
+            if not statement or statement.startswith("//"):
+                continue
+            gate = statement.split("(", 1)[0].split(None, 1)[0].rstrip(";")
+            if gate not in QASM_NON_GATE_STATEMENTS:
+                counts[gate] += 1
+    return dict(counts)
+
+class TranspileCache:
+    """
+    Size-bounded, least-recently-used cache of transpiled circuits.
+
+    Every entry is a directory named after its key holding one circuit.<format> file per
+    output format (qasm, gates) and meta.json. The mtime of meta.json is the entry's last use.
+    Entries are published with a directory rename, so several benchmark processes can share one cache.
+    """
+
+    def __init__(self, cache_dir, max_size_mb):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = float(max_size_mb) * 1024 * 1024
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key, output_files):
+        """
+        Copies the cached files to output_files and returns the entry metadata, or None on a miss.
+
+        Args:
+            key (str): Key from transpile_cache_key.
+            output_files (dict): Destination path per output format, e.g. {"qasm": "out/bell.qasm"}.
+        """
+        entry = self.cache_dir / key
+        meta_file = entry / "meta.json"
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+            for fmt, output_file in output_files.items():
+                shutil.copyfile(entry / f"circuit.{fmt}", output_file)
+            os.utime(meta_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return meta
+
+    def put(self, key, output_files, circuit_name, gate_counts, passes=None):
+        """
+        Stores output_files under key, evicts old entries if needed and returns the entry metadata.
+
+        passes is the pass report of the transpile, returned again on every hit.
+        """
+        meta = {
+            "circuit_name": circuit_name,
+            "gate_counts": gate_counts,
+            "passes": passes,
+            "size": sum(os.path.getsize(output_file) for output_file in output_files.values()),
+            "created": time.time(),
+        }
+
+        staging = self.cache_dir / f".{key}.{os.getpid()}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir()
+        for fmt, output_file in output_files.items():
+            shutil.copyfile(output_file, staging / f"circuit.{fmt}")
+        with open(staging / "meta.json", "w") as f:
+            json.dump(meta, f, indent=2)
+
+        try:
+            os.rename(staging, self.cache_dir / key)
+        except OSError:
+            # Another process published the same key first
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict()
+        return meta
+
+    def entries(self):
+        entries = []
+        for entry in self.cache_dir.iterdir():
+            meta_file = entry / "meta.json"
+            if entry.name.startswith(".") or not meta_file.exists():
+                continue
+            try:
+                with open(meta_file, "r") as f:
+                    meta = json.load(f)
+                last_used = meta_file.stat().st_mtime
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            entries.append((last_used, entry, meta))
+        return sorted(entries, key=lambda e: e[0])
+
+    def evict(self):
+        entries = self.entries()
+        total_size = sum(meta["size"] for _, _, meta in entries)
+        for _, entry, meta in entries:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= meta["size"]
+
+    def invalidate(self, circuit_name=None):
+        """Removes all entries, or only those of circuit_name. Returns the number of removed entries."""
+        removed = 0
+        for _, entry, meta in self.entries():
+            if circuit_name is None or meta["circuit_name"] == circuit_name:
+                shutil.rmtree(entry, ignore_errors=True)
+                removed += 1
+        return removed
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the transpile cache.")
+    parser.add_argument("command", choices=["list", "invalidate"],
+                        help="'list' shows the cached entries, 'invalidate' removes them.")
+    parser.add_argument("cache_dir", type=str,
+                        help="The transpile cache directory.")
+    parser.add_argument("circuit_name", type=str, nargs="?", default=None,
+                        help="Only invalidate entries of this circuit (e.g., 'bell_state'). All entries if omitted.")
+
+    args = parser.parse_args()
+
+    cache = TranspileCache(args.cache_dir, float("inf"))
+    if args.command == "list":
+        for last_used, entry, meta in cache.entries():
+            print(f"{entry.name[:16]}  {meta['circuit_name']}  {meta['size'] / 1024 / 1024:.2f} MB  last used {time.ctime(last_used)}")
+    else:
+        removed = cache.invalidate(args.circuit_name)
+        print(f"Removed {removed} cache entries")
@@ -1,25 +1,110 @@
 import os
+import sys
 from os import listdir
+import io
+import csv
+import time
+import contextlib
+import threading
+import traceback
+import multiprocessing as mp
+from multiprocessing.connection import Listener, Client
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import qiskit
 from qiskit import transpile
 
 import json
+import numpy as np
 from pytket.circuit import Circuit
 
 from pytket.extensions.qiskit import tk_to_qiskit
 from pytket.passes import FullPeepholeOptimise, SequencePass, RemoveRedundancies
 from pytket.passes import DecomposeBoxes
 
-def transpile_pytket_json( circuit_name, json_path, output_path ):
+from gate_ir import OPCODE, GATE_DTYPE, write_gate_file
+
+# Optimisation pass presets, from cheapest to most thorough. Every preset flattens the boxes first
+# and ends with the qiskit transpile to the u3/cx/h/x basis at its optimization_level.
+# "light" is the pipeline this script always ran before presets existed.
+PASS_PRESETS = {
+    "none": {"pytket": [], "optimization_level": 0},
+    "light": {"pytket": [], "optimization_level": 3},
+    "peephole": {"pytket": ["FullPeepholeOptimise", "RemoveRedundancies"], "optimization_level": 1},
+    "full": {"pytket": ["FullPeepholeOptimise", "RemoveRedundancies"], "optimization_level": 3},
+}
+DEFAULT_PRESET = "light"
+
+PYTKET_PASSES = {"FullPeepholeOptimise": FullPeepholeOptimise, "RemoveRedundancies": RemoveRedundancies}
+
+PASS_FIELDNAMES = ["preset", "pass", "time", "gates_before", "gates_after", "two_qubit_before", "two_qubit_after"]
+
+NON_GATES = {"measure", "barrier", "reset"}
+
+def count_gates(operations):
+    """Gate and two-qubit gate counts of (name, number of qubits) pairs, without measurements and barriers."""
+    gates = 0
+    two_qubit = 0
+    for name, num_qubits in operations:
+        if name.lower() in NON_GATES:
+            continue
+        gates += 1
+        two_qubit += num_qubits >= 2
+    return gates, two_qubit
+
+def tket_counts(circuit):
+    return count_gates((command.op.type.name, len(command.qubits)) for command in circuit.get_commands())
+
+def qiskit_counts(qc):
+    return count_gates((instruction.operation.name, len(instruction.qubits)) for instruction in qc.data)
+
+def pass_report_file(output_path, circuit_name):
+    return os.path.join(output_path, circuit_name + ".passes.json")
+
+def qiskit_to_gates(qc):
+    """Converts a transpiled qiskit circuit to a gate_ir array. Barriers are dropped."""
+    records = []
+    for instruction in qc.data:
+        name = instruction.operation.name
+        if name == "barrier":
+            continue
+        if name not in OPCODE:
+            raise ValueError(f"Gate '{name}' has no gate_ir opcode")
+
+        q0 = qc.find_bit(instruction.qubits[0]).index
+        if name == "measure":
+            q1 = qc.find_bit(instruction.clbits[0]).index
+        elif len(instruction.qubits) > 1:
+            q1 = qc.find_bit(instruction.qubits[1]).index
+        else:
+            q1 = -1
+        params = [float(p) for p in instruction.operation.params] + [0.0] * (3 - len(instruction.operation.params))
+        records.append((OPCODE[name], q0, q1, params))
+
+    return np.array(records, dtype=GATE_DTYPE)
+
+def transpile_pytket_json( circuit_name, json_path, output_path, formats=("qasm",), preset=DEFAULT_PRESET ):
+    """
+    Transpiles <json_path>/<circuit_name>.json with the passes of preset.
+
+    Every pass is timed and its gate and two-qubit gate counts before and after are written,
+    with the preset, to <output_path>/<circuit_name>.passes.json.
+
+    Returns:
+        list: One PASS_FIELDNAMES dict per pass.
+    """
     print (f"Transpiling circuit: {circuit_name}")
     print (f"Input path: {json_path}")
     print (f"Output path: {output_path}")
     
     json_file = os.path.join(json_path, circuit_name + ".json")
     output_file = os.path.join(output_path, circuit_name + ".qasm")
+    gate_file = os.path.join(output_path, circuit_name + ".gates")
 
-    print(f"TranspilingPyTketJson. Input file: {json_file} Output file: {output_file}")
+    output_files = [os.path.join(output_path, f"{circuit_name}.{fmt}") for fmt in formats]
+
+    print(f"TranspilingPyTketJson. Input file: {json_file} Output files: {output_files}")
 
     # Load the JSON data
     with open(json_file, 'r') as f:
@@ -28,36 +113,220 @@ def transpile_pytket_json( circuit_name, json_path, output_path ):
     # Create a Circuit object from the JSON dictionary
     tket_circ = Circuit.from_dict(circuit_json)
 
+    passes = PASS_PRESETS[preset]
+    report = []
+
+    def timed(name, apply, circuit, counts_before, counts_after):
+        gates_before, two_qubit_before = counts_before(circuit)
+        start_time = time.perf_counter()
+        circuit = apply(circuit)
+        elapsed = time.perf_counter() - start_time
+        gates_after, two_qubit_after = counts_after(circuit)
+        report.append({"preset": preset, "pass": name, "time": elapsed, "gates_before": gates_before, "gates_after": gates_after,
+                       "two_qubit_before": two_qubit_before, "two_qubit_after": two_qubit_after})
+        print(f"{name}: {elapsed:.3f}s, gates {gates_before} -> {gates_after}, two-qubit gates {two_qubit_before} -> {two_qubit_after}")
+        return circuit
+
+    def pytket_pass(opt_pass):
+        def apply(circuit):
+            opt_pass.apply(circuit)
+            return circuit
+        return apply
+
     # Remove the PauliExpBoxes and flatten the circuit
-    DecomposeBoxes().apply(tket_circ)
+    tket_circ = timed("DecomposeBoxes", pytket_pass(DecomposeBoxes()), tket_circ, tket_counts, tket_counts)
 
     # Optimize the circuit
-    #opt_pass = SequencePass([FullPeepholeOptimise(), RemoveRedundancies()])
-
-    # Apply optimizations to the circuit
-    #opt_pass.apply(tket_circ)
+    for name in passes["pytket"]:
+        tket_circ = timed(name, pytket_pass(PYTKET_PASSES[name]()), tket_circ, tket_counts, tket_counts)
 
     # Convert to Qiskit circuit
-    opt_qiskit_circ = tk_to_qiskit(tket_circ, replace_implicit_swaps = True, perm_warning=True)
+    opt_qiskit_circ = timed("tk_to_qiskit", lambda c: tk_to_qiskit(c, replace_implicit_swaps = True, perm_warning=True), tket_circ, tket_counts, qiskit_counts)
 
     # get rid of complex arithmetic expressions in the gate instructions and convert V or Vdg (if any) to simpler gates
-    qc = transpile(opt_qiskit_circ, basis_gates=['u3', 'cx', 'h', 'x'], optimization_level=3)
+    level = passes["optimization_level"]
+    qc = timed(f"qiskit optimization_level={level}", lambda c: transpile(c, basis_gates=['u3', 'cx', 'h', 'x'], optimization_level=level),
+               opt_qiskit_circ, qiskit_counts, qiskit_counts)
+
+    # Every output is written to a temporary file and renamed, so a benchmark that gave up
+    # waiting for this transpile and ran its own never reads a half-written file
+    if "qasm" in formats:
+        temp_file = f"{output_file}.{os.getpid()}.tmp"
+        qiskit.qasm2.dump(qc, temp_file)
+        os.replace(temp_file, output_file)
+
+    # Export the binary gate list read by benchmark_circuit.py
+    if "gates" in formats:
+        write_gate_file(gate_file, qiskit_to_gates(qc), qc.num_qubits, qc.num_clbits)
 
-    # Export to QASM
-    qiskit.qasm2.dump(qc, output_file)
+    report_file = pass_report_file(output_path, circuit_name)
+    temp_file = f"{report_file}.{os.getpid()}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump({"preset": preset, "passes": report}, f, indent=2)
+    os.replace(temp_file, report_file)
 
     print("Done")
+    return report
+
+def transpile_job(circuit_name, json_path, output_path, formats, preset=DEFAULT_PRESET):
+    """
+    Runs transpile_pytket_json in a server or preset worker and returns what the script would have printed.
+
+    Returns:
+        dict: returncode, stdout and stderr, as a subprocess run of this script would report them.
+    """
+    stdout = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(stdout):
+            transpile_pytket_json(circuit_name, json_path, output_path, formats, preset)
+    except Exception:
+        return {"returncode": 1, "stdout": stdout.getvalue(), "stderr": traceback.format_exc()}
+    return {"returncode": 0, "stdout": stdout.getvalue(), "stderr": ""}
+
+def transpile_all_presets(circuit_name, json_path, output_path, formats, workers=None):
+    """
+    Transpiles one circuit under every preset in parallel, each into <output_path>/<preset>/.
+
+    Every preset runs in its own spawned process, so a crashing pass only fails its preset.
+    The passes of all presets are written to <output_path>/<circuit_name>.presets.csv.
+
+    Returns:
+        dict: The job result (returncode, stdout, stderr) per preset.
+    """
+    with ProcessPoolExecutor(max_workers=workers or len(PASS_PRESETS), mp_context=mp.get_context("spawn")) as pool:
+        futures = {}
+        for preset in PASS_PRESETS:
+            preset_path = os.path.join(output_path, preset)
+            os.makedirs(preset_path, exist_ok=True)
+            futures[preset] = pool.submit(transpile_job, circuit_name, json_path, preset_path, formats, preset)
+        results = {}
+        for preset, future in futures.items():
+            try:
+                results[preset] = future.result()
+            except BrokenProcessPool:
+                results[preset] = {"returncode": 1, "stdout": "", "stderr": f"Transpile worker crashed under preset {preset}"}
+
+    presets_file = os.path.join(output_path, circuit_name + ".presets.csv")
+    with open(presets_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=PASS_FIELDNAMES)
+        writer.writeheader()
+        print(f"{'preset':<10} {'time':>10} {'gates':>10} {'two-qubit':>10}")
+        for preset, result in results.items():
+            if result["returncode"] != 0:
+                print(f"{preset:<10} failed:\n{result['stderr']}")
+                continue
+            with open(pass_report_file(os.path.join(output_path, preset), circuit_name), "r") as report_file:
+                report = json.load(report_file)["passes"]
+            writer.writerows(report)
+            print(f"{preset:<10} {sum(p['time'] for p in report):>9.3f}s {report[-1]['gates_after']:>10} {report[-1]['two_qubit_after']:>10}")
+    print(f"Pass report of all presets written to {presets_file}")
+    return results
+
+def warm_up():
+    return os.getpid()
+
+class TranspileServer:
+    """
+    Long-lived transpile service listening on a Unix socket.
+
+    Transpiles run in a pool of spawned worker processes that keep qiskit and pytket
+    imported, so a crashing transpile takes down a pool worker and never the caller.
+    Every connection is served on its own thread, so the original and dagger circuit
+    of a benchmark run are transpiled concurrently.
+
+    A request is one JSON message {"circuit_name", "source_folder", "dest_folder", "formats", "preset"} and is
+    answered with {"returncode", "stdout", "stderr"}. {"command": "shutdown"} stops the server.
+    """
+
+    def __init__(self, socket_path, workers):
+        self.socket_path = socket_path
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.pool = self.start_pool()
+        self.stopped = threading.Event()
+
+    def start_pool(self):
+        pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context("spawn"))
+        # Start every worker now so the first requests don't pay the qiskit/pytket import
+        for future in [pool.submit(warm_up) for _ in range(self.workers)]:
+            future.result()
+        return pool
+
+    def submit(self, request):
+        with self.lock:
+            pool = self.pool
+        try:
+            return pool.submit(transpile_job, request["circuit_name"], request["source_folder"], request["dest_folder"], request.get("formats", ["qasm"]),
+                               request.get("preset", DEFAULT_PRESET)).result()
+        except BrokenProcessPool:
+            with self.lock:
+                if self.pool is pool:
+                    print("A transpile worker crashed, restarting the pool")
+                    self.pool = self.start_pool()
+            return {"returncode": 1, "stdout": "", "stderr": f"Transpile worker crashed while transpiling {request['circuit_name']}"}
+
+    def handle(self, conn):
+        with conn:
+            try:
+                request = json.loads(conn.recv_bytes())
+            except (EOFError, json.JSONDecodeError):
+                return
+            if request.get("command") == "shutdown":
+                conn.send_bytes(json.dumps({"returncode": 0, "stdout": "", "stderr": ""}).encode())
+                self.stopped.set()
+                # Wake up the accept() in serve_forever so it sees the stop flag
+                Client(self.socket_path, family="AF_UNIX").close()
+                return
+            print(f"Transpile request: {request.get('circuit_name')} from {request.get('source_folder')}")
+            conn.send_bytes(json.dumps(self.submit(request)).encode())
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.listener = Listener(self.socket_path, family="AF_UNIX")
+        print(f"Transpile server listening on {self.socket_path} with {self.workers} workers")
+        try:
+            while True:
+                conn = self.listener.accept()
+                if self.stopped.is_set():
+                    conn.close()
+                    break
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        finally:
+            self.listener.close()
+            self.pool.shutdown(cancel_futures=True)
+            print("Transpile server stopped")
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(description="Transpile a PyTket JSON circuit.")
-    parser.add_argument("circuit_name", type=str,
+    parser.add_argument("circuit_name", type=str, nargs="?",
                         help="The name of the circuit (e.g., 'bell_state').")
-    parser.add_argument("source_folder", type=str,
+    parser.add_argument("source_folder", type=str, nargs="?",
                         help="The path to the folder containing the source circuit files.")
-    parser.add_argument("dest_folder", type=str,
+    parser.add_argument("dest_folder", type=str, nargs="?",
                         help="The path to the folder where transpiled circuits will be saved.")
+    parser.add_argument("--format", type=str, choices=["qasm", "gates", "both"], default="qasm",
+                        help="Write the transpiled circuit as QASM, as a binary gate file, or both.")
+    parser.add_argument("--preset", type=str, choices=list(PASS_PRESETS), default=DEFAULT_PRESET,
+                        help="Optimisation pass preset: none, light (default), peephole or full.")
+    parser.add_argument("--all-presets", action="store_true",
+                        help="Transpile the circuit under every preset in parallel, into <dest_folder>/<preset>/, and compare them.")
+    parser.add_argument("--serve", type=str, metavar="SOCKET_PATH",
+                        help="Run as a transpile server listening on this Unix socket instead.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of transpile worker processes of the server (default 2) or of --all-presets (default one per preset).")
 
     args = parser.parse_args()
 
-    transpile_pytket_json(args.circuit_name, args.source_folder, args.dest_folder)
+    if args.serve:
+        sys.stdout.reconfigure(line_buffering=True) # Prevent buffering when running with nohup
+        TranspileServer(args.serve, args.workers or 2).serve_forever()
+    else:
+        if args.dest_folder is None:
+            parser.error("circuit_name, source_folder and dest_folder are required")
+        formats = ["qasm", "gates"] if args.format == "both" else [args.format]
+        if args.all_presets:
+            results = transpile_all_presets(args.circuit_name, args.source_folder, args.dest_folder, formats, args.workers)
+            sys.exit(0 if all(result["returncode"] == 0 for result in results.values()) else 1)
+        transpile_pytket_json(args.circuit_name, args.source_folder, args.dest_folder, formats, args.preset)
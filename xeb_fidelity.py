@@ -0,0 +1,112 @@
+import math
+import time
+import numpy as np
+
+from shot_stream import outcome_keys
+
+# Slack for rounding in the probabilities reported by the backend
+PROBABILITY_TOLERANCE = 1e-6
+
+def sample_indices(total_shots, count, seed=0):
+    """Sorted indices of count shots drawn without replacement from total_shots, all of them if count >= total_shots."""
+    if count >= total_shots:
+        return np.arange(total_shots)
+    return np.sort(np.random.default_rng(seed).choice(total_shots, size=count, replace=False))
+
+def distinct_outcomes(bits):
+    """
+    Groups sampled shots by outcome.
+
+    Returns:
+        tuple: ((outcomes, num_qubits) array with one row per distinct outcome,
+                index of the outcome of every shot).
+    """
+    _, first, inverse = np.unique(outcome_keys(bits), return_index=True, return_inverse=True)
+    return bits[first], inverse.reshape(-1)
+
+def check_probabilities(probabilities):
+    """
+    Raises ValueError unless probabilities can be the probabilities of distinct outcomes:
+    each in [0, 1] and summing to at most 1.
+    """
+    if not np.all(np.isfinite(probabilities)) or np.any(probabilities < -PROBABILITY_TOLERANCE) \
+            or np.any(probabilities > 1 + PROBABILITY_TOLERANCE):
+        raise ValueError("outcome probabilities outside [0, 1]")
+    if probabilities.sum() > 1 + PROBABILITY_TOLERANCE * len(probabilities):
+        raise ValueError(f"the probabilities of {len(probabilities)} distinct outcomes sum to {probabilities.sum():.4g} > 1")
+
+def linear_xeb(probabilities, num_qubits):
+    """
+    Linear cross-entropy score 2^n * mean(p(x)) - 1 of sampled outcomes x and its standard error.
+
+    Args:
+        probabilities (array): Reference probability of the outcome of every shot.
+        num_qubits (int): n.
+    """
+    scaled = np.ldexp(np.asarray(probabilities, dtype=np.float64), num_qubits)
+    shots = len(scaled)
+    mean = float(scaled.mean())
+    variance = float(scaled.var(ddof=1)) if shots > 1 else 0.0
+    return mean - 1.0, math.sqrt(variance / shots)
+
+def estimate_fidelity(bits, reference_bits, probability, now=time.perf_counter):
+    """
+    Estimates the fidelity of a simulated state to a reference state by normalized linear cross-entropy.
+
+    bits are shots of the simulated state, reference_bits shots of an independent, more
+    accurate simulation of the same circuit, and probability gives the reference probabilities
+    p. The estimate is (2^n * mean p(bits) - 1) / (2^n * mean p(reference_bits) - 1). If the
+    simulated output is the reference output mixed with white noise of weight 1 - F, this is F
+    for any circuit, not only random ones. It is not clipped, so noise can take it slightly
+    outside [0, 1]. It is NaN if the reference output is indistinguishable from uniform (the
+    denominator is not positive) or if probability does not return probabilities.
+
+    The probability of every distinct outcome of both samples is computed once.
+
+    Args:
+        bits (np.ndarray): (shots, num_qubits) shots of the simulated state, column k holding qubit k.
+        reference_bits (np.ndarray): (shots, num_qubits) shots of the reference state.
+        probability (callable): Maps an (outcomes, num_qubits) array of outcomes to their reference probabilities.
+        now (callable): Clock for the cost report.
+
+    Returns:
+        dict: fidelity_estimate and its std_error, the xeb scores of both samples and their
+              standard errors, the shots and distinct outcomes used, the cost (probability
+              evaluations and time in seconds), and the error that made the estimate NaN.
+    """
+    start_time = now()
+    num_qubits = bits.shape[1]
+    outcomes, inverse = distinct_outcomes(np.concatenate([bits, reference_bits]))
+    probabilities = np.asarray(probability(outcomes), dtype=np.float64)
+
+    estimate, std_error = float("nan"), float("nan")
+    xeb, xeb_error, reference_xeb, reference_xeb_error = (float("nan"),) * 4
+    error = ""
+    try:
+        check_probabilities(probabilities)
+        xeb, xeb_error = linear_xeb(probabilities[inverse[:len(bits)]], num_qubits)
+        reference_xeb, reference_xeb_error = linear_xeb(probabilities[inverse[len(bits):]], num_qubits)
+        if reference_xeb <= 0:
+            raise ValueError(f"the reference output is indistinguishable from uniform (xeb {reference_xeb:.4g})")
+        estimate = xeb / reference_xeb
+        # Delta method for the ratio of two independent means
+        std_error = math.sqrt(xeb_error ** 2 + (estimate * reference_xeb_error) ** 2) / reference_xeb
+    except ValueError as e:
+        error = str(e)
+
+    elapsed = now() - start_time
+    return {
+        "fidelity_estimate": estimate,
+        "std_error": std_error,
+        "xeb": xeb,
+        "xeb_std_error": xeb_error,
+        "reference_xeb": reference_xeb,
+        "reference_xeb_std_error": reference_xeb_error,
+        "shots": int(bits.shape[0]),
+        "reference_shots": int(reference_bits.shape[0]),
+        "distinct_outcomes": len(outcomes),
+        "evaluations": len(outcomes),
+        "time": elapsed,
+        "time_per_evaluation": elapsed / max(len(outcomes), 1),
+        "error": error,
+    }